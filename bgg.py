@@ -1,19 +1,46 @@
 import logging
-from boardgamegeek import BGGClient, BGGRestrictSearchResultsTo
 
 import discord
 import sys
 from discord.ext import commands
 
 from functools import lru_cache
+from startup import lazy_import
+from metrics import metrics
+from tracing import tracer
+
+boardgamegeek = lazy_import("boardgamegeek")
 
 logger = logging.getLogger("boardgame.helper.bgg")
 
+BGG_API_URL = "https://www.boardgamegeek.com/xmlapi2"
+api_url = BGG_API_URL
+
+
+def bgg_client(url: str | None = None, **kwargs) -> "boardgamegeek.BGGClient":
+    kwargs.setdefault("timeout", 10)
+    client = boardgamegeek.BGGClient(**kwargs)
+    url = (url or api_url).rstrip("/")
+    if url != BGG_API_URL:
+        # BGGClient always talks to boardgamegeek.com, repoint the endpoints it uses
+        for endpoint in ("search", "thing", "guild", "user", "plays", "hot", "collection"):
+            setattr(client, f"_{endpoint}_api_url", f"{url}/{endpoint}")
+        client.requests_session.mount(url, boardgamegeek.utils.RateLimitingAdapter(
+            rpm=kwargs.get("requests_per_minute", boardgamegeek.utils.DEFAULT_REQUESTS_PER_MINUTE)))
+    return client
+
+
 class BGGCog(commands.Cog, name="BGG"):
     
     def __init__(self, bot):
         self.bot = bot
-        self._bgg = BGGClient(timeout=10)
+        self._client = None
+
+    @property
+    def _bgg(self):
+        if self._client is None:
+            self._client = bgg_client()
+        return self._client
 
     @staticmethod
     def game_path(game):
@@ -22,11 +49,13 @@ class BGGCog(commands.Cog, name="BGG"):
     @lru_cache(maxsize=128)
     def fetch_game(self, name=None, id=None):
         if id:
-            return [self._bgg.game(game_id=id)]
+            with metrics.timer("bgg_request_seconds", endpoint="thing"), tracer.span("bgg.thing"):
+                return [self._bgg.game(game_id=id)]
         if name:
-            search = self._bgg.search(
-                 name,search_type=[BGGRestrictSearchResultsTo.BOARD_GAME, BGGRestrictSearchResultsTo.BOARD_GAME_EXPANSION]
-                 )
+            with metrics.timer("bgg_request_seconds", endpoint="search"), tracer.span("bgg.search"):
+                search = self._bgg.search(
+                     name,search_type=[boardgamegeek.BGGRestrictSearchResultsTo.BOARD_GAME, boardgamegeek.BGGRestrictSearchResultsTo.BOARD_GAME_EXPANSION]
+                     )
             
             logger.info("found %d games for search %s", len(search), name)
 
@@ -34,7 +63,8 @@ class BGGCog(commands.Cog, name="BGG"):
             games = []
 
             for group in [ids[i:i + 20] for i in range(0, len(ids), 20)]:
-                games.extend(self._bgg.game_list(group))
+                with metrics.timer("bgg_request_seconds", endpoint="thing_list"), tracer.span("bgg.thing_list"):
+                    games.extend(self._bgg.game_list(group))
 
             return sorted(games, key=lambda g: g.boardgame_rank or sys.maxsize)
 
@@ -44,7 +74,8 @@ class BGGCog(commands.Cog, name="BGG"):
         user = ctx.author
 
         logger.info(f"Looking up game '{game_name}' for user {user.id}")
-        await ctx.defer()
+        with tracer.span("defer"):
+            await ctx.defer()
 
         games = []
         if game_name.isdigit():
@@ -0,0 +1,187 @@
+"""Benchmarks game lookups against the local BGG stub.
+
+Measures end-to-end `Meetup.lookup` and `BGGCog.fetch_game` latency, how
+lookups scale with parallelism and how well the lookup cache absorbs a skewed
+workload, without touching boardgamegeek.com:
+
+    python bggbench.py --games 2000 --latency-ms 50-150 --concurrency 1,4,16
+    python bggbench.py --fixtures fixtures/bgg --queued 0.1 --errors 0.02
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from cashews import cache
+
+import bggstub
+from bgg import BGGCog, bgg_client
+from meetup import Meetup
+from metrics import metrics
+
+logger = logging.getLogger("boardgame.helper.bggbench")
+
+
+def summary(values: list[float]) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    q = statistics.quantiles(values, n=100, method="inclusive") if len(values) > 1 else values * 99
+    return {"count": len(values), "p50_ms": round(q[49] * 1000, 1), "p95_ms": round(q[94] * 1000, 1),
+            "p99_ms": round(q[98] * 1000, 1), "max_ms": round(values[-1] * 1000, 1)}
+
+
+class Benchmark:
+    def __init__(self, args, stub: bggstub.BGGStub, url: str):
+        self.args = args
+        self.stub = stub
+        self.rng = random.Random(args.seed)
+        self.client = bgg_client(url, cache=self.http_cache(), retries=args.retries, retry_delay=args.retry_delay,
+                                 requests_per_minute=args.rpm)
+        self.cog = Meetup(None, None, bgg=self.client)
+
+        names = sorted({name for name, *_ in stub.fixtures.names})
+        self.queries = args.query or self.rng.sample(names, min(args.queries, len(names)))
+
+    def http_cache(self):
+        from boardgamegeek.cache import CacheBackendMemory, CacheBackendNone
+
+        return CacheBackendMemory(ttl=3600) if self.args.http_cache else CacheBackendNone()
+
+    def requests(self) -> int:
+        return sum(self.stub.stats.values())
+
+    def timed(self, func, **kwargs) -> tuple[float, str | None]:
+        start = time.perf_counter()
+        try:
+            func(**kwargs)
+            error = None
+        except Exception as e:
+            error = type(e).__name__
+        return time.perf_counter() - start, error
+
+    def sequential(self) -> dict:
+        results = {}
+        cog = BGGCog(None)
+        cog._client = self.client
+        for name, func in (("Meetup.lookup", self.cog.lookup), ("BGGCog.fetch_game", cog.fetch_game)):
+            self.stub.reset()
+            latencies, errors = [], Counter()
+            for query in self.queries:
+                took, error = self.timed(func, name=query)
+                latencies.append(took)
+                errors[error] += error is not None
+            results[name] = {**summary(latencies), "requests_per_lookup": round(self.requests() / len(latencies), 2),
+                             "errors": {k: v for k, v in errors.items() if v}, "stub": self.stub.summary()}
+        return results
+
+    async def parallel(self, concurrency: int) -> dict:
+        await cache.clear()
+        self.stub.reset()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, errors = [], Counter()
+
+        async def one(query: str):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await self.cog.async_lookup(name=query)
+                except Exception as e:
+                    errors[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(query) for query in self.queries))
+        elapsed = time.perf_counter() - start
+        return {"wall_s": round(elapsed, 2), "lookups_per_s": round(len(self.queries) / elapsed, 1),
+                **summary(latencies), "errors": dict(errors), "stub": self.stub.summary()}
+
+    async def cached(self) -> dict:
+        # Zipf-like popularity: a few games are asked for far more than the rest
+        await cache.clear()
+        self.stub.reset()
+        metrics.values.pop("lookup_cache_total", None)
+        weights = [1 / (rank + 1) ** self.args.skew for rank in range(len(self.queries))]
+        workload = self.rng.choices(self.queries, weights, k=self.args.lookups)
+        semaphore = asyncio.Semaphore(self.args.cache_concurrency)
+        latencies = []
+
+        async def one(query: str):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await self.cog.async_lookup(name=query)
+                except Exception:
+                    pass
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(query) for query in workload))
+        elapsed = time.perf_counter() - start
+        results = {dict(labels)["result"]: int(count)
+                   for labels, count in metrics.values.get("lookup_cache_total", {}).items()}
+        return {"lookups": len(workload), "distinct": len(set(workload)), "wall_s": round(elapsed, 2),
+                **summary(latencies), "results": results,
+                "hit_ratio": round((results.get("hit", 0) + results.get("coalesced", 0)) / len(workload), 3),
+                "bgg_requests": self.requests(), "stub": self.stub.summary()}
+
+    async def run(self) -> dict:
+        cache.setup("mem://")
+        metrics.enabled = True
+        loop = asyncio.get_running_loop()
+        # Parallel lookups are otherwise capped by the default executor's size
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=max(self.args.concurrency)))
+
+        report = {"queries": len(self.queries), "fixtures": len(self.stub.fixtures.things)}
+        report["sequential"] = await loop.run_in_executor(None, self.sequential)
+        report["parallel"] = {str(c): await self.parallel(c) for c in self.args.concurrency}
+        report["cache"] = await self.cached()
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", help="recorded fixtures to serve, a generated catalogue by default")
+    parser.add_argument("--games", type=int, default=2000, help="size of the generated catalogue")
+    parser.add_argument("--query", action="append", help="search to benchmark, sampled from the fixtures by default")
+    parser.add_argument("--queries", type=int, default=50, help="number of distinct searches to sample")
+    parser.add_argument("--lookups", type=int, default=500, help="lookups in the cache workload")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of the cache workload")
+    parser.add_argument("--concurrency", default="1,4,16", type=lambda v: [int(c) for c in v.split(",")])
+    parser.add_argument("--cache-concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", default="50-150", help="stub response latency range")
+    parser.add_argument("--item-latency-ms", type=float, default=2)
+    parser.add_argument("--rate", type=float, default=0, help="stub requests per second before answering 429")
+    parser.add_argument("--queued", type=float, default=0, help="fraction of thing requests answered 202")
+    parser.add_argument("--errors", type=float, default=0, help="fraction of requests answered 500")
+    parser.add_argument("--rpm", type=int, default=60000,
+                        help="client-side requests per minute (the bot uses the library default of 30)")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--retry-delay", type=float, default=0.2)
+    parser.add_argument("--http-cache", action="store_true", help="keep the client's in-memory HTTP cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    if args.fixtures:
+        fixtures = bggstub.Fixtures(args.fixtures).load()
+    else:
+        fixtures = bggstub.Fixtures(tempfile.mkdtemp(prefix="bggstub-"))
+        bggstub.generate(fixtures, args.games, args.seed)
+
+    low, high = (float(v) / 1000 for v in args.latency_ms.split("-"))
+    stub = bggstub.BGGStub(fixtures, (low, high), args.item_latency_ms / 1000, args.rate, args.queued,
+                           args.errors, args.seed)
+    url = stub.start_in_thread()
+    print(json.dumps(asyncio.run(Benchmark(args, stub, url).run()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
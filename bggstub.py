@@ -0,0 +1,314 @@
+"""Local stand-in for the BoardGameGeek XML API2 `search` and `thing` endpoints.
+
+Serves recorded (or generated) fixtures with configurable latency, throttling
+and error injection, so lookups can run without boardgamegeek.com:
+
+    python bggstub.py record --fixtures fixtures/bgg Catan Azul "Ticket to Ride"
+    python bggstub.py generate --fixtures fixtures/bgg --games 2000
+    python bggstub.py serve --fixtures fixtures/bgg --port 8765 --latency-ms 50-200 --rate 2
+    BGG_API_URL=http://127.0.0.1:8765/xmlapi2 python bot.py
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+from pathlib import Path
+from urllib.parse import quote
+from xml.sax.saxutils import escape, quoteattr
+
+logger = logging.getLogger("boardgame.helper.bggstub")
+
+TERMS = "https://boardgamegeek.com/xmlapi/termsofuse"
+QUEUED = "<message>Your request has been accepted and will be processed. Please try again later for access.</message>"
+
+
+def search_key(query: str, types: str) -> str:
+    return quote(f"{query.strip().lower()}|{types}", safe="") + ".xml"
+
+
+class Fixtures:
+    # thing/<id>.xml holds one <item> as returned by /thing?stats=1,
+    # search/<query|types>.xml a whole /search response
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.things: dict[str, str] = {}
+        self.names: list[tuple[str, str, str, str]] = []
+        self.searches: dict[str, str] = {}
+
+    def load(self) -> "Fixtures":
+        for file in sorted((self.path / "thing").glob("*.xml")):
+            self.add_thing(file.read_text(encoding="utf-8"))
+        for file in (self.path / "search").glob("*.xml"):
+            self.searches[file.name] = file.read_text(encoding="utf-8")
+        logger.info("loaded %d things and %d searches from %s", len(self.things), len(self.searches), self.path)
+        return self
+
+    def add_thing(self, text: str) -> ET.Element:
+        item = ET.fromstring(text)
+        name = item.find("name[@type='primary']")
+        year = item.find("yearpublished")
+        self.things[item.get("id")] = text
+        self.names.append((name.get("value") if name is not None else "", item.get("id"), item.get("type"),
+                           year.get("value") if year is not None else "0"))
+        return item
+
+    def save_thing(self, item: ET.Element):
+        text = ET.tostring(item, encoding="unicode")
+        (self.path / "thing").mkdir(parents=True, exist_ok=True)
+        (self.path / "thing" / f"{item.get('id')}.xml").write_text(text, encoding="utf-8")
+        self.add_thing(text)
+
+    def save_search(self, query: str, types: str, text: str):
+        (self.path / "search").mkdir(parents=True, exist_ok=True)
+        (self.path / "search" / search_key(query, types)).write_text(text, encoding="utf-8")
+        self.searches[search_key(query, types)] = text
+
+    def search(self, query: str, types: str, exact: bool = False) -> str:
+        recorded = self.searches.get(search_key(query, types))
+        if recorded is not None:
+            return recorded
+
+        # Without a recording, match every word of the query against the names we have
+        words = query.lower().split()
+        allowed = set(types.split(","))
+        found = [(name, id, type, year) for name, id, type, year in self.names
+                 if type in allowed and (name.lower() == query.lower() if exact
+                                         else all(word in name.lower() for word in words))]
+        items = "".join(f'<item type="{type}" id="{id}"><name type="primary" value={quoteattr(name)}/>'
+                        f'<yearpublished value="{year}"/></item>' for name, id, type, year in found)
+        return f'<?xml version="1.0" encoding="utf-8"?><items total="{len(found)}" termsofuse="{TERMS}">{items}</items>'
+
+    def thing(self, ids: list[str]) -> str:
+        items = "".join(self.things[id] for id in ids if id in self.things)
+        return f'<?xml version="1.0" encoding="utf-8"?><items termsofuse="{TERMS}">{items}</items>'
+
+
+def thing_xml(id: int, name: str, year: int, rank: int | None, minplayers: int, maxplayers: int, best: int,
+              type: str = "boardgame") -> str:
+    results = "".join(
+        f'<results numplayers="{n}"><result value="Best" numvotes="{20 if n == best else 2}"/>'
+        f'<result value="Recommended" numvotes="10"/><result value="Not Recommended" numvotes="1"/></results>'
+        for n in range(minplayers, maxplayers + 1))
+    return (f'<item type="{type}" id="{id}">'
+            f'<thumbnail>https://cf.geekdo-images.com/thumb/{id}.jpg</thumbnail>'
+            f'<image>https://cf.geekdo-images.com/original/{id}.jpg</image>'
+            f'<name type="primary" sortindex="1" value={quoteattr(name)}/>'
+            f'<description>{escape(f"{name} is a generated game used for lookup benchmarks. " * 8)}</description>'
+            f'<yearpublished value="{year}"/><minplayers value="{minplayers}"/><maxplayers value="{maxplayers}"/>'
+            f'<poll name="suggested_numplayers" title="User Suggested Number of Players" totalvotes="31">'
+            f'{results}</poll>'
+            f'<playingtime value="60"/><minplaytime value="30"/><maxplaytime value="90"/><minage value="10"/>'
+            f'<statistics page="1"><ratings><usersrated value="1000"/><average value="7.1"/>'
+            f'<bayesaverage value="6.8"/><ranks><rank type="subtype" id="1" name="boardgame" '
+            f'friendlyname="Board Game Rank" value="{rank or "Not Ranked"}" bayesaverage="6.8"/></ranks>'
+            f'<stddev value="1.3"/><median value="0"/><owned value="2000"/><trading value="10"/>'
+            f'<wanting value="20"/><wishing value="200"/><numcomments value="150"/><numweights value="50"/>'
+            f'<averageweight value="2.4"/></ratings></statistics></item>')
+
+
+WORDS = ("Lost", "Crimson", "Forgotten", "Iron", "Silent", "Golden", "Hidden", "Twilight", "Broken", "Endless")
+NOUNS = ("Kingdoms", "Harbors", "Rails", "Forests", "Empires", "Gardens", "Dungeons", "Stars", "Rivers", "Castles")
+
+
+def generate(fixtures: Fixtures, games: int, seed: int = 0):
+    rng = random.Random(seed)
+    for index in range(games):
+        id = 100000 + index
+        name = f"{WORDS[index % len(WORDS)]} {NOUNS[index // len(WORDS) % len(NOUNS)]}"
+        if index >= len(WORDS) * len(NOUNS):
+            name += f" {index // (len(WORDS) * len(NOUNS)) + 1}"
+        minplayers = rng.randint(1, 3)
+        maxplayers = rng.randint(minplayers + 1, 8)
+        rank = rng.randint(1, games * 5) if rng.random() < 0.8 else None
+        type = "boardgameexpansion" if rng.random() < 0.2 else "boardgame"
+        fixtures.save_thing(ET.fromstring(thing_xml(id, name, rng.randint(1995, 2025), rank, minplayers,
+                                                    maxplayers, rng.randint(minplayers, maxplayers), type)))
+
+
+def record(fixtures: Fixtures, queries: list[str], ids: list[str], url: str, types: str, batch: int = 20):
+    import requests
+
+    session = requests.Session()
+
+    def get(endpoint: str, params: dict) -> str:
+        for attempt in range(6):
+            response = session.get(f"{url}/{endpoint}", params=params, timeout=30)
+            if response.status_code == 200:
+                return response.text
+            logger.warning("%s returned %d, retrying", endpoint, response.status_code)
+            time.sleep(2 * (attempt + 1))
+        response.raise_for_status()
+        raise RuntimeError(f"{endpoint} returned {response.status_code}")
+
+    ids = list(ids)
+    for query in queries:
+        text = get("search", {"query": query, "type": types})
+        fixtures.save_search(query, types, text)
+        ids.extend(item.get("id") for item in ET.fromstring(text).findall("item"))
+
+    ids = [id for id in dict.fromkeys(ids) if id not in fixtures.things]
+    for group in (ids[i:i + batch] for i in range(0, len(ids), batch)):
+        for item in ET.fromstring(get("thing", {"id": ",".join(group), "stats": 1})).findall("item"):
+            fixtures.save_thing(item)
+    logger.info("recorded %d searches and %d things", len(queries), len(ids))
+
+
+class BGGStub:
+    def __init__(self, fixtures: Fixtures, latency: tuple[float, float] = (0.05, 0.2), item_latency: float = 0.002,
+                 rate: float = 0, queued: float = 0, errors: float = 0, seed: int = 0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.item_latency = item_latency
+        self.rate = rate
+        self.queued = queued
+        self.errors = errors
+        self.rng = random.Random(seed)
+        self.stats = Counter()
+        self.url: str | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._runner = None
+        self._tokens = rate
+        self._refilled = time.monotonic()
+
+    def throttled(self) -> bool:
+        if not self.rate:
+            return False
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens < 1:
+            return True
+        self._tokens -= 1
+        return False
+
+    async def respond(self, endpoint: str, body, items: int = 0, queue: bool = False):
+        from aiohttp import web
+
+        if self.throttled():
+            self.stats[endpoint, 429] += 1
+            return web.Response(status=429, text="Rate limit exceeded", headers={"Retry-After": "1"})
+
+        await asyncio.sleep(self.rng.uniform(*self.latency) + items * self.item_latency)
+        if self.rng.random() < self.errors:
+            self.stats[endpoint, 500] += 1
+            return web.Response(status=500, text="<html><body>Internal Server Error</body></html>",
+                                content_type="text/html")
+        if queue and self.rng.random() < self.queued:
+            self.stats[endpoint, 202] += 1
+            return web.Response(status=202, text=QUEUED, content_type="text/xml")
+
+        self.stats[endpoint, 200] += 1
+        return web.Response(text=body(), content_type="text/xml", charset="utf-8")
+
+    async def search(self, request):
+        query = request.query.get("query", "")
+        types = request.query.get("type", "boardgame")
+        exact = request.query.get("exact") == "1"
+        return await self.respond("search", lambda: self.fixtures.search(query, types, exact))
+
+    async def thing(self, request):
+        ids = [id for id in request.query.get("id", "").split(",") if id]
+        return await self.respond("thing", lambda: self.fixtures.thing(ids), items=len(ids), queue=True)
+
+    async def stats_handler(self, request):
+        from aiohttp import web
+
+        return web.json_response(self.summary())
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/xmlapi2/search", self.search)
+        app.router.add_get("/xmlapi2/thing", self.thing)
+        app.router.add_get("/stats", self.stats_handler)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}/xmlapi2"
+        logger.info("serving BGG stub on %s", self.url)
+        return self.url
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(self.start(host, port))
+            started.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, name="bggstub", daemon=True).start()
+        started.wait()
+        return self.url
+
+    def summary(self) -> dict[str, int]:
+        return {f"{endpoint} {status}": count for (endpoint, status), count in sorted(self.stats.items())}
+
+    def reset(self):
+        self.stats.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-v", "--verbose", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="serve the fixtures")
+    serve.add_argument("--fixtures", default="fixtures/bgg")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--latency-ms", default="50-200", help="response latency range")
+    serve.add_argument("--item-latency-ms", type=float, default=2, help="extra latency per id in a thing request")
+    serve.add_argument("--rate", type=float, default=0, help="requests per second before answering 429, 0 for none")
+    serve.add_argument("--queued", type=float, default=0, help="fraction of thing requests answered 202 (queued)")
+    serve.add_argument("--errors", type=float, default=0, help="fraction of requests answered 500")
+    serve.add_argument("--seed", type=int, default=0)
+
+    rec = commands.add_parser("record", help="record fixtures from boardgamegeek.com")
+    rec.add_argument("queries", nargs="*", help="searches to record, along with every game they find")
+    rec.add_argument("--fixtures", default="fixtures/bgg")
+    rec.add_argument("--id", action="append", default=[], help="extra game ids to record")
+    rec.add_argument("--url", default="https://boardgamegeek.com/xmlapi2")
+    rec.add_argument("--type", default="boardgame,boardgameexpansion")
+
+    gen = commands.add_parser("generate", help="generate a synthetic catalogue")
+    gen.add_argument("--fixtures", default="fixtures/bgg")
+    gen.add_argument("--games", type=int, default=1000)
+    gen.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    fixtures = Fixtures(args.fixtures)
+    if args.command == "record":
+        record(fixtures.load(), args.queries, args.id, args.url.rstrip("/"), args.type)
+    elif args.command == "generate":
+        generate(fixtures, args.games, args.seed)
+        logger.info("generated %d games in %s", args.games, args.fixtures)
+    else:
+        low, high = (float(v) / 1000 for v in args.latency_ms.split("-"))
+        stub = BGGStub(fixtures.load(), (low, high), args.item_latency_ms / 1000, args.rate, args.queued,
+                       args.errors, args.seed)
+
+        async def serve_forever():
+            await stub.start(args.host, args.port)
+            try:
+                await asyncio.Event().wait()
+            finally:
+                logger.info("requests served: %s", json.dumps(stub.summary()))
+
+        try:
+            asyncio.run(serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
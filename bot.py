@@ -1,3 +1,16 @@
+from startup import startup
+from metrics import metrics
+from tracing import tracer
+from outbound import outbound
+from guard import guard
+import bgg
+import fuzzy
+from store.archive import Archiver
+from store.backup import Backups
+from datetime import timedelta
+
+import functools
+import multiprocessing
 import discord
 from environs import Env
 from discord.ext import commands
@@ -11,19 +24,79 @@ env = Env()
 env.read_env()
 
 token = env.str("DISCORD_TOKEN")
+metrics_port = env.int("METRICS_PORT", 0)
+metrics_host = env.str("METRICS_HOST", "127.0.0.1")
+tracer.threshold = env.float("SLOW_INTERACTION_SECONDS", tracer.threshold)
+bgg.api_url = env.str("BGG_API_URL", bgg.api_url)
+fuzzy.catalog_path = env.str("GAME_CATALOG", None)
+guard.rate = env.int("USER_COMMAND_RATE", guard.rate)
+guard.per = env.float("USER_COMMAND_PER", guard.per)
+Archiver.archive_path = env.str("ARCHIVE_DB", Archiver.archive_path)
+Archiver.archive_after = timedelta(days=env.float("ARCHIVE_AFTER_DAYS", 30))
+Archiver.retention = timedelta(days=env.float("ARCHIVE_RETENTION_DAYS", 0)) or None
+if env.int("STORE_SHARDS", 0):
+    # Left unimported otherwise, like the other rarely needed modules
+    from store.sharded import ShardedStore
+    ShardedStore.shard_count = env.int("STORE_SHARDS")
+    ShardedStore.shard_path = env.str("STORE_SHARD_PATH", ShardedStore.shard_path)
+    ShardedStore.index_path = env.str("STORE_INDEX", ShardedStore.index_path)
+Backups.backup_dir = env.str("BACKUP_DIR", Backups.backup_dir)
+Backups.keep = env.int("BACKUP_KEEP", Backups.keep)
+Backups.interval = timedelta(hours=env.float("BACKUP_INTERVAL_HOURS", 24)) or None
+shard_count = env.int("SHARD_COUNT", 0)
+shard_ids = env.list("SHARD_IDS", None, subcast=int)
+processes = env.int("BOT_PROCESSES", 1)
 
 
-def main():
+def run(shard_ids: list[int] = None, shard_count: int = 0, index: int = 0):
+    logger.info("imports done %.3fs after start", startup.elapsed())
 
-    bot = commands.Bot(intents=discord.Intents.default())
+    if shard_count or shard_ids:
+        bot = commands.AutoShardedBot(intents=discord.Intents.default(), shard_count=shard_count or None, shard_ids=shard_ids)
+    else:
+        bot = commands.Bot(intents=discord.Intents.default())
     async def on_ready():
-        logger.info('%s has connected to Discord!', bot.user)
+        logger.info('%s has connected to Discord! shards %s of %s', bot.user, getattr(bot, "shard_ids", None), bot.shard_count)
 
     bot.add_listener(on_ready)
     bot.add_check(commands.guild_only())
-    bot.load_extension("bgg")
-    bot.load_extension("meetup")
+    guard.attach(bot)
+    startup.attach(bot)
+    tracer.attach(bot)
+    outbound.attach(bot)
+    tracer.instrument_discord(bot)
+    if metrics_port:
+        metrics.enabled = True
+        metrics.attach(bot)
+        # Processes started together each get their own port, one after the other
+        startup.defer("metrics", functools.partial(metrics.serve, metrics_host, metrics_port + index))
+    with startup.phase("extensions"):
+        bot.load_extension("bgg")
+        bot.load_extension("meetup")
     bot.run(token)
 
+
+def main():
+    if processes <= 1:
+        run(shard_ids, shard_count)
+        return
+
+    # Each process connects its own range of shards and handles their guilds,
+    # all of them share the store
+    from coordination import shard_ranges
+    count = shard_count or processes
+    if count < processes:
+        raise ValueError(f"SHARD_COUNT={count} is too few shards for {processes} processes")
+    context = multiprocessing.get_context("spawn")
+    children = []
+    for i, ids in enumerate(shard_ranges(count, processes)):
+        child = context.Process(target=run, args=(ids, count, i), name=f"bot-{i}")
+        child.start()
+        children.append(child)
+        logger.info("Started %s for shards %s of %d", child.name, ids, count)
+    for child in children:
+        child.join()
+        logger.info("%s exited with %s", child.name, child.exitcode)
+
 if __name__ == "__main__":
     main()
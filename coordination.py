@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+from datetime import datetime, timedelta, UTC
+
+from store import ChangeFeed, ChangeType, TableChange
+from store.local import _timestamp
+
+logger = logging.getLogger("boardgame.helper.coordination")
+
+# What other processes' caches care about: new games for the catalogue and
+# signups for recommendations. Message edits stay with the process that made
+# the change, it owns the guild.
+BROADCAST = (ChangeType.ADD, ChangeType.JOIN, ChangeType.PROMOTE, ChangeType.SEAT)
+
+
+def shard_ranges(shard_count: int, processes: int) -> list[list[int]]:
+    """Split shards into `processes` contiguous ranges, as evenly as they go."""
+    size, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        end = start + size + (i < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class Coordinator:
+    # Bot processes sharing a store each own a range of Discord shards, and
+    # with it the guilds on them. Table changes are written to a broadcast
+    # table in the store, every process polls it and replays the others'
+    # changes on `remote`, for its in-memory caches to pick up.
+    poll_interval = 2.0
+    batch_size = 500
+    retention = timedelta(hours=1)
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.origin = f"{socket.gethostname()}:{os.getpid()}"
+        self.remote = ChangeFeed()
+        self.conn = sqlite3.connect(db_path, autocommit=True, timeout=30)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS broadcast (
+                id INTEGER PRIMARY KEY,
+                origin TEXT NOT NULL,
+                type INTEGER NOT NULL,
+                table_id TEXT NOT NULL,
+                player_id INTEGER,
+                created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS broadcast_created ON broadcast (created_at);
+        """)
+        # Only what happens from now on, caches were loaded from the store itself
+        self.last_id = self.conn.execute("SELECT coalesce(max(id), 0) FROM broadcast").fetchone()[0]
+
+    def on_table_change(self, change: TableChange):
+        if change.type not in BROADCAST:
+            return
+        self.conn.execute("INSERT INTO broadcast (origin, type, table_id, player_id, created_at) VALUES (?, ?, ?, ?, ?)",
+                          (self.origin, change.type, change.table_id, change.player_id, _timestamp(datetime.now(UTC))))
+
+    def poll(self) -> int:
+        rows = self.conn.execute("SELECT * FROM broadcast WHERE id > ? ORDER BY id LIMIT ?",
+                                 (self.last_id, self.batch_size)).fetchall()
+        for id, origin, type, table_id, player_id, _ in rows:
+            self.last_id = id
+            if origin != self.origin:
+                self.remote.publish(TableChange(ChangeType(type), table_id, player_id=player_id))
+        return len(rows)
+
+    def trim(self) -> int:
+        cutoff = _timestamp(datetime.now(UTC) - self.retention)
+        # The newest row always stays: ids of an emptied table start again at 1,
+        # below every peer's last_id, and their polls would skip what follows
+        return self.conn.execute("DELETE FROM broadcast WHERE created_at < ? AND id < (SELECT max(id) FROM broadcast)",
+                                 (cutoff,)).rowcount
+
+    async def run(self):
+        trimmed_at = datetime.now(UTC)
+        while True:
+            try:
+                # A full batch means there is more waiting
+                while self.poll() == self.batch_size:
+                    await asyncio.sleep(0)
+                if datetime.now(UTC) - trimmed_at > self.retention:
+                    trimmed_at = datetime.now(UTC)
+                    self.trim()
+            except sqlite3.Error:
+                logger.warning("Could not read changes from other processes", exc_info=True)
+            await asyncio.sleep(self.poll_interval)
@@ -1,11 +1,36 @@
 
 import discord
-from store import Table, Game
-from boardgamegeek.objects.games import BoardGame
+from collections import OrderedDict
+from store import Table, Game, TableSummary, Event, event_label
 
 
+class RenderCache:
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.payloads: OrderedDict[tuple, dict] = OrderedDict()
+
+    def render(self, key: tuple, build) -> discord.Embed:
+        payload = self.payloads.get(key)
+        if payload is None:
+            payload = build().to_dict()
+            self.payloads[key] = payload
+            if len(self.payloads) > self.maxsize:
+                self.payloads.popitem(last=False)
+        else:
+            self.payloads.move_to_end(key)
+        return discord.Embed.from_dict(payload)
+
+
+# Keyed by table id and version, so a roster change is a cache miss rather
+# than an invalidation - stale versions simply age out
+render_cache = RenderCache()
+
 
 class PlayerListEmbed(discord.Embed):
+    @classmethod
+    def cached(cls, table: Table) -> discord.Embed:
+        return render_cache.render(("players", table.id, table.version), lambda: cls(table))
+
     def __init__(self, table: Table):
         owner = table.owner
         game = table.game
@@ -30,6 +55,11 @@ class GamesEmbed(discord.Embed):
 
 
 class GameEmbed(discord.Embed):
+    @classmethod
+    def cached(cls, table: Table, list_players=False) -> discord.Embed:
+        return render_cache.render(("game", table.id, table.version, list_players),
+                                   lambda: cls(table, list_players=list_players))
+
     def __init__(self, table: Table, list_players=False):
         owner = table.owner
         game = table.game
@@ -50,3 +80,37 @@ class GameEmbed(discord.Embed):
         if list_players and len(table.players) > 0:
             self.add_field(name="Currently signed up to play:",
                            value=(", ".join(p.mention for p in table.players.values())))
+        if list_players and table.waitlist:
+            self.add_field(name="Waitlist:", value=", ".join(p.mention for p in table.waitlist)[:1024])
+
+
+class GameSummaryEmbed(discord.Embed):
+    lines_per_page = 20
+    description_limit = 4096
+
+    def __init__(self, lines: list[str], title: str = "Games being brought"):
+        super().__init__(title=title, description="\n".join(lines))
+
+    @classmethod
+    def pages(cls, tables: list[TableSummary], title: str = None) -> list["GameSummaryEmbed"]:
+        title = f"Games being brought to {title}"[:256] if title else "Games being brought"
+        pages, lines, size = [], [], 0
+        for table in tables:
+            line = f"[{table.name}]({table.link}) [{table.players}/{table.maxplayers}] - {table.mentions}"
+            line = line[:cls.description_limit]
+            if lines and (len(lines) == cls.lines_per_page or size + len(line) > cls.description_limit):
+                pages.append(cls(lines, title))
+                lines, size = [], 0
+            lines.append(line)
+            size += len(line) + 1
+
+        if lines:
+            pages.append(cls(lines, title))
+        return pages
+
+
+class SignupEmbed(discord.Embed):
+    def __init__(self, event: Event):
+        super().__init__(title=event_label(event)[:256],
+                         description="Bringing a game? Add it with `/meetup games add`, "
+                                     "then join games with the buttons. Signups close when the meetup starts.")
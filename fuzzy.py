@@ -0,0 +1,266 @@
+"""Typo-tolerant game name search.
+
+Names are indexed by character trigrams. A query collects candidates sharing
+enough trigrams with it, reranks the best of them by edit distance and breaks
+near ties by BGG rank, so "Wingpsan" still finds Wingspan without asking BGG.
+
+    python fuzzy.py --names 100000
+    python fuzzy.py --catalog boardgames_ranks.csv --query "terraforming mar"
+"""
+import argparse
+import csv
+import heapq
+import logging
+import math
+import random
+import re
+import statistics
+import time
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+logger = logging.getLogger("boardgame.helper.fuzzy")
+
+# Optional CSV of id,name,rank rows (BGG's boardgames_ranks.csv works) to
+# search beyond the games the bot has already seen
+catalog_path: str | None = None
+
+
+def normalize(name: str) -> str:
+    name = unicodedata.normalize("NFKD", name.casefold())
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w]+", " ", name).split())
+
+
+def trigrams(key: str) -> set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def distances(query: str, name: str, limit: int) -> tuple[int, int]:
+    """Edit distance (with transpositions) from `query` to `name` and to its closest prefix.
+
+    Both are capped at `limit`, rows stop being computed once they can't get under it.
+    """
+    m = len(name)
+    previous = None
+    row = list(range(m + 1))
+    last = ""
+    for i, q in enumerate(query, start=1):
+        current = [i] * (m + 1)
+        left = i
+        for j in range(1, m + 1):
+            c = name[j - 1]
+            best = row[j - 1] + (q != c)
+            if row[j] + 1 < best:
+                best = row[j] + 1
+            if left + 1 < best:
+                best = left + 1
+            if j > 1 and q == name[j - 2] and last == c and previous[j - 2] + 1 < best:
+                best = previous[j - 2] + 1
+            current[j] = left = best
+        previous, row, last = row, current, q
+        if min(row) >= limit:
+            return limit, limit
+    return min(row[m], limit), min(min(row), limit)
+
+
+@dataclass(frozen=True)
+class Match:
+    id: int
+    name: str
+    rank: int | None
+    score: float
+    distance: int  # To the whole name
+    prefix: bool  # Whether the query is a prefix of the name, give or take typos
+
+
+class FuzzyIndex:
+    candidates = 40
+    popularity_weight = 0.1
+    # How close the best match has to be before a query is rewritten to it,
+    # and how many edits a misspelling may have per this many characters
+    rewrite_score = 0.75
+    rewrite_length = 6
+
+    def __init__(self):
+        self.ids = array("q")
+        self.ranks = array("q")
+        self.names: list[str] = []
+        self.keys: list[str] = []
+        self.grams = array("H")
+        self.postings: dict[str, array] = defaultdict(lambda: array("I"))
+        self.by_id: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, id: int, name: str, rank: int | None = None):
+        key = normalize(name)
+        if not key:
+            return
+        known = self.by_id.get(id)
+        if known is not None and self.keys[known] == key:
+            return
+        doc = len(self.names)
+        self.by_id[id] = doc
+        self.ids.append(id)
+        self.ranks.append(rank or 0)
+        self.names.append(name)
+        self.keys.append(key)
+        grams = trigrams(key)
+        self.grams.append(min(len(grams), 65535))
+        for gram in grams:
+            self.postings[gram].append(doc)
+
+    def add_all(self, games: Iterable[tuple[int, str, int | None]]) -> int:
+        before = len(self)
+        for id, name, rank in games:
+            self.add(id, name, rank)
+        return len(self) - before
+
+    def popularity(self, doc: int) -> float:
+        rank = self.ranks[doc]
+        return 1 / (1 + math.log10(rank)) if rank > 0 else 0.0
+
+    def search(self, query: str, n: int = 5) -> list[Match]:
+        key = normalize(query)
+        if not key:
+            return []
+        grams = trigrams(key)
+        overlap = Counter()
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is not None:
+                overlap.update(posting)
+        if not overlap:
+            return []
+
+        # Dice coefficient over trigrams picks the candidates worth an edit distance
+        needed = max(1, len(grams) // 3)
+        shortlist = heapq.nlargest(self.candidates, ((2 * shared / (len(grams) + self.grams[doc]), doc)
+                                                     for doc, shared in overlap.items() if shared >= needed))
+
+        matches = {}
+        limit = max(2, len(key) // 2)
+        for _, doc in shortlist:
+            name = self.keys[doc]
+            if len(name) < len(key) - limit:
+                continue
+            full, prefix = distances(key, name, limit)
+            if prefix >= limit:
+                continue
+            similarity = max(1 - full / max(len(key), len(name)), 0.9 * (1 - prefix / len(key)))
+            score = similarity + self.popularity_weight * self.popularity(doc)
+            match = Match(self.ids[doc], self.names[doc], self.ranks[doc] or None, score, full, prefix == 0)
+            # A renamed game is indexed again, keep its best name
+            if match.id not in matches or matches[match.id].score < score:
+                matches[match.id] = match
+        return sorted(matches.values(), key=lambda m: (-m.score, m.name))[:n]
+
+    def rewrite(self, query: str) -> str | None:
+        """A corrected query when `query` looks misspelt, None when it is fine as it is.
+
+        Only a few edits to a whole name count as a misspelling, a query that
+        merely starts a name ("Cat" for Catan) may well be another game.
+        """
+        key = normalize(query)
+        matches = self.search(query, n=self.candidates)
+        if not matches or any(match.distance == 0 for match in matches):
+            return None
+        edits = max(1, len(key) // self.rewrite_length)
+        close = [match for match in matches if match.distance <= edits and match.score >= self.rewrite_score]
+        return close[0].name if close else None
+
+
+def load_csv(path: str) -> Iterator[tuple[int, str, int | None]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            try:
+                yield int(row["id"]), row["name"], int(row.get("rank") or 0) or None
+            except (KeyError, ValueError):
+                continue
+
+
+# Benchmark
+
+FAMOUS = ("Brass: Birmingham", "Gloomhaven", "Terraforming Mars", "Wingspan", "Ark Nova", "Dune: Imperium",
+          "Twilight Imperium: Fourth Edition", "Spirit Island", "Scythe", "Gaia Project", "Azul", "Catan",
+          "Carcassonne", "Ticket to Ride", "Pandemic", "7 Wonders Duel", "Everdell", "Cascadia", "Root", "Agricola")
+SYLLABLES = ("ka", "ta", "ri", "mon", "dra", "vel", "sa", "lo", "tor", "en", "qua", "zi", "bel", "ron", "ma", "nis",
+             "gar", "pe", "lun", "or", "thi", "cas", "ven", "al", "do", "mir", "sha", "ul", "tre", "ko")
+WORDS = ("of", "the", "and", "Legends", "Kingdom", "Empire", "Quest", "Tales", "Wars", "Island", "City", "Trail",
+         "Dungeon", "Expedition", "Chronicles", "Rising", "Duel", "Deluxe", "Edition", "Second")
+
+
+def generate(names: int, seed: int = 0) -> list[tuple[int, str, int | None]]:
+    rng = random.Random(seed)
+    catalog = [(i + 1, name, i + 1) for i, name in enumerate(FAMOUS)]
+    while len(catalog) < names:
+        words = []
+        for _ in range(rng.choice((1, 1, 2, 2, 3, 4))):
+            if words and rng.random() < 0.4:
+                words.append(rng.choice(WORDS))
+            else:
+                words.append("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))).capitalize())
+        id = len(catalog) + 1
+        catalog.append((id, " ".join(words), id if rng.random() < 0.3 else None))
+    return catalog
+
+
+def typo(name: str, rng: random.Random) -> str:
+    i = rng.randrange(max(len(name) - 1, 1))
+    kind = rng.choice(("swap", "drop", "double", "replace", "truncate"))
+    if kind == "swap" and len(name) > 2:
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    if kind == "drop":
+        return name[:i] + name[i + 1:]
+    if kind == "double":
+        return name[:i] + name[i] + name[i:]
+    if kind == "replace":
+        return name[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + name[i + 1:]
+    return name[:max(len(name) - rng.randint(1, 3), 3)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--catalog", help="CSV of id,name,rank, a generated catalogue by default")
+    parser.add_argument("--names", type=int, default=100_000, help="size of the generated catalogue")
+    parser.add_argument("--queries", type=int, default=1000, help="misspelt queries to time")
+    parser.add_argument("--query", action="append", help="show matches for these queries instead")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    catalog = list(load_csv(args.catalog)) if args.catalog else generate(args.names, args.seed)
+    index = FuzzyIndex()
+    start = time.perf_counter()
+    index.add_all(catalog)
+    print(f"indexed {len(index)} names in {time.perf_counter() - start:.2f}s")
+
+    if args.query:
+        for query in args.query:
+            print(query, "->", index.rewrite(query))
+            for match in index.search(query):
+                print(f"  {match.score:.3f} d={match.distance} {match.name} (rank {match.rank})")
+        return
+
+    rng = random.Random(args.seed)
+    latencies, top1, top5 = [], 0, 0
+    for id, name, _ in rng.sample(catalog, min(args.queries, len(catalog))):
+        query = typo(name, rng)
+        start = time.perf_counter()
+        matches = index.search(query)
+        latencies.append(time.perf_counter() - start)
+        found = [match.id for match in matches]
+        top1 += found[:1] == [id]
+        top5 += id in found
+    q = statistics.quantiles(latencies, n=100, method="inclusive")
+    print(f"{len(latencies)} misspelt queries: top-1 {top1 / len(latencies):.1%}, top-5 {top5 / len(latencies):.1%}, "
+          f"p50 {q[49] * 1000:.2f}ms, p95 {q[94] * 1000:.2f}ms, p99 {q[98] * 1000:.2f}ms, max {max(latencies) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+
+import discord
+from discord.ext import commands
+
+from metrics import metrics
+
+logger = logging.getLogger("boardgame.helper.guard")
+
+
+class CommandInFlight(commands.CheckFailure):
+    def __init__(self, command: str, finished: bool):
+        self.command = command
+        self.finished = finished
+        super().__init__(f"/{command} is already running")
+
+
+class CommandThrottled(commands.CheckFailure):
+    def __init__(self, command: str, retry_after: float):
+        self.command = command
+        self.retry_after = retry_after
+        super().__init__(f"Too many commands, try again in {retry_after:.0f}s")
+
+
+class TokenBucket:
+    __slots__ = ("rate", "per", "tokens", "updated")
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        # Returns 0 when a token was taken, otherwise how long until one is free
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) * self.per / self.rate
+
+    def full(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate / self.per >= self.rate
+
+
+class Guard:
+    # Duplicates of these wait for the running command and are then told it
+    # has finished; duplicates of anything else are turned away immediately
+    attach_commands = {"meetup games add", "meetup games remove", "lookup"}
+    attach_timeout = 600.0
+    # These wait on the user picking from a view, a second one just opens
+    # another picker, so they are throttled but not tracked as in flight
+    interactive_commands = {"meetup games join", "meetup manage settings"}
+    # A command whose completion or error never arrives is forgotten after this long
+    max_age = 900.0
+
+    def __init__(self, rate: int = 5, per: float = 10.0):
+        self.rate = rate
+        self.per = per
+        self.limits: dict[str, tuple[int, float]] = {"meetup games add": (3, 60.0), "lookup": (5, 30.0),
+                                                     "button": (10, 10.0)}
+        self.buckets: dict[tuple[int, str], TokenBucket] = {}
+        self.inflight: dict[tuple, tuple[asyncio.Future, float]] = {}
+        self.running: dict[int, tuple | None] = {}
+
+    def allow(self, user_id: int, scope: str) -> float:
+        scope = scope if scope in self.limits else "*"
+        bucket = self.buckets.get((user_id, scope))
+        if bucket is None:
+            if len(self.buckets) > 10_000:
+                self.buckets = {key: b for key, b in self.buckets.items() if not b.full()}
+            bucket = self.buckets[user_id, scope] = TokenBucket(*self.limits.get(scope, (self.rate, self.per)))
+        return bucket.take()
+
+    def attach(self, bot):
+        bot.add_check(self.check)
+        bot.add_listener(self.on_application_command_completion, "on_application_command_completion")
+        bot.add_listener(self.on_application_command_error, "on_application_command_error")
+
+    async def check(self, ctx: discord.ApplicationContext) -> bool:
+        # Global checks run once for each level of a command group, only the
+        # subcommand that is actually invoked counts
+        if isinstance(ctx.command, discord.SlashCommandGroup) or ctx.interaction.id in self.running:
+            return True
+
+        command = ctx.command.qualified_name
+        key = (ctx.guild_id, ctx.author.id, command)
+        running, started = self.inflight.get(key, (None, 0.0))
+        if running is not None and time.monotonic() - started > self.max_age:
+            logger.warning("Forgetting /%s for user %s, it started %.0fs ago", command, ctx.author.id,
+                           time.monotonic() - started)
+            self.forget(key)
+            self.running = {interaction: k for interaction, k in self.running.items() if k != key}
+            running = None
+        if running is not None:
+            metrics.inc("command_rejected_total", command=command, reason="in_flight")
+            if command not in self.attach_commands:
+                raise CommandInFlight(command, finished=False)
+
+            await ctx.defer(ephemeral=True)
+            try:
+                await asyncio.wait_for(asyncio.shield(running), self.attach_timeout)
+            except asyncio.TimeoutError:
+                raise CommandInFlight(command, finished=False)
+            raise CommandInFlight(command, finished=True)
+
+        retry_after = self.allow(ctx.author.id, command)
+        if retry_after:
+            metrics.inc("command_rejected_total", command=command, reason="throttled")
+            raise CommandThrottled(command, retry_after)
+
+        if command in self.interactive_commands:
+            key = None
+        else:
+            self.inflight[key] = (asyncio.get_running_loop().create_future(), time.monotonic())
+        self.running[ctx.interaction.id] = key
+        return True
+
+    def forget(self, key: tuple):
+        future, _ = self.inflight.pop(key, (None, 0.0))
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def release(self, ctx):
+        self.forget(self.running.pop(ctx.interaction.id, None))
+
+    async def on_application_command_completion(self, ctx):
+        self.release(ctx)
+
+    async def on_application_command_error(self, ctx, error):
+        self.release(ctx)
+        if isinstance(error, CommandInFlight):
+            if error.finished:
+                await ctx.respond(f"Your earlier /{error.command} has finished", ephemeral=True)
+            else:
+                await ctx.respond(f"Your earlier /{error.command} is still running", ephemeral=True, delete_after=5)
+        elif isinstance(error, CommandThrottled):
+            await ctx.respond(f"Slow down! Try again in {error.retry_after:.0f}s", ephemeral=True, delete_after=5)
+
+
+guard = Guard()
@@ -0,0 +1,478 @@
+"""Offline load test for the Meetup cog and the table join buttons.
+
+Drives the real cog, router and SQLite store against an in-process stand-in
+for the Discord API, so concurrency changes can be checked without a server:
+
+    python loadtest.py --guilds 4 --users 40 --actions 10
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+import types
+from collections import Counter, defaultdict
+
+import discord
+
+import meetup
+from cashews import cache
+from store import Game, MessageType
+from store.local import SQLiteStore
+from store.sharded import ShardedStore
+from views import GameJoinRouter
+
+logger = logging.getLogger("boardgame.helper.loadtest")
+
+
+def not_found():
+    return discord.NotFound(types.SimpleNamespace(status=404, reason="Not Found"), "Unknown Message")
+
+
+class FakeDiscord:
+    """Records API calls and applies latency and per-route rate limits."""
+
+    def __init__(self, latency: tuple[float, float], rate: int, per: float, rng: random.Random):
+        self.latency = latency
+        self.rate = rate
+        self.per = per
+        self.rng = rng
+        self.ids = itertools.count(discord.utils.time_snowflake(discord.utils.utcnow()))
+        self.messages: dict[int, "FakeMessage"] = {}
+        self.channels: dict[int, "FakeChannel"] = {}
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        self.buckets: dict[tuple, list] = {}
+
+    async def request(self, route: str, bucket: tuple | None = None):
+        self.calls[route] += 1
+        if bucket is not None:
+            # Like the client library, wait out an exhausted bucket rather than fail
+            loop = asyncio.get_running_loop()
+            state = self.buckets.setdefault(bucket, [self.rate, loop.time() + self.per])
+            while True:
+                now = loop.time()
+                if now >= state[1]:
+                    state[0], state[1] = self.rate, now + self.per
+                if state[0] > 0:
+                    state[0] -= 1
+                    break
+                self.rate_limited[route] += 1
+                await asyncio.sleep(state[1] - now)
+        await asyncio.sleep(self.rng.uniform(*self.latency))
+
+    def channel(self, channel_id: int) -> "FakeChannel":
+        if channel_id not in self.channels:
+            self.channels[channel_id] = FakeChannel(self, channel_id)
+        return self.channels[channel_id]
+
+    def create_message(self, channel_id: int, **fields) -> "FakeMessage":
+        message = FakeMessage(self, next(self.ids), self.channel(channel_id))
+        message.update(**fields)
+        self.messages[message.id] = message
+        return message
+
+
+class FakeMessage:
+    def __init__(self, api: FakeDiscord, id: int, channel: "FakeChannel"):
+        self.api = api
+        self.id = id
+        self.channel = channel
+        self.content = None
+        self.embeds: list[discord.Embed] = []
+        self.view = None
+
+    def update(self, content=discord.utils.MISSING, embed=discord.utils.MISSING,
+               embeds=discord.utils.MISSING, view=discord.utils.MISSING, **_):
+        if content is not discord.utils.MISSING:
+            self.content = content
+        if embed is not discord.utils.MISSING:
+            self.embeds = [] if embed is None else [embed]
+        if embeds is not discord.utils.MISSING:
+            self.embeds = list(embeds or [])
+        if view is not discord.utils.MISSING:
+            self.view = view
+
+
+class FakePartialMessage:
+    def __init__(self, channel: "FakeChannel", id: int):
+        self.channel = channel
+        self.id = id
+
+    async def edit(self, **fields):
+        api = self.channel.api
+        await api.request("message.edit", ("channel", self.channel.id))
+        if self.id not in api.messages:
+            raise not_found()
+        api.messages[self.id].update(**fields)
+
+    async def delete(self):
+        api = self.channel.api
+        await api.request("message.delete", ("channel", self.channel.id))
+        if api.messages.pop(self.id, None) is None:
+            raise not_found()
+
+
+class FakeChannel:
+    def __init__(self, api: FakeDiscord, id: int):
+        self.api = api
+        self.id = id
+
+    async def send(self, content=None, **fields):
+        await self.api.request("message.send", ("channel", self.id))
+        return self.api.create_message(self.id, content=content, **fields)
+
+    def get_partial_message(self, message_id: int) -> FakePartialMessage:
+        return FakePartialMessage(self, message_id)
+
+    async def fetch_message(self, message_id: int):
+        await self.api.request("message.fetch", ("channel", self.id))
+        if message_id not in self.api.messages:
+            raise not_found()
+        return self.api.messages[message_id]
+
+    async def delete_messages(self, messages):
+        await self.api.request("message.bulk_delete", ("channel", self.id))
+        for message in messages:
+            self.api.messages.pop(message.id, None)
+
+
+class FakeBot:
+    def __init__(self, api: FakeDiscord):
+        self.api = api
+        self.user = types.SimpleNamespace(id=1, display_name="bot", mention="<@1>")
+        self._connection = types.SimpleNamespace(prevent_view_updates_for=lambda message_id: None)
+
+    def get_channel(self, channel_id: int):
+        return self.api.channel(channel_id)
+
+    def get_partial_messageable(self, channel_id: int):
+        return self.api.channel(channel_id)
+
+    async def fetch_channel(self, channel_id: int):
+        await self.api.request("channel.fetch")
+        return self.api.channel(channel_id)
+
+    def get_message(self, message_id: int):
+        return self.api.messages.get(message_id)
+
+    async def create_dm(self, user):
+        await self.api.request("dm.create")
+        return self.api.channel(user.id)
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self.done = False
+        self.content = None
+
+    def is_done(self) -> bool:
+        return self.done
+
+    def _respond(self):
+        if self.done:
+            raise discord.InteractionResponded(self.interaction)
+        self.done = True
+        self.interaction.acked = time.perf_counter()
+
+    async def defer(self, *args, **kwargs):
+        self._respond()
+        await self.interaction.api.request("interaction.defer")
+
+    async def send_message(self, content=None, **fields):
+        self._respond()
+        self.content = content
+        await self.interaction.api.request("interaction.respond")
+        return self.interaction.api.create_message(self.interaction.channel_id, content=content, **fields)
+
+    async def edit_message(self, **fields):
+        self._respond()
+        await self.interaction.api.request("interaction.edit")
+        if self.interaction.message is not None:
+            self.interaction.message.update(**fields)
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+
+    async def send(self, content=None, **fields):
+        await self.interaction.api.request("interaction.followup")
+        return self.interaction.api.create_message(self.interaction.channel_id, content=content, **fields)
+
+
+class FakeInteraction(discord.Interaction):
+    # Paginator checks isinstance(interaction, discord.Interaction)
+    def __init__(self, api: FakeDiscord, user, guild_id: int, channel_id: int,
+                 custom_id: str | None = None, message: FakeMessage | None = None):
+        self.api = api
+        self.id = next(api.ids)
+        self.type = discord.InteractionType.component if custom_id else discord.InteractionType.application_command
+        self.user = user
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.custom_id = custom_id
+        self.message = message
+        self.created = time.perf_counter()
+        self.acked: float | None = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, **fields):
+        await self.api.request("interaction.edit_original")
+        if self.message is not None:
+            self.message.update(**fields)
+
+
+class FakeContext:
+    def __init__(self, api: FakeDiscord, user, guild_id: int, channel_id: int):
+        self.interaction = FakeInteraction(api, user, guild_id, channel_id)
+        self.author = user
+        self.guild = types.SimpleNamespace(id=guild_id, owner_id=None)
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+
+    async def defer(self, *args, **kwargs):
+        await self.interaction.response.defer()
+
+    async def respond(self, content=None, **fields):
+        fields.pop("delete_after", None)
+        if not self.interaction.response.is_done():
+            return await self.interaction.response.send_message(content, **fields)
+        return await self.interaction.followup.send(content, **fields)
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        low, high = (float(v) / 1000 for v in args.latency_ms.split("-"))
+        self.api = FakeDiscord((low, high), args.rate, args.per, self.rng)
+        self.bot = FakeBot(self.api)
+        if args.shards:
+            directory = tempfile.mkdtemp()
+            ShardedStore.shard_path = os.path.join(directory, "shard-{}.sqlite")
+            ShardedStore.index_path = os.path.join(directory, "index.sqlite")
+            self.store = ShardedStore(args.shards)
+        else:
+            self.store = SQLiteStore(args.db or os.path.join(tempfile.mkdtemp(), "loadtest.sqlite"))
+        self.cog = meetup.Meetup(self.bot, self.store)
+        self.cog.lookup = self.lookup
+        self.router = GameJoinRouter(self.store)
+        self.store.changes.subscribe(self.cog.on_table_change)
+
+        self.catalogue = [Game(id=i, name=f"Game {i}", year=2000 + i % 25, rank=i, description="A game " * 20,
+                               thumbnail="https://example.com/t.png", minplayers=2, maxplayers=2 + i % 5,
+                               recommended_players=3)
+                          for i in range(1, args.games + 1)]
+        self.latencies = defaultdict(list)
+        self.acks = []
+        self.errors = Counter()
+        self.throttled = Counter()
+        self.lags = []
+        self.expected: dict[str, set[int]] = defaultdict(set)
+
+    def lookup(self, name=None, id=None):
+        time.sleep(self.args.bgg_latency_ms / 1000)
+        return [game for game in self.catalogue if game.name == name]
+
+    async def timed(self, op: str, coro, interaction: FakeInteraction):
+        start = time.perf_counter()
+        try:
+            await coro
+        except Exception:
+            logger.error("%s failed", op, exc_info=True)
+            self.errors[op] += 1
+        self.latencies[op].append(time.perf_counter() - start)
+        if interaction.acked is not None:
+            self.acks.append(interaction.acked - interaction.created)
+
+    async def monitor_loop(self, interval: float = 0.05):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.lags.append(max(loop.time() - start - interval, 0.0))
+
+    def user(self, user_id: int):
+        return types.SimpleNamespace(id=user_id, display_name=f"user{user_id}", mention=f"<@{user_id}>")
+
+    def guild_users(self):
+        users = range(1000, 1000 + self.args.users)
+        return [(self.user(user_id), 100 + index % self.args.guilds) for index, user_id in enumerate(users)]
+
+    async def add(self, user, guild_id: int):
+        # Half the users post from the signup channel, half from elsewhere
+        channel_id = guild_id * 10 + (user.id % 2)
+        ctx = FakeContext(self.api, user, guild_id, channel_id)
+        game = self.rng.choice(self.catalogue)
+        await self.timed("add", meetup.Meetup.add_game.callback(self.cog, ctx, game.name), ctx.interaction)
+
+    async def click(self, op: str, user, guild_id: int, table_id: str) -> bool:
+        join = next((m for m in self.store.get_messages_for_table(table_id) if m.type == MessageType.JOIN), None)
+        message = self.api.messages.get(join.id) if join else None
+        interaction = FakeInteraction(self.api, user, guild_id, guild_id * 10,
+                                      custom_id=f"{table_id}-{op}", message=message)
+        await self.timed(op, self.router.on_interaction(interaction), interaction)
+        # Clicks turned away by the per-user throttle change nothing
+        if interaction.response.content and interaction.response.content.startswith("Slow down"):
+            self.throttled[op] += 1
+            return False
+        return True
+
+    async def list_games(self, user, guild_id: int):
+        ctx = FakeContext(self.api, user, guild_id, guild_id * 10)
+        await self.timed("list", meetup.Meetup.list_games.callback(self.cog, ctx), ctx.interaction)
+
+    async def remove(self, user, guild_id: int):
+        ctx = FakeContext(self.api, user, guild_id, guild_id * 10)
+        await self.timed("remove", meetup.Meetup.remove_game.callback(self.cog, ctx), ctx.interaction)
+
+    async def actions(self, user, guild_id: int, tables: list[str]):
+        joined = []
+        for _ in range(self.args.actions):
+            roll = self.rng.random()
+            if roll < 0.2:
+                await self.list_games(user, guild_id)
+            elif roll < 0.35 and joined:
+                table_id = joined.pop(self.rng.randrange(len(joined)))
+                if await self.click("leave", user, guild_id, table_id):
+                    self.expected[table_id].discard(user.id)
+                else:
+                    joined.append(table_id)
+            elif tables:
+                table_id = self.rng.choice(tables)
+                if await self.click("join", user, guild_id, table_id):
+                    self.expected[table_id].add(user.id)
+                    if table_id not in joined:
+                        joined.append(table_id)
+            await asyncio.sleep(self.rng.uniform(0, self.args.think_ms / 1000))
+
+    async def settle(self):
+        while self.cog._table_flush is not None and not self.cog._table_flush.done():
+            await asyncio.sleep(0.05)
+
+    async def run(self) -> dict:
+        cache.setup("mem://")
+        for guild_id in range(100, 100 + self.args.guilds):
+            self.store.add_guild(guild_id=guild_id, channel_id=guild_id * 10)
+
+        monitor = asyncio.create_task(self.monitor_loop())
+        users = self.guild_users()
+        start = time.perf_counter()
+
+        await asyncio.gather(*(self.add(user, guild_id) for user, guild_id in users))
+
+        tables = defaultdict(list)
+        owners = {}
+        for guild_id in range(100, 100 + self.args.guilds):
+            event = self.store.get_guild(guild_id).event
+            for summary in self.store.get_table_summaries(event.id) if event else []:
+                tables[guild_id].append(summary.id)
+                owners[summary.owner_id] = summary.id
+                self.expected[summary.id]
+
+        await asyncio.gather(*(self.actions(user, guild_id, tables[guild_id]) for user, guild_id in users))
+
+        leaving = [(user, guild_id) for user, guild_id in users if self.rng.random() < self.args.remove]
+        await asyncio.gather(*(self.remove(user, guild_id) for user, guild_id in leaving))
+        for user, _ in leaving:
+            self.expected.pop(owners.get(user.id), None)
+
+        await asyncio.sleep(self.cog.table_update_delay)
+        await self.settle()
+        elapsed = time.perf_counter() - start
+        monitor.cancel()
+        return self.report(elapsed)
+
+    def check(self) -> dict:
+        # Expected rosters include the waitlist: which of them got a seat
+        # depends on the order clicks reached the store
+        store_mismatch, message_mismatch, stale, overfull = [], [], [], []
+        for table_id, users in self.expected.items():
+            table = self.store.get_table(table_id)
+            if table is None:
+                stale.append(table_id)
+                continue
+
+            roster = set(table.players)
+            waiting = [p.id for p in table.waitlist]
+            if roster | set(waiting) != users or roster & set(waiting):
+                store_mismatch.append(table_id)
+            seats = table.game.maxplayers
+            if len(roster) > seats or (waiting and len(roster) < seats):
+                overfull.append(table_id)
+
+            mentions = {p.mention for p in table.players.values()}
+            for message in table.messages:
+                shown = self.api.messages.get(message.id)
+                embed = shown.embeds[0] if shown and shown.embeds else None
+                fields = {f.name: f.value for f in embed.fields} if embed else {}
+                value = fields.get("Currently signed up to play:")
+                if message.type == MessageType.JOIN and set(value.split(", ") if value else []) != mentions:
+                    message_mismatch.append(message.id)
+
+        return {
+            "tables": len(self.expected),
+            "store_roster_mismatches": len(store_mismatch),
+            "seating_violations": len(overfull),
+            "message_roster_mismatches": len(message_mismatch),
+            "missing_tables": len(stale),
+        }
+
+    def report(self, elapsed: float) -> dict:
+        def summary(values):
+            if not values:
+                return {}
+            values = sorted(values)
+            q = statistics.quantiles(values, n=100, method="inclusive") if len(values) > 1 else values * 99
+            return {"count": len(values), "p50_ms": round(q[49] * 1000, 1), "p95_ms": round(q[94] * 1000, 1),
+                    "p99_ms": round(q[98] * 1000, 1), "max_ms": round(values[-1] * 1000, 1)}
+
+        operations = sum(len(v) for v in self.latencies.values())
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "operations": operations,
+            "throughput_ops_s": round(operations / elapsed, 1),
+            "latency": {op: summary(values) for op, values in sorted(self.latencies.items())},
+            "ack": {**summary(self.acks), "over_3s": sum(1 for a in self.acks if a > 3)},
+            "event_loop_lag": summary(self.lags),
+            "errors": dict(self.errors),
+            "throttled": dict(self.throttled),
+            "api_calls": dict(self.api.calls),
+            "rate_limited": dict(self.api.rate_limited),
+            "correctness": self.check(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=2)
+    parser.add_argument("--users", type=int, default=20, help="users in total, spread across the guilds")
+    parser.add_argument("--actions", type=int, default=10, help="join/leave/list actions per user")
+    parser.add_argument("--remove", type=float, default=0.25, help="fraction of users that remove their game")
+    parser.add_argument("--games", type=int, default=50, help="size of the fake game catalogue")
+    parser.add_argument("--think-ms", type=float, default=50, help="max pause between a user's actions")
+    parser.add_argument("--latency-ms", default="20-80", help="Discord API latency range")
+    parser.add_argument("--bgg-latency-ms", type=float, default=200)
+    parser.add_argument("--rate", type=int, default=5, help="requests per rate limit window per channel")
+    parser.add_argument("--per", type=float, default=5.0, help="rate limit window in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="SQLite file to use, a temporary one by default")
+    parser.add_argument("--shards", type=int, default=0, help="use a sharded store with this many temporary files")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+    result = asyncio.run(LoadTest(args).run())
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,23 +2,42 @@ import logging
 import discord
 import asyncio
 import functools
+import contextvars
+import dataclasses
+import os
 import sys
-from datetime import datetime, time, UTC
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, UTC
 from typing import Iterator
 
+import discord.ext.pages
 from discord.ext import commands
 from discord.commands import SlashCommandGroup
-from boardgamegeek import BGGClient, BGGRestrictSearchResultsTo
-from boardgamegeek.objects.games import BoardGame
 
 from store import *
 from store.local import SQLiteStore
+from store.archive import Archiver
+from store.backup import Backups
+from scheduler import Scheduler
+from recommend import Recommender
+import fuzzy
 from embeds import *
 from views import *
+from startup import startup, lazy_import
+from metrics import metrics
+from tracing import tracer
+from outbound import outbound, Priority
+from bgg import bgg_client
 
-from cashews import cache, noself
+from cashews import cache
 
-cache.setup("disk://?directory=/tmp/cache&timeout=1&shards=0")
+boardgamegeek = lazy_import("boardgamegeek")
+# Only needed by a command or two, or with several bot processes
+seating = lazy_import("seating")
+dump = lazy_import("store.dump")
+coordination = lazy_import("coordination")
 
 logger = logging.getLogger("boardgame.helper.games")
 
@@ -31,37 +50,95 @@ def is_guild_owner():
     return commands.check(predicate)
 
 class Meetup(commands.Cog):
-    def __init__(self, bot: discord.Bot, store: Store, bgg: BGGClient):
+    message_concurrency = 5
+    table_update_delay = 0.5
+    lookup_ttl = "24h"
+    event_sweep_interval = 3600
+    signup_lock = timedelta(0)  # How long before a scheduled meetup starts its signups close
+    bulk_delete_age = timedelta(days=14, minutes=-5)
+    summary_cache_size = 256  # Events whose games list pages are kept, least recently listed go first
+
+    def __init__(self, bot: discord.Bot, store: Store, bgg: "boardgamegeek.BGGClient" = None,
+                 archivers: list[Archiver] = (), backups: list[Backups] = ()):
         self.bot = bot
         self.store = store
-        self.bgg = bgg
+        self._bgg = bgg
+        self.archivers = list(archivers)  # One per database file
+        self.backups = list(backups)
+        self.scheduler = Scheduler(store)
+        self.recommender = Recommender(store)
+        self.catalog = fuzzy.FuzzyIndex()
+        self.scheduler.handle(JobType.CREATE, self.create_scheduled_event)
+        self.scheduler.handle(JobType.LOCK, self.lock_event)
+        self.scheduler.handle(JobType.SWEEP, self.sweep_events)
+        self.scheduler.handle(JobType.BACKUP, self.backup)
+        self._summary_pages: OrderedDict[str, tuple[int, list[GameSummaryEmbed]]] = OrderedDict()
+        self._table_changes: dict[str, TableChange] = {}
+        self._table_flush: asyncio.Task | None = None
+        self._promotions: list[TableChange] = []
+        self._lookups: dict[str, asyncio.Future] = {}
+        self._hydrated = False
+
+    @property
+    def bgg(self) -> "boardgamegeek.BGGClient":
+        if self._bgg is None:
+            self._bgg = bgg_client()
+        return self._bgg
 
     meetup = SlashCommandGroup("meetup", "meetup group")
     games = meetup.create_subgroup("games", "Manage games")
+    events = meetup.create_subgroup("events", "Manage meetups")
+    schedules = meetup.create_subgroup("schedule", "Manage recurring meetups")
     manage = meetup.create_subgroup("manage", "Manage games")
 
-    async def on_ready(self):
-        logger.info("Setting up events")
-        for event in self.store.get_all_events():
-            for table in list(event.tables.values()):
-                for message in table.messages:
-                    if message.type == MessageType.JOIN:
-                        logger.info("Add view for table %s - message %d",
-                                    table.id, message.id)
-                        self.bot.add_view(GameJoinView(
-                            table, self.store), message_id=message.id)
-                
+    async def event_choices(self, ctx: discord.AutocompleteContext):
+        typed = (ctx.value or "").lower()
+        events = self.store.get_active_events(ctx.interaction.guild_id)
+        return [discord.OptionChoice(event_label(event)[:100], event.id)
+                for event in events if typed in event_label(event).lower()]
+
+    def find_event(self, guild: Guild, event_id: str | None) -> Event | None:
+        # Without a choice commands act on the guild's next meetup
+        if event_id is None:
+            return guild.event
+        event = self.store.get_event(event_id=event_id)
+        if event is None or event.guild_id != guild.id or event.status != EventStatus.OPEN:
+            return None
+        return event
+
+    event_option = dict(description="Which meetup, defaults to the next one", autocomplete=event_choices,
+                        required=False, parameter_name="event_id")
+
+    async def game_choices(self, ctx: discord.AutocompleteContext):
+        return [match.name[:100] for match in self.catalog.search(ctx.value or "", n=25)]
+
+    async def table_choices(self, ctx: discord.AutocompleteContext):
+        typed = (ctx.value or "").lower()
+        guild = self.store.get_guild(ctx.interaction.guild_id)
+        event = self.find_event(guild, ctx.options.get("event")) if guild else None
+        if event is None:
+            return []
+        return [discord.OptionChoice(table.name[:100], table.id)
+                for table in self.store.get_table_summaries(event.id) if typed in table.name.lower()][:25]
+
+    async def schedule_choices(self, ctx: discord.AutocompleteContext):
+        typed = (ctx.value or "").lower()
+        return [discord.OptionChoice(f"{schedule.title} - every {schedule.every_days} days"[:100], str(schedule.id))
+                for schedule in self.store.get_schedules(ctx.interaction.guild_id) if typed in schedule.title.lower()]
+
     @commands.check_any(commands.is_owner(), is_guild_owner())
     @manage.command(name='reset', help='Reset the games')
     async def reset(self, ctx: discord.ApplicationContext):
         self.store.reset()
-        await ctx.defer()
+        with tracer.span("defer"):
+            await ctx.defer()
     
     @commands.check_any(commands.is_owner())
     @manage.command(name='sync', help='Resync bot commands')
     async def sync(self, ctx: discord.ApplicationContext):
         self.bot.sync_commands()
-        await ctx.defer()
+        with tracer.span("defer"):
+            await ctx.defer()
         
     @commands.check_any(commands.is_owner(), is_guild_owner())
     @manage.command(name='settings', help='Manage settings for this guild')
@@ -73,26 +150,154 @@ class Meetup(commands.Cog):
         self.bot.delete_messages()
 
         await view.wait()
-        logger.info("view.await() - role=%d channel=%d", view.role_choice, view.channel_choice)
+        logger.info("view.await() - role=%s channel=%s", view.role_choice, view.channel_choice)
     
+    @commands.check_any(commands.is_owner())
+    @manage.command(name='backup', help='Snapshot the bot database now')
+    async def backup_now(self, ctx: discord.ApplicationContext):
+        if not self.backups:
+            await ctx.respond("Backups are not set up", ephemeral=True)
+            return
+        # Through the scheduler, so it can't overlap with a scheduled one
+        self.scheduler.push(Job("backup", JobType.BACKUP, datetime.now(UTC)))
+        await ctx.respond("Backup started", ephemeral=True)
+
+    @commands.check_any(commands.is_owner(), is_guild_owner())
+    @manage.command(name='export', help='Download the meetup data of this server')
+    async def export(self, ctx: discord.ApplicationContext):
+        with tracer.span("defer"):
+            await ctx.defer(ephemeral=True)
+        guild_id = ctx.interaction.guild_id
+
+        def write(path: str):
+            conn = dump.connect(self.store.shard_for_guild(guild_id).db_path)
+            try:
+                with open(path, "w", encoding="utf-8") as out:
+                    return dump.export(conn, out, guild_id)
+            finally:
+                conn.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"meetup-{guild_id}.jsonl")
+            counts = await asyncio.get_running_loop().run_in_executor(None, write, path)
+            if os.path.getsize(path) > ctx.guild.filesize_limit:
+                await ctx.respond(content="Too big to upload here, export it with `python -m store.dump export` instead")
+                return
+            summary = ", ".join(f"{count} {kind}" for kind, count in counts.items())
+            await ctx.respond(content=f"Exported {summary}", file=discord.File(path))
+
     @commands.check_any(commands.is_owner(), is_guild_owner())
-    @manage.command(name='clean', help='Remove bot messages from today')
+    @manage.command(name='clean', help='Remove bot messages posted in this channel today')
     async def clean(self, ctx: discord.ApplicationContext):
-        start = datetime.combine(datetime.now(UTC), time.min)
-        channel = await self.bot.fetch_channel(ctx.channel_id)
-        await ctx.defer()
-        await channel.purge(after=start, check=lambda m: m.author == self.bot.user, bulk=False)
+        with tracer.span("defer"):
+            await ctx.defer(ephemeral=True)
+
+        # Today's messages in this channel, older ones belong to events that may still be open
+        start = datetime.combine(datetime.now(UTC), datetime.min.time(), tzinfo=UTC)
+        channels = {}
+        for message in self.store.get_messages_for_guild(ctx.guild_id, ctx.channel_id,
+                                                         discord.utils.time_snowflake(start)):
+            channels.setdefault(message.channel_id, []).append(message)
+
+        logger.info("Clean %d messages in %d channels for guild %s",
+                    sum(len(m) for m in channels.values()), len(channels), ctx.guild_id)
+        with outbound.priority(Priority.CLEANUP):
+            results = await asyncio.gather(*(self.delete_channel_messages(channel_id, messages)
+                                             for channel_id, messages in channels.items()))
+        deleted = [message for result in results for message in result]
+        if deleted:
+            self.store.delete_messages(deleted)
+
+        await ctx.respond(f"Removed {len(deleted)} messages", ephemeral=True)
+
+    @commands.check_any(commands.is_owner(), is_guild_owner())
+    @events.command(name='create', help='Schedule a meetup')
+    async def create_event(self, ctx: discord.ApplicationContext, title: str, date: str, time: str = "19:00"):
+        try:
+            scheduled_at = datetime.strptime(f"{date} {time}", "%Y-%m-%d %H:%M").replace(tzinfo=UTC)
+        except ValueError:
+            await ctx.respond("Use YYYY-MM-DD for the date and HH:MM (UTC) for the time", ephemeral=True)
+            return
+
+        guild = self.store.get_guild(ctx.guild_id) or self.store.add_guild(channel_id=ctx.channel_id, guild_id=ctx.guild_id)
+        event = self.store.add_event(guild=guild, title=title, scheduled_at=scheduled_at)
+        logger.info("Created event %s for guild %s at %s", event.id, ctx.guild_id, scheduled_at)
+        await ctx.respond(f"Scheduled {event_label(event)}", ephemeral=True)
+
+    @commands.check_any(commands.is_owner(), is_guild_owner())
+    @schedules.command(name='add', help='Create a meetup every few days, starting on a date')
+    async def add_schedule(self, ctx: discord.ApplicationContext, title: str, first_date: str, time: str = "19:00",
+                           every_days: int = 7, lead_days: int = 6):
+        try:
+            next_at = datetime.strptime(f"{first_date} {time}", "%Y-%m-%d %H:%M").replace(tzinfo=UTC)
+        except ValueError:
+            await ctx.respond("Use YYYY-MM-DD for the date and HH:MM (UTC) for the time", ephemeral=True)
+            return
+        if not 0 <= lead_days <= every_days or every_days < 1:
+            await ctx.respond("Meetups must repeat at least daily and be created at most one repeat ahead", ephemeral=True)
+            return
+
+        schedule = self.store.add_schedule(Schedule(ctx.guild_id, ctx.channel_id, title, next_at, every_days, lead_days))
+        self.scheduler.push(Job(f"create:{schedule.id}", JobType.CREATE, next_at - schedule.lead, str(schedule.id)))
+        logger.info("Added schedule %s for guild %s from %s", schedule.id, ctx.guild_id, next_at)
+        await ctx.respond(f"Scheduled {title} every {every_days} days, signups open {lead_days} days ahead", ephemeral=True)
+
+    @schedules.command(name='list', help='List recurring meetups')
+    async def list_schedules(self, ctx: discord.ApplicationContext):
+        schedules = self.store.get_schedules(ctx.guild_id)
+        if not schedules:
+            await ctx.respond("No recurring meetups for this server", ephemeral=True)
+            return
+        await ctx.respond("\n".join(f"- {s.title} every {s.every_days} days, next {s.next_at:%a %d %b %H:%M} UTC"
+                                    for s in schedules), ephemeral=True)
+
+    @commands.check_any(commands.is_owner(), is_guild_owner())
+    @schedules.command(name='remove', help='Stop a recurring meetup, meetups already created are kept')
+    @discord.option("schedule", str, autocomplete=schedule_choices, parameter_name="schedule_id")
+    async def remove_schedule(self, ctx: discord.ApplicationContext, schedule_id: str):
+        schedule = self.store.get_schedule(int(schedule_id)) if schedule_id.isdigit() else None
+        if schedule is None or schedule.guild_id != ctx.guild_id:
+            await ctx.respond("No such recurring meetup", ephemeral=True)
+            return
+        self.store.remove_schedule(schedule.id)
+        await ctx.respond(f"Stopped {schedule.title}", ephemeral=True)
+
+    @events.command(name='list', help='List upcoming meetups')
+    async def list_events(self, ctx: discord.ApplicationContext):
+        events = self.store.get_active_events(ctx.guild_id)
+        if not events:
+            await ctx.respond("No upcoming events for this server", ephemeral=True)
+            return
+        await ctx.respond("\n".join(f"- {event_label(event)}" for event in events), ephemeral=True)
+
+    @commands.check_any(commands.is_owner(), is_guild_owner())
+    @events.command(name='close', help='Close a meetup to new games and players')
+    @discord.option("event", str, **event_option)
+    async def close_event(self, ctx: discord.ApplicationContext, event_id: str = None):
+        guild = self.store.get_guild(ctx.guild_id)
+        event = self.find_event(guild, event_id) if guild else None
+        if event is None:
+            await ctx.respond("No upcoming events for this server", ephemeral=True)
+            return
+
+        self.store.set_event_status(event.id, EventStatus.CLOSED)
+        await ctx.respond(f"Closed {event_label(event)}", ephemeral=True)
 
     @games.command(name='add', help='Add a game you are bringing')
-    async def add_game(self, ctx: discord.ApplicationContext, game_name: str):
+    @discord.option("game_name", str, autocomplete=game_choices)
+    @discord.option("event", str, **event_option)
+    async def add_game(self, ctx: discord.ApplicationContext, game_name: str, event_id: str = None):
         user = ctx.author
         guild = ctx.guild
 
         try:
             guild = self.store.get_guild(guild.id) or self.store.add_guild(channel_id=ctx.channel_id, guild_id=guild.id)
-            event = guild.event
-            if event is None:
+            event = self.find_event(guild, event_id)
+            if event is None and event_id is None:
                 event = self.store.add_event(guild=guild)
+            if event is None:
+                await ctx.respond("That meetup isn't open for games", ephemeral=True, delete_after=5)
+                return
 
             logger.info(f"Add game {game_name} for user {user.id}, guild {guild.id}, event {event.id}")
 
@@ -102,22 +307,39 @@ class Meetup(commands.Cog):
                 await ctx.respond(response, ephemeral=True, delete_after=5)
                 return
 
-            await ctx.defer(ephemeral=True)
+            with tracer.span("defer"):
+                await ctx.defer(ephemeral=True)
             bgg_games = await self.async_lookup(name=game_name)
+            # Misspelt names find nothing on BGG, search again for what they most likely meant
+            query = game_name
+            if len(bgg_games) == 0:
+                query = self.catalog.rewrite(game_name) or game_name
+                if query != game_name:
+                    logger.info("Searching for %r instead of %r", query, game_name)
+                    bgg_games = await self.async_lookup(name=query)
+
+            # The lookup can be slow, check again in case a table was added meanwhile
+            if any(t.owner_id == user.id for t in self.store.get_table_summaries(event.id)):
+                await ctx.respond(content="You are already bringing a game")
+                return
 
             owner = self.store.get_player(user.id) or self.store.add_player(
                 Player(user.id, user.display_name, user.mention))
 
             if len(bgg_games) == 0:
-                await ctx.respond(content=f"Couldn't find game '{game_name}'")
+                suggestions = [match.name for match in self.catalog.search(game_name, n=3)]
+                hint = f" - did you mean {' or '.join(suggestions)}?" if suggestions else ""
+                await ctx.respond(content=f"Couldn't find game '{game_name}'{hint}")
                 return
 
-            if len(bgg_games) == 1:
+            # A corrected name is only a guess, the user confirms even a single match
+            if len(bgg_games) == 1 and query == game_name:
                 game = bgg_games[0]
             else:
                 view = GameChooseView(bgg_games)
+                found = f"Found {len(bgg_games)} games with the name '{query}'"
                 message = await ctx.respond(
-                    content=f"Found {len(bgg_games)} games with the name '{game_name}'",
+                    content=found if query == game_name else f"Couldn't find game '{game_name}'. {found}",
                     embed=GamesEmbed(game_name, bgg_games[:5]),
                     view=view,
                 )
@@ -129,38 +351,40 @@ class Meetup(commands.Cog):
                 game = view.choice
 
             game = self.store.add_game(game)
+            self.catalog.add(game.id, game.name, game.rank)
             table = self.store.add_table(event, owner, game)
             if guild.channel_id != ctx.channel_id:
-                add_msg = await ctx.respond(embed=GameEmbed(table))
+                add_msg = await ctx.respond(embed=GameEmbed.cached(table))
                 table = self.store.add_table_message(table, Message(add_msg.id, guild.id, ctx.channel_id, MessageType.ADD))
 
             channel = self.bot.get_channel(guild.channel_id)
-            join_view = GameJoinView(table, self.store)
             join_message = await channel.send(
                 content="Click to join",
-                embed=GameEmbed(table, list_players=True),
-                view=join_view
+                embed=GameEmbed.cached(table, list_players=True),
+                view=GameJoinView(table)
             )
-            join_view.message = join_message
-            table = self.store.add_table_message(table, Message(join_message.id, guild.id, ctx.channel_id, MessageType.JOIN))
+            # send() tracks the view by message id for the life of the process, the router needs none of it
+            self.bot._connection.prevent_view_updates_for(join_message.id)
+            table = self.store.add_table_message(table, Message(join_message.id, guild.id, join_message.channel.id, MessageType.JOIN))
         except Exception as e:
             logger.error("Failed to add game", exc_info=True)
             await ctx.respond(content="Failed", ephemeral=True, delete_after=5)
 
     @games.command(name='remove', help='Remove a game you were bringing')
-    async def remove_game(self, ctx: discord.ApplicationContext):
+    @discord.option("event", str, **event_option)
+    async def remove_game(self, ctx: discord.ApplicationContext, event_id: str = None):
         user = ctx.author
         guild = ctx.guild
         logger.info(f"Remove game for user {user.id}, guild {guild.id}")
 
         try:
             guild = self.store.get_guild(guild.id)
-            if guild is None or guild.event is None:
+            event = self.find_event(guild, event_id) if guild else None
+            if event is None:
                 response = f"No upcoming events for this server"
                 await ctx.respond(response)
                 return
             
-            event = guild.event
             tables = event.tables
             user_tables = [table for table in tables.values() if table.owner.id == user.id]
 
@@ -178,24 +402,7 @@ class Meetup(commands.Cog):
                 response = f"Sorry {players}, but {user.display_name} is not bringing {game.name} anymore!"
                 await ctx.respond(response, embeds=None)
 
-                messages = table.messages
-                if len(messages) == 0:
-                    continue
-
-                for message in messages:
-                    logger.debug("Process message %d for table %s", message.id, table.id)
-                    msg = self.bot.get_message(message.id)
-                    if not msg:
-                        logger.debug("Try find message %d for channel %d", message.id, message.channel_id)
-                        channel = await self.bot.fetch_channel(message.channel_id)
-                        message = await channel.fetch_message(message.id)
-                    
-                    if msg:
-                        await msg.edit(content=f"{user.mention} removed {game.name}", embed=None, view=None)
-                    else:
-                        logger.debug("Message %d not found - removing", message.id)
-                        self.store.delete_message(message)
-
+                # The table's messages are updated from the change feed
                 self.store.remove_table(table)
 
         except Exception as e:
@@ -203,7 +410,8 @@ class Meetup(commands.Cog):
             await ctx.respond(content="Failed", ephemeral=True, delete_after=5)
 
     @games.command(name='list', help='List games that people are bringing')
-    async def list_games(self, ctx: discord.ApplicationContext):
+    @discord.option("event", str, **event_option)
+    async def list_games(self, ctx: discord.ApplicationContext, event_id: str = None):
         user = ctx.author
         guild = ctx.guild
 
@@ -211,112 +419,477 @@ class Meetup(commands.Cog):
 
         try:
             guild = self.store.get_guild(guild.id)
-            if guild is None or guild.event is None:
+            event = self.find_event(guild, event_id) if guild else None
+            if event is None:
                 response = f"No upcoming events for this server"
                 await ctx.respond(response)
                 return
             
-            event = guild.event
-            if len(event.tables) == 0:
+            pages = self.summary_pages(event)
+            if len(pages) == 0:
                 response = f"No games yet for the next event"
                 await ctx.respond(response)
                 return
 
-            desc = ""
-            for table in event.tables.values():
-                game = table.game
-                players = list(table.players.values())
-                desc += f"[{game.name}]({game.link}) [{len(players)}/{game.maxplayers}] - {", ".join(
-                    [p.mention for p in players])}\n"
-
-            embed = discord.Embed(
-                title="Games being brought", description=desc)
-
-            await ctx.respond(embed=embed, ephemeral=True)
+            paginator = discord.ext.pages.Paginator(pages=pages)
+            await paginator.respond(ctx.interaction, ephemeral=True)
         except Exception as e:
             logger.error("Failed to list games", exc_info=True)
             await ctx.respond(content="Failed", ephemeral=True, delete_after=5)
 
     @games.command(name='players', help='List people that want to play your game')
-    async def list_players(self, ctx):
+    @discord.option("event", str, **event_option)
+    async def list_players(self, ctx, event_id: str = None):
         user = ctx.author
         guild = ctx.guild
         logger.info(f"List players for user {user.id}, guild {guild.id}")
 
         try:
             guild = self.store.get_guild(guild.id)
-            if guild is None or guild.event is None:
+            event = self.find_event(guild, event_id) if guild else None
+            if event is None:
                 response = f"No upcoming events for this server"
                 await ctx.respond(response, ephemeral=True)
                 return
             
-            event = guild.event
-            player = self.store.get_player(user.id)
-
-            table = event.tables[player.id]
+            user_tables = [table for table in event.tables.values() if table.owner.id == user.id]
+            table = user_tables[0] if user_tables else None
             if table is None:
                 response = f"{user.mention}, you are not bringing any games"
                 await ctx.respond(response, ephemeral=True)
                 return
 
-            await ctx.respond(embed=PlayerListEmbed(table), ephemeral=True)
+            await ctx.respond(embed=PlayerListEmbed.cached(table), ephemeral=True)
         except Exception as e:
             logger.error("Failed to list players", exc_info=True)
             await ctx.respond(content="Failed", ephemeral=True, delete_after=5)
 
     @games.command(name='join', help='Join a game that someone is bringing')
-    async def join_game(self, ctx: discord.ApplicationContext):
+    @discord.option("event", str, **event_option)
+    async def join_game(self, ctx: discord.ApplicationContext, event_id: str = None):
         user = ctx.author
         guild = ctx.guild
 
         try:
             guild = self.store.get_guild(guild.id)
-            if guild is None or guild.event is None:
+            event = self.find_event(guild, event_id) if guild else None
+            if event is None:
                 response = f"No upcoming events for this server"
                 await ctx.respond(response, ephemeral=True)
                 return
-            event = guild.event
 
-            tables = list(event.tables.values())
-            if len(tables) == 0:
+            view = GameListView(event=event, store=self.store)
+            if len(view.tables) == 0:
                 await ctx.respond(f"{user.mention}, No-one is bringing any games yet!", ephemeral=True)
                 return
 
-            embed = GameEmbed(tables[0])
-            view = GameListView(event=event, store=self.store)
-            msg = await ctx.respond("Pick a game", embed=embed, view=view, ephemeral=True)
+            msg = await ctx.respond(self.suggestions(user, view.tables) or "Pick a game", embed=view.embed(0), view=view,
+                                    ephemeral=True)
             view.message = msg
+            view.prerender()
 
             await view.wait()
             logger.info("view.await() - choice=%s", view.choice)
 
             if view.choice is not None:
-                player = self.store.get_player(user.id) or Player(
-                    user.id, user.display_name, user.mention)
-                table = tables[view.choice]
+                player = self.store.get_player(user.id) or self.store.add_player(
+                    Player(user.id, user.display_name, user.mention))
+                table = self.store.get_table(view.choice)
+                if table is None:
+                    await ctx.respond(f"{user.mention}, that game is no longer being brought", ephemeral=True)
+                    return
                 logger.info("user: %s/%s selected game %s", user.id,
                             user.display_name,  table.game.name)
                 self.store.join_table(player=player, table=table)
+                position = self.store.get_waitlist_position(table.id, player.id)
+                if position:
+                    await ctx.respond(f"{table.game.name} is full - you're #{position} on the waitlist", ephemeral=True)
 
         except Exception as e:
             logger.error("Failed to join game", exc_info=True)
             await ctx.respond(content="Failed", ephemeral=True, delete_after=5)
 
-    @noself(cache)(ttl="24h")
+    @games.command(name='prefer', help='Rank the games you would like to play, for auto-seating')
+    @discord.option("first", str, autocomplete=table_choices)
+    @discord.option("second", str, autocomplete=table_choices, required=False)
+    @discord.option("third", str, autocomplete=table_choices, required=False)
+    @discord.option("event", str, **event_option)
+    async def prefer_games(self, ctx: discord.ApplicationContext, first: str, second: str = None, third: str = None,
+                           event_id: str = None):
+        user = ctx.author
+        guild = self.store.get_guild(ctx.guild_id)
+        event = self.find_event(guild, event_id) if guild else None
+        if event is None:
+            await ctx.respond("No upcoming events for this server", ephemeral=True)
+            return
+
+        tables = {table.id: table for table in self.store.get_table_summaries(event.id)}
+        ranked = list(dict.fromkeys(table_id for table_id in (first, second, third) if table_id))
+        if not all(table_id in tables for table_id in ranked):
+            await ctx.respond("Pick games from the list", ephemeral=True)
+            return
+
+        player = self.store.get_player(user.id) or self.store.add_player(
+            Player(user.id, user.display_name, user.mention))
+        self.store.set_preferences(event.id, player.id, ranked)
+        choices = ", ".join(f"{rank}. {tables[table_id].name}" for rank, table_id in enumerate(ranked, start=1))
+        await ctx.respond(f"Your choices for {event_label(event)}: {choices}", ephemeral=True)
+
+    @commands.check_any(commands.is_owner(), is_guild_owner())
+    @games.command(name='seat', help="Seat players at games from their ranked choices")
+    @discord.option("apply", bool, description="Replace the rosters, otherwise only show the proposal",
+                    required=False, default=False)
+    @discord.option("event", str, **event_option)
+    async def seat_players(self, ctx: discord.ApplicationContext, apply: bool = False, event_id: str = None):
+        guild = self.store.get_guild(ctx.guild_id)
+        event = self.find_event(guild, event_id) if guild else None
+        if event is None:
+            await ctx.respond("No upcoming events for this server", ephemeral=True)
+            return
+        with tracer.span("defer"):
+            await ctx.defer(ephemeral=True)
+
+        tables = {table.id: table for table in self.store.get_table_summaries(event.id)}
+        # Owners aren't moved, the seats they have taken count against each table
+        owners = {table.owner_id for table in tables.values()}
+        preferences = {player_id: ranked for player_id, ranked in self.store.get_preferences(event.id).items()
+                       if player_id not in owners}
+        kept = {table_id: [player_id for player_id in players if player_id in owners]
+                for table_id, players in self.store.get_rosters(event.id).items()}
+        capacity = {}
+        for table in tables.values():
+            taken = len(kept.get(table.id, []))
+            capacity[table.id] = (max((table.minplayers or 0) - taken, 0),
+                                  max(table.maxplayers - taken, 0) if table.maxplayers else len(preferences))
+        with tracer.span("seat"):
+            plan = await run_sync_method(seating.seat, preferences, capacity)
+        if apply:
+            self.store.seat_players(event.id, plan.tables)
+        logger.info("Seating for event %s: %d players, %d unseated, %d tables dropped (applied: %s)",
+                    event.id, len(preferences), len(plan.unseated), len(plan.dropped), apply)
+
+        rosters = {table_id: kept.get(table_id, []) + players for table_id, players in plan.tables.items()}
+        proposal = [dataclasses.replace(table, players=len(rosters[table.id]),
+                                        mentions=", ".join(f"<@{player_id}>" for player_id in rosters[table.id]))
+                    for table in tables.values()]
+        title = f"{event_label(event)} ({'seated' if apply else 'proposed seating'})"
+        choices = ", ".join(f"{count} got choice {rank}" for rank, count in sorted(plan.choices.items()))
+        lines = [f"Seated {len(preferences) - len(plan.unseated)} of {len(preferences)} players" +
+                 (f": {choices}" if choices else "")]
+        if plan.unseated:
+            lines.append("No seat: " + ", ".join(f"<@{player_id}>" for player_id in plan.unseated))
+        if plan.dropped:
+            lines.append("Not enough players: " + ", ".join(tables[table_id].name for table_id in plan.dropped))
+        content = "\n".join(lines)
+        if len(content) > 2000:
+            content = content[:1997] + "..."
+
+        pages = GameSummaryEmbed.pages(proposal, title=title)
+        if not pages:
+            await ctx.respond(content, ephemeral=True)
+            return
+        paginator = discord.ext.pages.Paginator(pages=[discord.ext.pages.Page(content=content, embeds=[page])
+                                                       for page in pages])
+        await paginator.respond(ctx.interaction, ephemeral=True)
+
+    def suggestions(self, user: discord.User, tables: list[TableSummary]) -> str | None:
+        # From the picker's snapshot, loading each table's game and players again costs a query per table
+        names = {table.game_id: table.name for table in tables
+                 if table.owner_id != user.id and user.mention not in table.mentions.split(", ")}
+        games = self.recommender.recommend(user.id, names)
+        if not games:
+            return None
+        return "Players like you also joined " + ", ".join(names[game_id] for game_id, _ in games) + " - pick a game"
+
+    async def load_catalog(self):
+        # Built off the event loop and swapped in whole, games added meanwhile go into both
+        catalog = fuzzy.FuzzyIndex()
+        loop = asyncio.get_running_loop()
+        sources = [self.store.game_names] + ([functools.partial(fuzzy.load_csv, fuzzy.catalog_path)] if fuzzy.catalog_path else [])
+        for source in sources:
+            await loop.run_in_executor(None, lambda: catalog.add_all(source()))
+        catalog.add_all(zip(self.catalog.ids, self.catalog.names, self.catalog.ranks))
+        self.catalog = catalog
+        logger.info("Loaded %d game names", len(catalog))
+
+    async def load_recommendations(self):
+        # Every archiver moves events into the same archive file, reading one reads them all
+        await self.recommender.load(self.store.signup_history,
+                                    *[archiver.signup_history for archiver in self.archivers[:1]])
+
+    def summary_pages(self, event: Event) -> list[GameSummaryEmbed]:
+        # Pages are rebuilt only when the event version has moved on, which
+        # every join/leave/add/remove does
+        version = self.store.get_event_version(event.id)
+        cached = self._summary_pages.get(event.id)
+        if cached is not None and cached[0] == version:
+            self._summary_pages.move_to_end(event.id)
+            return cached[1]
+
+        pages = GameSummaryEmbed.pages(self.store.get_table_summaries(event.id), title=event_label(event))
+        self._summary_pages[event.id] = (version, pages)
+        self._summary_pages.move_to_end(event.id)
+        # Closed and archived events are never listed again, so they age out
+        if len(self._summary_pages) > self.summary_cache_size:
+            self._summary_pages.popitem(last=False)
+        return pages
+
+    async def run_scheduler(self):
+        # The sweep pushes its own next run, it only needs seeding once
+        self.scheduler.push(Job("sweep", JobType.SWEEP, datetime.now(UTC)), replace=False)
+        if self.backups and Backups.interval:
+            self.scheduler.push(Job("backup", JobType.BACKUP, datetime.now(UTC)), replace=False)
+        await self.scheduler.run()
+
+    async def create_scheduled_event(self, job: Job):
+        schedule = self.store.get_schedule(int(job.target))
+        if schedule is None:
+            return
+
+        now = datetime.now(UTC)
+        starts = schedule.next_at
+        # Meetups missed while the bot was down are skipped rather than created late
+        while starts <= now:
+            starts += schedule.every
+        if starts - schedule.lead > now:
+            self.store.update_schedule(schedule.id, starts)
+            self.scheduler.push(Job(job.key, JobType.CREATE, starts - schedule.lead, job.target))
+            return
+
+        guild = self.store.get_guild(schedule.guild_id) or self.store.add_guild(schedule.guild_id, schedule.channel_id)
+        event = self.store.add_event(guild=guild, title=schedule.title, scheduled_at=starts)
+        self.scheduler.push(Job(f"lock:{event.id}", JobType.LOCK, starts - self.signup_lock, event.id))
+        self.store.update_schedule(schedule.id, starts + schedule.every)
+        self.scheduler.push(Job(job.key, JobType.CREATE, starts + schedule.every - schedule.lead, job.target))
+        logger.info("Created event %s for schedule %s at %s", event.id, schedule.id, starts)
+        await self.post_signup(schedule, event)
+
+    async def post_signup(self, schedule: Schedule, event: Event):
+        channel = self.bot.get_partial_messageable(schedule.channel_id)
+        try:
+            with outbound.priority(Priority.ROSTER):
+                message = await channel.send(embed=SignupEmbed(event))
+        except discord.HTTPException as e:
+            logger.warning("Could not post signups for event %s in channel %s: %s", event.id, schedule.channel_id, e)
+            return
+        self.store.add_message(Message(message.id, schedule.guild_id, schedule.channel_id, MessageType.SIGNUP))
+
+    async def lock_event(self, job: Job):
+        event = self.store.get_event(event_id=job.target)
+        if event is not None and event.status == EventStatus.OPEN:
+            self.store.set_event_status(event.id, EventStatus.CLOSED)
+            logger.info("Closed signups for event %s", event.id)
+
+    async def sweep_events(self, job: Job):
+        self.scheduler.push(Job(job.key, JobType.SWEEP, datetime.now(UTC) + timedelta(seconds=self.event_sweep_interval)))
+        closed = self.store.close_past_events(datetime.now(UTC) - self.store.event_grace)
+        if closed:
+            logger.info("Closed %d past events", closed)
+        for archiver in self.archivers:
+            archived, purged = await run_sync_method(archiver.run)
+            metrics.inc("archived_events_total", archived, action="archived")
+            metrics.inc("archived_events_total", purged, action="purged")
+
+    async def backup(self, job: Job):
+        if Backups.interval:
+            self.scheduler.push(Job(job.key, JobType.BACKUP, datetime.now(UTC) + Backups.interval))
+        for backups in self.backups:
+            with metrics.timer("backup_seconds"):
+                try:
+                    await run_sync_method(backups.run)
+                except Exception:
+                    metrics.inc("backups_total", status="error")
+                    raise
+            metrics.inc("backups_total", status="ok")
+
+    def on_remote_change(self, change: TableChange):
+        # Games other processes added go into this one's catalogue too
+        if change.type == ChangeType.ADD:
+            table = self.store.get_table(change.table_id)
+            if table is not None:
+                self.catalog.add(table.game.id, table.game.name, table.game.rank)
+
+    async def hydrate_guilds(self):
+        # bot.guilds only has the guilds on this process's shards, so with
+        # several processes the loading and rendering is split between them
+        if self._hydrated:
+            return
+        self._hydrated = True
+        start = time.perf_counter()
+        tables = 0
+        for guild in self.bot.guilds:
+            for event in self.store.get_active_events(guild.id):
+                self.summary_pages(event)
+                for table in event.tables.values():
+                    GameEmbed.cached(table, list_players=True)
+                    tables += 1
+            await asyncio.sleep(0)
+        logger.info("Rendered %d tables of %d guilds in %.2fs", tables, len(self.bot.guilds), time.perf_counter() - start)
+
+    def on_table_change(self, change: TableChange):
+        # New tables have no messages yet - add_game posts them itself
+        if change.type == ChangeType.ADD:
+            return
+
+        # Changes are coalesced per table: a burst of joins on one table
+        # results in a single edit of each of its messages
+        self._table_changes[change.table_id] = change
+        if change.type == ChangeType.PROMOTE:
+            self._promotions.append(change)
+        if self._table_flush is None or self._table_flush.done():
+            self._table_flush = asyncio.create_task(self.flush_table_changes())
+
+    async def flush_table_changes(self):
+        # Changes that arrive while a flush is editing messages don't start a
+        # new task, so keep going until nothing is left
+        while self._table_changes or self._promotions:
+            await asyncio.sleep(self.table_update_delay)
+            changes, self._table_changes = self._table_changes, {}
+            promotions, self._promotions = self._promotions, []
+            logger.debug("Flush changes for %d tables", len(changes))
+
+            with outbound.priority(Priority.ROSTER):
+                results = await asyncio.gather(*(self.push_table_change(change) for change in changes.values()),
+                                               *(self.notify_promoted(change) for change in promotions),
+                                               return_exceptions=True)
+            missing = []
+            for change, result in zip([*changes.values(), *promotions], results):
+                if isinstance(result, BaseException):
+                    logger.error("Failed to update messages for table %s", change.table_id, exc_info=result)
+                else:
+                    missing.extend(result)
+            if missing:
+                self.store.delete_messages(missing)
+
+    async def notify_promoted(self, change: TableChange) -> list[Message]:
+        table = self.store.get_table(change.table_id)
+        if table is None:
+            return []
+        try:
+            channel = await self.bot.create_dm(discord.Object(change.player_id))
+            await channel.send(f"A seat opened up - you're now playing {table.game.name} at {event_label(table.event)}")
+        except discord.HTTPException:
+            logger.warning("Could not tell player %s they were seated at table %s", change.player_id, table.id,
+                           exc_info=True)
+        return []
+
+    async def push_table_change(self, change: TableChange) -> list[Message]:
+        if change.type == ChangeType.REMOVE:
+            return await self.edit_messages(list(change.messages), content="Table removed", embed=None, view=None)
+
+        table = self.store.get_table(change.table_id)
+        if table is None:
+            return []
+
+        messages = table.messages
+        join = [m for m in messages if m.type == MessageType.JOIN]
+        add = [m for m in messages if m.type == MessageType.ADD]
+        results = await asyncio.gather(
+            self.edit_messages(join, embed=GameEmbed.cached(table, list_players=True), view=GameJoinView(table)),
+            self.edit_messages(add, embed=GameEmbed.cached(table)),
+        )
+        return [message for result in results for message in result]
+
+    def partial_message(self, message: Message, channels: dict) -> discord.PartialMessage:
+        channel = channels.get(message.channel_id)
+        if channel is None:
+            channel = self.bot.get_channel(message.channel_id) or self.bot.get_partial_messageable(message.channel_id)
+            channels[message.channel_id] = channel
+        return channel.get_partial_message(message.id)
+
+    async def edit_messages(self, messages: list[Message], **fields) -> list[Message]:
+        # Edits are sent straight to the message id, so there is no fetch
+        # round trip; returns the messages Discord no longer has.
+        semaphore = asyncio.Semaphore(self.message_concurrency)
+        channels = {}
+
+        async def edit(message: Message) -> Message | None:
+            async with semaphore:
+                logger.debug("Edit message %d in channel %d", message.id, message.channel_id)
+                try:
+                    await self.partial_message(message, channels).edit(**fields)
+                except discord.NotFound:
+                    logger.debug("Message %d not found - removing", message.id)
+                    return message
+                except discord.HTTPException:
+                    logger.warning("Failed to edit message %d", message.id, exc_info=True)
+            return None
+
+        results = await asyncio.gather(*(edit(message) for message in messages))
+        return [message for message in results if message is not None]
+
+    async def delete_channel_messages(self, channel_id: int, messages: list[Message]) -> list[Message]:
+        # Returns the messages that are gone from Discord, whether we deleted
+        # them or they had already been removed.
+        try:
+            channel = self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
+        except discord.NotFound:
+            logger.debug("Channel %d not found - dropping %d messages", channel_id, len(messages))
+            return messages
+
+        # Discord only bulk deletes messages younger than 14 days
+        cutoff = datetime.now(UTC) - self.bulk_delete_age
+        recent = [m for m in messages if discord.utils.snowflake_time(m.id) > cutoff]
+        single = [m for m in messages if discord.utils.snowflake_time(m.id) <= cutoff]
+
+        deleted = []
+        for chunk in [recent[i:i + 100] for i in range(0, len(recent), 100)]:
+            try:
+                await channel.delete_messages([discord.Object(m.id) for m in chunk])
+                deleted.extend(chunk)
+            except discord.HTTPException:
+                logger.debug("Bulk delete failed in channel %d - deleting one by one", channel_id, exc_info=True)
+                single.extend(chunk)
+
+        for message in single:
+            try:
+                await channel.get_partial_message(message.id).delete()
+            except discord.NotFound:
+                pass
+            except discord.HTTPException:
+                logger.warning("Failed to delete message %d", message.id, exc_info=True)
+                continue
+            deleted.append(message)
+
+        return deleted
+
     async def async_lookup(self, name=None, id=None) -> Iterator[Game]:
-        return await run_sync_method(self.lookup, name=name, id=id)
+        key = f"lookup:name={name}:id={id}"
+        pending = self._lookups.get(key)
+        if pending is None:
+            games = await cache.get(key)
+            if games is not None:
+                metrics.inc("lookup_cache_total", result="hit")
+                return games
+            pending = self._lookups.get(key)
+
+        # Concurrent lookups for the same game wait on the one BGG request
+        if pending is not None:
+            metrics.inc("lookup_cache_total", result="coalesced")
+            return await asyncio.shield(pending)
+
+        metrics.inc("lookup_cache_total", result="miss")
+        pending = self._lookups[key] = asyncio.ensure_future(run_sync_method(self.lookup, name=name, id=id))
+        try:
+            games = await asyncio.shield(pending)
+            await cache.set(key, games, expire=self.lookup_ttl)
+            return games
+        finally:
+            self._lookups.pop(key, None)
 
     def lookup(self, name=None, id=None) -> Iterator[Game]:
         logger.info("doing lookup id=%s name=%s", id, name)
 
         if id:
-            game = bgg_to_game(self.bgg.game(game_id=id))
+            with metrics.timer("bgg_request_seconds", endpoint="thing"), tracer.span("bgg.thing"):
+                game = bgg_to_game(self.bgg.game(game_id=id))
             return [game] if game else []
         if name:
-            search = self.bgg.search(
-                name, search_type=[BGGRestrictSearchResultsTo.BOARD_GAME,
-                                   BGGRestrictSearchResultsTo.BOARD_GAME_EXPANSION]
-            )
+            with metrics.timer("bgg_request_seconds", endpoint="search"), tracer.span("bgg.search"):
+                search = self.bgg.search(
+                    name, search_type=[boardgamegeek.BGGRestrictSearchResultsTo.BOARD_GAME,
+                                       boardgamegeek.BGGRestrictSearchResultsTo.BOARD_GAME_EXPANSION]
+                )
 
             logger.info("found %d games for search %s", len(search), name)
 
@@ -324,13 +897,14 @@ class Meetup(commands.Cog):
             games = []
 
             for group in [ids[i:i + 20] for i in range(0, len(ids), 20)]:
-                gs = self.bgg.game_list(group)
+                with metrics.timer("bgg_request_seconds", endpoint="thing_list"), tracer.span("bgg.thing_list"):
+                    gs = self.bgg.game_list(group)
                 games.extend(bgg_to_game(bg) for bg in gs)
 
             return sorted(games, key=lambda g: g.rank or sys.maxsize)
 
 
-def bgg_to_game(bg: BoardGame) -> Game:
+def bgg_to_game(bg: "boardgamegeek.objects.games.BoardGame") -> Game:
     if bg is None:
         return None
 
@@ -349,13 +923,46 @@ def bgg_to_game(bg: BoardGame) -> Game:
     )
 
 def setup(bot):
-    store = SQLiteStore()
-    meetup = Meetup(bot, store, BGGClient(timeout=10))
-    bot.add_listener(meetup.on_ready, "on_ready")
+    with startup.phase("store"):
+        # bot.py only imports store.sharded when the store is sharded
+        sharded = sys.modules.get("store.sharded")
+        store = sharded.ShardedStore() if sharded and sharded.ShardedStore.shard_count else SQLiteStore()
+    metrics.instrument_store(store)
+    tracer.instrument_store(store)
+    shards = getattr(store, "shards", [store])
+    meetup = Meetup(bot, store, archivers=[Archiver(shard.db_path) for shard in shards],
+                    backups=[Backups(each.db_path) for each in getattr(store, "stores", [store])])
+    store.changes.subscribe(meetup.on_table_change)
+    store.changes.subscribe(meetup.recommender.on_table_change)
+    bot.add_listener(GameJoinRouter(store).on_interaction, "on_interaction")
+    bot.add_listener(meetup.hydrate_guilds, "on_ready")
+    # Processes that only run some of the shards keep each other's caches current
+    if getattr(bot, "shard_ids", None) is not None:
+        coordinator = coordination.Coordinator(store.db_path)
+        store.changes.subscribe(coordinator.on_table_change)
+        coordinator.remote.subscribe(meetup.recommender.on_table_change)
+        coordinator.remote.subscribe(meetup.on_remote_change)
+        startup.defer("coordination", coordinator.run)
     bot.add_cog(meetup)
 
+    # Serve lookups from memory until the disk cache has been opened
+    cache.setup("mem://")
+    startup.defer("cache", setup_cache)
+    startup.defer("store warmup", store.warmup)
+    startup.defer("bgg client", lambda: meetup.bgg)
+    startup.defer("scheduler", meetup.run_scheduler)
+    startup.defer("recommendations", meetup.load_recommendations)
+    startup.defer("game catalog", meetup.load_catalog)
+
+
+async def setup_cache():
+    cache.setup("disk://?directory=/tmp/cache&timeout=1&shards=0")
+    await cache.init()
+
 
 async def run_sync_method(func, *args, **kwargs):
     loop = asyncio.get_running_loop()
     func_call = functools.partial(func, *args, **kwargs)
-    return await loop.run_in_executor(None, func_call)
+    # Carry the caller's context (and with it the current trace) into the executor
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, context.run, func_call)
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger("boardgame.helper.metrics")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format(name: str, labels: tuple, value: float, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if pairs:
+        escaped = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                           for k, v in pairs)
+        return f"{name}{{{escaped}}} {value:g}"
+    return f"{name} {value:g}"
+
+
+class Metrics:
+    prefix = "bhb_"
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.types: dict[str, str] = {}
+        self.help: dict[str, str] = {}
+        self.values: dict[str, dict[tuple, float]] = {}
+        self.histograms: dict[str, dict[tuple, list]] = {}
+        self.started: dict[int, float] = {}
+
+    def describe(self, name: str, kind: str, help: str):
+        self.types[name] = kind
+        self.help[name] = help
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = _labels(labels)
+        with self.lock:
+            series = self.values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.values.setdefault(name, {})[_labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = _labels(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            # per-bucket counts followed by sum and count
+            data = series.get(key)
+            if data is None:
+                data = series[key] = [0] * (len(BUCKETS) + 3)
+            data[bisect_left(BUCKETS, value)] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def _timer(self, name: str, labels: dict):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timer(self, name: str, **labels):
+        if not self.enabled:
+            return nullcontext()
+        return self._timer(name, labels)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.values.items()):
+                full = self.prefix + name
+                lines.append(f"# HELP {full} {self.help.get(name, name)}")
+                lines.append(f"# TYPE {full} {self.types.get(name, 'counter')}")
+                lines.extend(_format(full, labels, value) for labels, value in sorted(series.items()))
+
+            for name, series in sorted(self.histograms.items()):
+                full = self.prefix + name
+                lines.append(f"# HELP {full} {self.help.get(name, name)}")
+                lines.append(f"# TYPE {full} histogram")
+                for labels, data in sorted(series.items()):
+                    total = 0
+                    for bound, count in zip(BUCKETS + (float("inf"),), data):
+                        total += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(_format(f"{full}_bucket", labels, total, (("le", le),)))
+                    lines.append(_format(f"{full}_sum", labels, data[-2]))
+                    lines.append(_format(f"{full}_count", labels, data[-1]))
+        return "\n".join(lines) + "\n"
+
+    # Slash commands
+
+    def attach(self, bot):
+        bot.add_listener(self.on_application_command, "on_application_command")
+        bot.add_listener(self.on_application_command_completion, "on_application_command_completion")
+        bot.add_listener(self.on_application_command_error, "on_application_command_error")
+
+    async def on_application_command(self, ctx):
+        if not self.enabled:
+            return
+        self.started[ctx.interaction.id] = time.perf_counter()
+
+    def _command_done(self, ctx, status: str):
+        start = self.started.pop(ctx.interaction.id, None)
+        command = ctx.command.qualified_name if ctx.command else "unknown"
+        self.inc("commands_total", command=command, status=status)
+        if start is not None:
+            self.observe("command_seconds", time.perf_counter() - start, command=command)
+
+    async def on_application_command_completion(self, ctx):
+        self._command_done(ctx, "ok")
+
+    async def on_application_command_error(self, ctx, error):
+        self._command_done(ctx, "error")
+
+    # Store
+
+    def instrument_store(self, store):
+        if not self.enabled:
+            return
+
+        def trace(statement: str):
+            verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+            self.inc("store_queries_total", statement=verb)
+
+        # A sharded store has a connection per file
+        for each in getattr(store, "stores", [store]):
+            each.conn.set_trace_callback(trace)
+
+    # Event loop and HTTP endpoint
+
+    async def monitor_loop(self, interval: float = 1.0):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(loop.time() - start - interval, 0.0)
+            self.set("event_loop_lag_seconds", lag)
+            self.observe("event_loop_lag_seconds_distribution", lag)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9100):
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8",
+                                headers={"X-Content-Type-Options": "nosniff"})
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info("serving metrics on http://%s:%d/metrics", host, port)
+        asyncio.create_task(self.monitor_loop(), name="metrics-event-loop-lag")
+
+
+metrics = Metrics()
+metrics.describe("commands_total", "counter", "Slash commands handled, by command and status")
+metrics.describe("command_seconds", "histogram", "Slash command latency")
+metrics.describe("command_rejected_total", "counter", "Commands and clicks turned away, by reason (in_flight, throttled)")
+metrics.describe("view_callback_seconds", "histogram", "View and button callback latency")
+metrics.describe("bgg_request_seconds", "histogram", "BoardGameGeek API latency, by endpoint")
+metrics.describe("lookup_cache_total", "counter", "Game lookups by cache result (hit, miss, coalesced)")
+metrics.describe("archived_events_total", "counter", "Finished events moved to the archive or purged from it, by action")
+metrics.describe("backups_total", "counter", "Database snapshots taken, by status")
+metrics.describe("backup_seconds", "histogram", "Time taken to snapshot and check the database")
+metrics.describe("scheduler_jobs_total", "counter", "Scheduled jobs run, by type and status")
+metrics.describe("scheduler_lag_seconds", "histogram", "How late scheduled jobs ran after they were due")
+metrics.describe("store_queries_total", "counter", "SQLite statements executed, by statement type")
+metrics.describe("outbound_requests_total", "counter", "Discord REST calls, by priority and route")
+metrics.describe("outbound_merged_total", "counter", "Message edits folded into a queued edit of the same message")
+metrics.describe("outbound_queue_depth", "gauge", "Discord REST calls waiting for rate limit budget, by priority")
+metrics.describe("outbound_wait_seconds", "histogram", "Time Discord REST calls waited for rate limit budget")
+metrics.describe("event_loop_lag_seconds", "gauge", "Most recent event loop scheduling lag")
+metrics.describe("event_loop_lag_seconds_distribution", "histogram", "Event loop scheduling lag")
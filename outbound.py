@@ -0,0 +1,214 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+
+from metrics import metrics
+
+logger = logging.getLogger("boardgame.helper.outbound")
+
+
+class Priority(IntEnum):
+    INTERACTION = 0
+    ROSTER = 1
+    CLEANUP = 2
+
+
+current: ContextVar[Priority] = ContextVar("priority", default=Priority.INTERACTION)
+
+# Budgets are (requests, seconds) per route and major parameter. They sit at or
+# below Discord's documented limits so our own queue, not the library's bucket
+# lock, decides which call goes next.
+MESSAGE = "/channels/{channel_id}/messages/{message_id}"
+LIMITS = {
+    ("POST", "/channels/{channel_id}/messages"): (5, 5.0),
+    ("PATCH", MESSAGE): (5, 5.0),
+    ("DELETE", MESSAGE): (5, 1.0),
+    ("POST", "/channels/{channel_id}/messages/bulk-delete"): (1, 1.0),
+}
+DEFAULT_LIMIT = (5, 1.0)
+GLOBAL_LIMIT = (50, 1.0)
+
+
+class Budget:
+    def __init__(self, limit: int, per: float):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def wait(self, now: float) -> float:
+        if now >= self.reset_at:
+            self.remaining, self.reset_at = self.limit, now + self.per
+        return 0.0 if self.remaining > 0 else self.reset_at - now
+
+
+class Request:
+    __slots__ = ("priority", "seq", "send", "route", "args", "kwargs", "merge", "future", "queued")
+
+    def __init__(self, priority: Priority, seq: int, send, route, args, kwargs, merge):
+        self.priority = priority
+        self.seq = seq
+        self.send = send
+        self.route = route
+        self.args = args
+        self.kwargs = kwargs
+        self.merge = merge
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued = time.monotonic()
+
+    def __lt__(self, other: "Request") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Bucket:
+    def __init__(self, limit: int, per: float):
+        self.budget = Budget(limit, per)
+        self.pending: list[Request] = []
+        self.edits: dict[str, Request] = {}
+
+
+class Outbound:
+    def __init__(self, limits: dict | None = None, global_limit: tuple[int, float] = GLOBAL_LIMIT):
+        self.limits = {**LIMITS, **(limits or {})}
+        self.buckets: dict[str, Bucket] = {}
+        self.budget = Budget(*global_limit)
+        self.depth = Counter()
+        self.seq = itertools.count()
+        self.sending: set[asyncio.Task] = set()
+        # Buckets with queued requests, all drained by one task so the global
+        # budget goes to the most urgent of them whichever route it is for
+        self.waiting: set[Bucket] = set()
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    @contextmanager
+    def priority(self, priority: Priority):
+        token = current.set(priority)
+        try:
+            yield
+        finally:
+            current.reset(token)
+
+    # Every REST call the bot makes goes through HTTPClient.request.
+    # Interaction responses and followups use the webhook adapter instead and
+    # are never queued here.
+
+    def attach(self, bot):
+        bot.http.request = self.wrap(bot.http.request)
+
+    def wrap(self, send):
+        @functools.wraps(send)
+        async def request(route, *args, **kwargs):
+            return await self.submit(send, route, *args, **kwargs)
+        return request
+
+    def bucket(self, route) -> Bucket:
+        key = f"{route.method} {route.bucket}"
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            limit = self.limits.get((route.method, route.path), DEFAULT_LIMIT)
+            bucket = self.buckets[key] = Bucket(*limit)
+        return bucket
+
+    @staticmethod
+    def merge_key(route, args, kwargs) -> str | None:
+        # Only plain JSON message edits can be folded into one another
+        if route.method == "PATCH" and route.path == MESSAGE and not args \
+                and set(kwargs) == {"json"} and isinstance(kwargs["json"], dict):
+            return route.url
+        return None
+
+    def _set_depth(self, priority: Priority, change: int):
+        self.depth[priority] += change
+        metrics.set("outbound_queue_depth", self.depth[priority], priority=priority.name.lower())
+
+    async def submit(self, send, route, *args, **kwargs):
+        priority = current.get()
+        bucket = self.bucket(route)
+        merge = self.merge_key(route, args, kwargs)
+
+        queued = bucket.edits.get(merge) if merge else None
+        if queued is not None:
+            # A later edit of the same message replaces one still waiting, fields
+            # it doesn't set keep the earlier value just as two PATCHes would
+            queued.kwargs["json"] = {**queued.kwargs["json"], **kwargs["json"]}
+            if priority < queued.priority:
+                self._set_depth(queued.priority, -1)
+                self._set_depth(priority, 1)
+                queued.priority = priority
+                heapq.heapify(bucket.pending)
+            metrics.inc("outbound_merged_total", route=route.path)
+            return await asyncio.shield(queued.future)
+
+        metrics.inc("outbound_requests_total", priority=priority.name.lower(), route=route.path)
+        now = time.monotonic()
+        if not self.waiting and bucket.budget.wait(now) == 0 and self.budget.wait(now) == 0:
+            bucket.budget.remaining -= 1
+            self.budget.remaining -= 1
+            metrics.observe("outbound_wait_seconds", 0.0, priority=priority.name.lower())
+            return await send(route, *args, **kwargs)
+
+        request = Request(priority, next(self.seq), send, route, args, kwargs, merge)
+        heapq.heappush(bucket.pending, request)
+        if merge:
+            bucket.edits[merge] = request
+        self._set_depth(priority, 1)
+        self.waiting.add(bucket)
+        self.wakeup.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.drain())
+        return await asyncio.shield(request.future)
+
+    async def drain(self):
+        while self.waiting:
+            # Cleared before looking so a request queued meanwhile is not missed
+            self.wakeup.clear()
+            now = time.monotonic()
+            wait = self.budget.wait(now)
+            if wait == 0:
+                ready = [bucket for bucket in self.waiting if bucket.budget.wait(now) == 0]
+                if ready:
+                    self.dispatch(min(ready, key=lambda bucket: bucket.pending[0]), now)
+                    continue
+                wait = min(bucket.budget.wait(now) for bucket in self.waiting)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def dispatch(self, bucket: Bucket, now: float):
+        request = heapq.heappop(bucket.pending)
+        if not bucket.pending:
+            self.waiting.discard(bucket)
+        if request.merge and bucket.edits.get(request.merge) is request:
+            del bucket.edits[request.merge]
+        bucket.budget.remaining -= 1
+        self.budget.remaining -= 1
+        self._set_depth(request.priority, -1)
+        metrics.observe("outbound_wait_seconds", now - request.queued, priority=request.priority.name.lower())
+        task = asyncio.create_task(self.send(request))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+
+    async def send(self, request: Request):
+        try:
+            result = await request.send(request.route, *request.args, **request.kwargs)
+        except asyncio.CancelledError:
+            request.future.cancel()
+            raise
+        except Exception as e:
+            request.future.set_exception(e)
+            # Nobody may be waiting any more, so don't warn about it being unretrieved
+            request.future.exception()
+        else:
+            request.future.set_result(result)
+
+
+outbound = Outbound()
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import math
+from collections import Counter, defaultdict
+from typing import Iterable
+
+from store import ChangeType, Store, TableChange
+
+logger = logging.getLogger("boardgame.helper.recommend")
+
+
+class Recommender:
+    # Item-item similarity over who signed up for what. The player x game
+    # matrix is kept sparse as each player's set of games, and the game x game
+    # co-occurrence counts are updated one signup at a time, so nothing is ever
+    # recomputed from scratch.
+
+    def __init__(self, store: Store = None):
+        self.store = store
+        self.games: dict[int, set[int]] = {}
+        self.players = Counter()
+        self.together: dict[int, Counter] = defaultdict(Counter)
+        self.pending: list[tuple[int, int]] | None = None
+
+    def add(self, player_id: int, game_id: int) -> bool:
+        games = self.games.setdefault(player_id, set())
+        if game_id in games:
+            return False
+        for other in games:
+            self.together[game_id][other] += 1
+            self.together[other][game_id] += 1
+        games.add(game_id)
+        self.players[game_id] += 1
+        return True
+
+    def add_all(self, signups: Iterable[tuple[int, int]]) -> int:
+        return sum(self.add(player_id, game_id) for player_id, game_id in signups)
+
+    def observe(self, player_id: int, game_id: int):
+        # Signups seen while a load is running are applied once it finishes
+        if self.pending is not None:
+            self.pending.append((player_id, game_id))
+        else:
+            self.add(player_id, game_id)
+
+    async def load(self, *sources):
+        """Rebuild from `sources`, callables returning (player, game) pairs, in an executor."""
+        self.pending = []
+        fresh = Recommender()
+        loop = asyncio.get_running_loop()
+        try:
+            for source in sources:
+                await loop.run_in_executor(None, lambda: fresh.add_all(source()))
+        finally:
+            pending, self.pending = self.pending, None
+        self.games, self.players, self.together = fresh.games, fresh.players, fresh.together
+        self.add_all(pending)
+        logger.info("Loaded signups of %d players for %d games", len(self.games), len(self.players))
+
+    def on_table_change(self, change: TableChange):
+        if change.type not in (ChangeType.JOIN, ChangeType.PROMOTE, ChangeType.SEAT):
+            return
+        table = self.store.get_table(change.table_id)
+        if table is None:
+            return
+        players = [change.player_id] if change.player_id is not None else list(table.players)
+        for player_id in players:
+            self.observe(player_id, table.game_id)
+
+    def similarity(self, a: int, b: int) -> float:
+        # Cosine similarity of the two games' player columns
+        together = self.together.get(a, {}).get(b, 0)
+        return together / math.sqrt(self.players[a] * self.players[b]) if together else 0.0
+
+    def similar(self, game_id: int, n: int = 5) -> list[tuple[int, float]]:
+        scores = {other: self.similarity(game_id, other) for other in self.together.get(game_id, {})}
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+    def recommend(self, player_id: int, candidates: Iterable[int], n: int = 3) -> list[tuple[int, float]]:
+        """Rank `candidates` by how similar they are to the games the player joined before."""
+        history = self.games.get(player_id)
+        if not history:
+            return []
+        scores = {}
+        for game_id in set(candidates):
+            score = sum(self.similarity(game_id, played) for played in history if played != game_id)
+            if score > 0:
+                scores[game_id] = score
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:n]
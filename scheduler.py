@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, UTC
+
+from metrics import metrics
+from store import Job, JobType, Store
+
+logger = logging.getLogger("boardgame.helper.scheduler")
+
+
+class Scheduler:
+    # One task serves every guild: it sleeps until the earliest due job in the
+    # store, so nothing needs loading on restart and idle guilds cost nothing
+    batch_size = 100
+    max_sleep = 3600.0
+    retry_delay = timedelta(minutes=5)
+    # How long a claimed job is left to its process before another may run it,
+    # the claim is renewed while the handler runs so long jobs keep it
+    claim_timeout = timedelta(minutes=10)
+
+    def __init__(self, store: Store):
+        self.store = store
+        self.handlers = {}
+        self.wakeup = asyncio.Event()
+
+    def handle(self, type: JobType, handler):
+        """Run the coroutine function `handler(job)` for jobs of `type`."""
+        self.handlers[type] = handler
+
+    def push(self, job: Job, replace: bool = True):
+        self.store.push_job(job, replace)
+        # Cheaper to let the loop look again than to track what it is waiting for
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            # Cleared before looking so a push while jobs run is not missed
+            self.wakeup.clear()
+            now = datetime.now(UTC)
+            jobs = self.store.get_due_jobs(now, self.batch_size)
+            for job in jobs:
+                # Every bot process sharing the store runs a scheduler, the
+                # claim makes sure only one of them runs each job
+                claimed = self.store.claim_job(job, now + self.claim_timeout)
+                if claimed is None:
+                    continue
+                metrics.observe("scheduler_lag_seconds", max((now - job.due_at).total_seconds(), 0), type=job.type.name.lower())
+                await self.execute(claimed, now)
+            if len(jobs) == self.batch_size:
+                continue
+
+            due = self.store.get_next_due()
+            delay = self.max_sleep if due is None else (due - datetime.now(UTC)).total_seconds()
+            if delay <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), min(delay, self.max_sleep))
+            except asyncio.TimeoutError:
+                pass
+
+    async def renew(self, claim: list[Job]):
+        # Only a process that died stops renewing, so only its jobs are run again elsewhere
+        while True:
+            await asyncio.sleep(self.claim_timeout.total_seconds() / 2)
+            renewed = self.store.claim_job(claim[0], datetime.now(UTC) + self.claim_timeout)
+            if renewed is None:
+                # Pushed again while running, the new due time stands
+                return
+            claim[0] = renewed
+
+    async def execute(self, job: Job, now: datetime):
+        handler = self.handlers.get(job.type)
+        claim = [job]
+        renewal = asyncio.create_task(self.renew(claim))
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for {job.type.name} jobs")
+            await handler(job)
+        except Exception:
+            logger.exception("Scheduled %s job %s failed, retrying in %s", job.type.name, job.key, self.retry_delay)
+            metrics.inc("scheduler_jobs_total", type=job.type.name.lower(), status="error")
+            self.store.push_job(Job(job.key, job.type, now + self.retry_delay, job.target))
+            return
+        finally:
+            renewal.cancel()
+        metrics.inc("scheduler_jobs_total", type=job.type.name.lower(), status="ok")
+        self.store.complete_job(claim[0])
@@ -0,0 +1,234 @@
+"""Seats players at tables from their ranked preferences.
+
+Seating is a min-cost flow: each player sends one unit of flow to one of the
+tables they ranked (cheaper the higher they ranked it) or, failing that, to a
+costly "unseated" edge. Each table's seats up to `minplayers` carry a bonus,
+so flow fills games up to their minimum before topping others up. A table that
+still can't reach its minimum is dropped and the rest are solved again.
+
+    python seating.py --players 500 --tables 40
+"""
+import argparse
+import heapq
+import logging
+import random
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+
+logger = logging.getLogger("boardgame.helper.seating")
+
+UNSEATED_COST = 10_000
+MIN_SEAT_BONUS = 1_000
+INF = float("inf")
+
+
+def rank_cost(rank: int) -> int:
+    # Convex, so two people on their second choice beat one on their first
+    # and one on their third
+    return (rank - 1) ** 2
+
+
+class MinCostFlow:
+    def __init__(self, nodes: int):
+        self.graph: list[list[list]] = [[] for _ in range(nodes)]
+
+    def add_edge(self, u: int, v: int, capacity: int, cost: int) -> tuple[int, int]:
+        # Edges are [to, residual capacity, cost, index of the reverse edge]
+        self.graph[u].append([v, capacity, cost, len(self.graph[v])])
+        self.graph[v].append([u, 0, -cost, len(self.graph[u]) - 1])
+        return u, len(self.graph[u]) - 1
+
+    def flow(self, edge: tuple[int, int]) -> int:
+        u, i = edge
+        v, _, _, rev = self.graph[u][i]
+        return self.graph[v][rev][1]
+
+    def _potentials(self, source: int) -> list[float]:
+        # Bellman-Ford (SPFA) once, as the bonus edges have negative costs
+        dist = [INF] * len(self.graph)
+        dist[source] = 0
+        queue, queued = deque([source]), {source}
+        while queue:
+            u = queue.popleft()
+            queued.discard(u)
+            for v, capacity, cost, _ in self.graph[u]:
+                if capacity and dist[u] + cost < dist[v]:
+                    dist[v] = dist[u] + cost
+                    if v not in queued:
+                        queue.append(v)
+                        queued.add(v)
+        return [0 if d == INF else d for d in dist]
+
+    def _dijkstra(self, source: int, potential: list[float]) -> list[float]:
+        dist = [INF] * len(self.graph)
+        dist[source] = 0
+        heap = [(0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for v, capacity, cost, _ in self.graph[u]:
+                nd = d + cost + potential[u] - potential[v]
+                if capacity and nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+
+    def solve(self, source: int, sink: int) -> int:
+        # Primal-dual: after each shortest path round, push as much flow as
+        # possible along zero reduced cost edges, Dinic style, before the next.
+        # Costs are a handful of small integers, so there are few rounds.
+        potential = self._potentials(source)
+        total = 0
+        while True:
+            dist = self._dijkstra(source, potential)
+            if dist[sink] == INF:
+                return total
+            for v, d in enumerate(dist):
+                if d < INF:
+                    potential[v] += d
+
+            while True:
+                level = self._levels(source, potential)
+                if level[sink] < 0:
+                    break
+                pointer = [0] * len(self.graph)
+                while pushed := self._augment(source, sink, INF, level, potential, pointer):
+                    total += pushed
+
+    def _admissible(self, u: int, edge: list, potential: list[float]) -> bool:
+        v, capacity, cost, _ = edge
+        return capacity > 0 and potential[u] + cost == potential[v]
+
+    def _levels(self, source: int, potential: list[float]) -> list[int]:
+        level = [-1] * len(self.graph)
+        level[source] = 0
+        queue = deque([source])
+        while queue:
+            u = queue.popleft()
+            for edge in self.graph[u]:
+                if level[edge[0]] < 0 and self._admissible(u, edge, potential):
+                    level[edge[0]] = level[u] + 1
+                    queue.append(edge[0])
+        return level
+
+    def _augment(self, u: int, sink: int, limit: float, level, potential, pointer) -> int:
+        if u == sink:
+            return limit
+        edges = self.graph[u]
+        while pointer[u] < len(edges):
+            edge = edges[pointer[u]]
+            v = edge[0]
+            if level[v] == level[u] + 1 and self._admissible(u, edge, potential):
+                pushed = self._augment(v, sink, min(limit, edge[1]), level, potential, pointer)
+                if pushed:
+                    edge[1] -= pushed
+                    self.graph[v][edge[3]][1] += pushed
+                    return pushed
+            pointer[u] += 1
+        return 0
+
+
+@dataclass
+class Seating:
+    tables: dict[str, list[int]] = field(default_factory=dict)
+    unseated: list[int] = field(default_factory=list)
+    dropped: list[str] = field(default_factory=list)  # Tables that couldn't reach their minimum
+    choices: Counter = field(default_factory=Counter)  # Players seated at their 1st, 2nd... choice
+
+
+def solve(preferences: dict[int, list[str]], capacity: dict[str, tuple[int, int]]) -> Seating:
+    players = list(preferences)
+    tables = list(capacity)
+    source, sink = 0, 1
+    player_node = {player: 2 + i for i, player in enumerate(players)}
+    table_node = {table: 2 + len(players) + i for i, table in enumerate(tables)}
+    graph = MinCostFlow(2 + len(players) + len(tables))
+
+    seats = {}
+    for player in players:
+        graph.add_edge(source, player_node[player], 1, 0)
+        graph.add_edge(player_node[player], sink, 1, UNSEATED_COST)
+        for rank, table in enumerate(preferences[player], start=1):
+            if table in table_node:
+                seats[player, table] = (rank, graph.add_edge(player_node[player], table_node[table], 1, rank_cost(rank)))
+    for table in tables:
+        low, high = capacity[table]
+        low = min(low, high)
+        if low:
+            graph.add_edge(table_node[table], sink, low, -MIN_SEAT_BONUS)
+        if high > low:
+            graph.add_edge(table_node[table], sink, high - low, 0)
+
+    graph.solve(source, sink)
+    seating = Seating(tables={table: [] for table in tables})
+    seated = set()
+    for (player, table), (rank, edge) in seats.items():
+        if graph.flow(edge):
+            seating.tables[table].append(player)
+            seating.choices[rank] += 1
+            seated.add(player)
+    seating.unseated = [player for player in players if player not in seated]
+    return seating
+
+
+def seat(preferences: dict[int, list[str]], capacity: dict[str, tuple[int, int]]) -> Seating:
+    """Assign each player to at most one of their ranked tables.
+
+    `capacity` maps table ids to (minplayers, maxplayers) for the players
+    being seated.
+    """
+    capacity = dict(capacity)
+    dropped = []
+    while True:
+        seating = solve(preferences, capacity)
+        short = [table for table, players in seating.tables.items() if 0 < len(players) < capacity[table][0]]
+        if not short:
+            # Dropped tables are part of the result, with nobody at them
+            seating.tables.update((table, []) for table in dropped)
+            seating.dropped = dropped
+            return seating
+        # Drop the emptiest game and let its players move to their other choices
+        table = min(short, key=lambda t: (len(seating.tables[t]), t))
+        logger.debug("table %s can't reach %d players, dropping it", table, capacity[table][0])
+        dropped.append(table)
+        del capacity[table]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=500)
+    parser.add_argument("--tables", type=int, default=40)
+    parser.add_argument("--choices", type=int, default=3, help="tables each player ranks")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tables = [f"table-{i}" for i in range(args.tables)]
+    capacity = {}
+    for table in tables:
+        low = rng.randint(2, 4)
+        capacity[table] = (low, rng.randint(low, 8))
+    # Some games are far more popular than others
+    weights = [1 / (i + 1) ** 0.5 for i in range(args.tables)]
+    preferences = {}
+    for player in range(args.players):
+        ranked = []
+        while len(ranked) < min(args.choices, args.tables):
+            table = rng.choices(tables, weights)[0]
+            if table not in ranked:
+                ranked.append(table)
+        preferences[player] = ranked
+
+    start = time.perf_counter()
+    seating = seat(preferences, capacity)
+    elapsed = time.perf_counter() - start
+    seated = sum(len(players) for players in seating.tables.values())
+    print(f"{args.players} players, {args.tables} tables: seated {seated}, unseated {len(seating.unseated)}, "
+          f"dropped {len(seating.dropped)} tables, choices {dict(sorted(seating.choices.items()))} "
+          f"in {elapsed * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
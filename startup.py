@@ -0,0 +1,91 @@
+import asyncio
+import importlib
+import importlib.util
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("boardgame.helper.startup")
+
+
+def lazy_import(name: str):
+    """Import a module on first attribute access instead of at import time."""
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'")
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+class Startup:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases: dict[str, float] = {}
+        self.deferred: list[tuple[str, callable]] = []
+        self.tasks: list[asyncio.Task] = []
+        self.first_command: float | None = None
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.monotonic() - start
+            logger.info("startup phase %s took %.3fs", name, self.phases[name])
+
+    def defer(self, name: str, func):
+        """Run `func` (sync or async) in the background once the bot has connected."""
+        self.deferred.append((name, func))
+
+    def attach(self, bot):
+        bot.add_listener(self.on_connect, "on_connect")
+        bot.add_listener(self.on_ready, "on_ready")
+        bot.add_listener(self.on_application_command_completion, "on_application_command_completion")
+
+    async def _run(self, name: str, func):
+        start = time.monotonic()
+        try:
+            if asyncio.iscoroutinefunction(func):
+                await func()
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, func)
+        except Exception:
+            logger.error("deferred startup task %s failed", name, exc_info=True)
+        finally:
+            self.phases[name] = time.monotonic() - start
+            logger.info("deferred startup task %s took %.3fs", name, self.phases[name])
+
+    async def on_connect(self):
+        self.phases.setdefault("connect", self.elapsed())
+        logger.info("connected %.3fs after start", self.phases["connect"])
+
+        deferred, self.deferred = self.deferred, []
+        for name, func in deferred:
+            self.tasks.append(asyncio.create_task(self._run(name, func), name=f"startup-{name}"))
+
+    async def on_ready(self):
+        self.phases.setdefault("ready", self.elapsed())
+        logger.info("ready %.3fs after start", self.phases["ready"])
+
+    async def on_application_command_completion(self, ctx):
+        if self.first_command is None:
+            self.first_command = self.elapsed()
+            logger.info("first command /%s served %.3fs after start - phases: %s",
+                        ctx.command.qualified_name, self.first_command,
+                        ", ".join(f"{name}={took:.3f}s" for name, took in self.phases.items()))
+
+
+startup = Startup()
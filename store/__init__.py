@@ -2,7 +2,8 @@
 from abc import ABC, abstractmethod
 
 from dataclasses import dataclass, field
-from typing import Dict, Optional
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional
 from enum import IntEnum
 import uuid
 
@@ -25,6 +26,21 @@ class Game:
     def link(self) -> str:
         return f"https://boardgamegeek.com/boardgame/{self.id}" 
 
+@dataclass(frozen=True)
+class TableSummary:
+    id: str
+    owner_id: int
+    game_id: int
+    name: str
+    minplayers: int
+    maxplayers: int
+    players: int
+    mentions: str
+
+    @property
+    def link(self) -> str:
+        return f"https://boardgamegeek.com/boardgame/{self.game_id}"
+
 @dataclass(unsafe_hash=True)
 class Player:
     id: int
@@ -40,12 +56,30 @@ class Table:
     players: Dict[str, Player] = field(default_factory=dict)
     messages: Optional[list["Message"]] = field(default_factory=list)
     id: str = field(default_factory=lambda: str(uuid.uuid4()))  # Generate unique ID per instance
+    version: int = 0  # Bumped on every roster change
+    waitlist: list[Player] = field(default_factory=list)  # In the order they will be seated
+
+class EventStatus(IntEnum):
+    OPEN = 1 # Taking games and players
+    CLOSED = 2 # Over, or closed by an organiser
+    CANCELLED = 3
 
 @dataclass(frozen=False)
 class Event:
     id: str
     guild: "Guild"
     tables: Dict[str, Table] = field(default_factory=dict)
+    title: Optional[str] = None
+    scheduled_at: Optional[datetime] = None  # UTC
+    status: EventStatus = EventStatus.OPEN
+    closed_at: Optional[datetime] = None  # UTC
+    active_at: Optional[datetime] = None  # UTC, last change to the event or its tables
+
+def event_label(event) -> str:
+    title = event.title or "Meetup"
+    if event.scheduled_at is None:
+        return title
+    return f"{title} - {event.scheduled_at:%a %d %b %H:%M} UTC"
 
 @dataclass(frozen=False)
 class Guild:
@@ -70,9 +104,74 @@ class Message:
 class MessageType(IntEnum):
     JOIN = 1 # Join view messages
     ADD = 2 # Game added view messages
+    SIGNUP = 3 # Signup header of a scheduled meetup
+
+@dataclass
+class Schedule:
+    guild_id: int
+    channel_id: int
+    title: str
+    next_at: datetime  # UTC start of the next meetup still to be created
+    every_days: int = 7
+    lead_days: int = 6  # How long before it starts each meetup is created
+    id: Optional[int] = None
+
+    @property
+    def every(self) -> timedelta:
+        return timedelta(days=self.every_days)
+
+    @property
+    def lead(self) -> timedelta:
+        return timedelta(days=self.lead_days)
+
+class JobType(IntEnum):
+    CREATE = 1 # Create a schedule's next event and post its signup header
+    LOCK = 2 # Close an event's signups once it starts
+    SWEEP = 3 # Close past events and archive finished ones
+    BACKUP = 4 # Snapshot the database
+
+@dataclass
+class Job:
+    key: str  # One pending job per key, pushing it again moves it
+    type: JobType
+    due_at: datetime  # UTC
+    target: Optional[str] = None
+
+class ChangeType(IntEnum):
+    ADD = 1 # Table added to an event
+    JOIN = 2 # Player joined a table
+    LEAVE = 3 # Player left a table
+    REMOVE = 4 # Table removed from an event
+    WAITLIST = 5 # Player queued for a full table
+    PROMOTE = 6 # Player seated from the waitlist
+    SEAT = 7 # Roster replaced by auto-seating
+
+@dataclass(frozen=True)
+class TableChange:
+    type: ChangeType
+    table_id: str
+    player_id: Optional[int] = None
+    messages: tuple[Message, ...] = ()  # Messages of a removed table
+
+class ChangeFeed:
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, callback) -> None:
+        self.subscribers.append(callback)
+
+    def publish(self, change: TableChange) -> None:
+        logger.debug("publish %s for table %s", change.type.name, change.table_id)
+        for callback in self.subscribers:
+            try:
+                callback(change)
+            except Exception:
+                logger.error("Subscriber failed for %s on table %s", change.type.name, change.table_id, exc_info=True)
 
 class Store(ABC):
-    
+    changes: ChangeFeed
+    event_grace: timedelta  # How long after its start an event still counts as upcoming
+
     @abstractmethod
     def add_guild(self, guild_id: int, channel_id: int, role_id:int = None) -> Guild:
         pass
@@ -94,13 +193,81 @@ class Store(ABC):
         pass
     
     @abstractmethod
-    def add_event(self, guild: Guild, event_id: str = None) -> Event:
+    def add_event(self, guild: Guild, event_id: str = None, title: str = None, scheduled_at: datetime = None) -> Event:
         pass
     
     @abstractmethod
     def get_event(self, guild_id: int = None, event_id: int = None) -> list[Event]:
         pass
 
+    @abstractmethod
+    def get_next_event(self, guild_id: int, since: datetime = None) -> Optional[Event]:
+        pass
+
+    @abstractmethod
+    def get_active_events(self, guild_id: int, since: datetime = None) -> list[Event]:
+        pass
+
+    @abstractmethod
+    def set_event_status(self, event_id: str, status: EventStatus) -> None:
+        pass
+
+    @abstractmethod
+    def close_past_events(self, before: datetime) -> int:
+        pass
+
+    @abstractmethod
+    def add_schedule(self, schedule: Schedule) -> Schedule:
+        pass
+
+    @abstractmethod
+    def get_schedule(self, schedule_id: int) -> Optional[Schedule]:
+        pass
+
+    @abstractmethod
+    def get_schedules(self, guild_id: int) -> list[Schedule]:
+        pass
+
+    @abstractmethod
+    def update_schedule(self, schedule_id: int, next_at: datetime) -> None:
+        pass
+
+    @abstractmethod
+    def remove_schedule(self, schedule_id: int) -> None:
+        pass
+
+    @abstractmethod
+    def push_job(self, job: Job, replace: bool = True) -> None:
+        pass
+
+    @abstractmethod
+    def get_due_jobs(self, now: datetime, limit: int) -> list[Job]:
+        pass
+
+    @abstractmethod
+    def get_next_due(self) -> Optional[datetime]:
+        pass
+
+    @abstractmethod
+    def claim_job(self, job: Job, until: datetime) -> Optional[Job]:
+        pass
+
+    @abstractmethod
+    def complete_job(self, job: Job) -> None:
+        pass
+
+    @abstractmethod
+    def signup_history(self) -> Iterator[tuple[int, int]]:
+        pass
+
+    @abstractmethod
+    def game_names(self) -> Iterator[tuple[int, str, int]]:
+        pass
+
+    @abstractmethod
+    def shard_for_guild(self, guild_id: int) -> "Store":
+        pass
+
     @abstractmethod
     def get_all_events(self) -> list[Event]:
         pass
@@ -108,6 +275,14 @@ class Store(ABC):
     @abstractmethod
     def remove_event(self, event: Event) -> None:
         pass
+
+    @abstractmethod
+    def get_event_version(self, event_id: str) -> int:
+        pass
+
+    @abstractmethod
+    def get_table_summaries(self, event_id: str) -> list[TableSummary]:
+        pass
     
     @abstractmethod
     def add_table(self, event: Event, owner: Player, game: Game) -> Table:
@@ -125,6 +300,30 @@ class Store(ABC):
     def leave_table(self, player: Player, table: Table) -> Table:
         pass
 
+    @abstractmethod
+    def get_waitlist_for_table(self, table_id: str) -> list[Player]:
+        pass
+
+    @abstractmethod
+    def get_waitlist_position(self, table_id: str, player_id: int) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def set_preferences(self, event_id: str, player_id: int, table_ids: list[str]) -> None:
+        pass
+
+    @abstractmethod
+    def get_preferences(self, event_id: str) -> dict[int, list[str]]:
+        pass
+
+    @abstractmethod
+    def get_rosters(self, event_id: str) -> dict[str, list[int]]:
+        pass
+
+    @abstractmethod
+    def seat_players(self, event_id: str, seating: dict[str, list[int]]) -> None:
+        pass
+
     @abstractmethod
     def remove_table(self, table: Table) -> None:
         pass
@@ -169,10 +368,18 @@ class Store(ABC):
     def get_message(self, message_id: int) -> Message:
         pass
 
+    @abstractmethod
+    def get_messages_for_guild(self, guild_id: int, channel_id: int = None, after: int = None) -> list[Message]:
+        pass
+
     @abstractmethod
     def delete_message(self, message: Message) -> None:
         pass
 
+    @abstractmethod
+    def delete_messages(self, messages: list[Message]) -> None:
+        pass
+
     @abstractmethod
     def reset() -> None:
         pass
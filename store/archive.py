@@ -0,0 +1,140 @@
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta, UTC
+from typing import Iterator, Optional
+
+from . import EventStatus
+from .local import _timestamp
+
+logger = logging.getLogger("boardgame.helper.store.archive")
+
+
+class Archiver:
+    # Finished events move to their own file so the hot database only holds
+    # what the bot can still show or change
+    archive_path = "bhb-archive.sqlite"
+    archive_after = timedelta(days=30)
+    # How long archived events are kept, None keeps them forever
+    retention: Optional[timedelta] = None
+    batch_size = 50
+
+    def __init__(self, db_path: str = "bhb.sqlite"):
+        self.db_path = db_path
+
+    def connect(self) -> sqlite3.Connection:
+        # Its own connection so it can run in an executor alongside the store's
+        conn = sqlite3.connect(self.db_path, autocommit=True, timeout=30)
+        conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS archive.event (
+                id TEXT PRIMARY KEY,
+                guild_id INTEGER NOT NULL,
+                channel_id INTEGER NOT NULL,
+                title TEXT,
+                scheduled_at TEXT,
+                closed_at TEXT,
+                status INTEGER NOT NULL,
+                archived_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS archive.event_table (
+                id TEXT PRIMARY KEY,
+                event_id TEXT NOT NULL,
+                owner_id INTEGER NOT NULL,
+                game_id INTEGER NOT NULL,
+                players TEXT,
+                messages TEXT
+            );
+            CREATE INDEX IF NOT EXISTS archive.event_guild_schedule ON event (guild_id, scheduled_at);
+            CREATE INDEX IF NOT EXISTS archive.event_archived ON event (archived_at);
+            CREATE INDEX IF NOT EXISTS archive.event_table_event ON event_table (event_id);
+        """)
+        return conn
+
+    def signup_history(self) -> Iterator[tuple[int, int]]:
+        # (player, game) pairs of archived tables
+        if not os.path.exists(self.archive_path):
+            return
+        conn = sqlite3.connect(self.archive_path)
+        try:
+            for players, game_id in conn.execute("SELECT players, game_id FROM event_table WHERE players IS NOT NULL"):
+                for player_id in players.split(","):
+                    yield int(player_id), game_id
+        finally:
+            conn.close()
+
+    def run(self, now: datetime = None) -> tuple[int, int]:
+        now = now or datetime.now(UTC)
+        conn = self.connect()
+        try:
+            archived = self.archive(conn, now)
+            purged = self.purge(conn, now) if self.retention else 0
+        finally:
+            conn.close()
+        if archived or purged:
+            logger.info("Archived %d events, purged %d", archived, purged)
+        return archived, purged
+
+    def archive(self, conn: sqlite3.Connection, now: datetime) -> int:
+        cutoff = _timestamp(now - self.archive_after)
+        archived = 0
+        while True:
+            ids = [row[0] for row in conn.execute("""
+                SELECT id FROM event
+                WHERE status IN (?, ?) AND coalesce(closed_at, scheduled_at) < ?
+                LIMIT ?
+            """, (EventStatus.CLOSED, EventStatus.CANCELLED, cutoff, self.batch_size))]
+            if not ids:
+                return archived
+            self._move(conn, ids, _timestamp(now))
+            archived += len(ids)
+
+    def _move(self, conn: sqlite3.Connection, ids: list[str], archived_at: str):
+        events = ",".join("?" * len(ids))
+        tables = f"SELECT id FROM _table WHERE event_id IN ({events})"
+        # One short write transaction per batch, so the bot is never locked
+        # out of the hot database for long
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"""
+                INSERT OR REPLACE INTO archive.event
+                SELECT id, guild_id, channel_id, title, scheduled_at, closed_at, status, ?
+                FROM event WHERE id IN ({events})
+            """, (archived_at, *ids))
+            conn.execute(f"""
+                INSERT OR REPLACE INTO archive.event_table
+                SELECT t.id, t.event_id, t.owner_id, t.game_id,
+                       (SELECT group_concat(player_id) FROM table_player WHERE table_id = t.id),
+                       (SELECT group_concat(message_id) FROM table_message WHERE table_id = t.id)
+                FROM _table t WHERE t.event_id IN ({events})
+            """, ids)
+            conn.execute(f"DELETE FROM message WHERE id IN (SELECT message_id FROM table_message WHERE table_id IN ({tables}))", ids)
+            conn.execute(f"DELETE FROM table_message WHERE table_id IN ({tables})", ids)
+            conn.execute(f"DELETE FROM table_player WHERE table_id IN ({tables})", ids)
+            conn.execute(f"DELETE FROM table_waitlist WHERE table_id IN ({tables})", ids)
+            conn.execute(f"DELETE FROM table_preference WHERE table_id IN ({tables})", ids)
+            conn.execute(f"DELETE FROM _table WHERE event_id IN ({events})", ids)
+            conn.execute(f"DELETE FROM event WHERE id IN ({events})", ids)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def purge(self, conn: sqlite3.Connection, now: datetime) -> int:
+        cutoff = _timestamp(now - self.retention)
+        purged = 0
+        while True:
+            ids = [row[0] for row in conn.execute(
+                "SELECT id FROM archive.event WHERE archived_at < ? LIMIT ?", (cutoff, self.batch_size))]
+            if not ids:
+                return purged
+            events = ",".join("?" * len(ids))
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(f"DELETE FROM archive.event_table WHERE event_id IN ({events})", ids)
+                conn.execute(f"DELETE FROM archive.event WHERE id IN ({events})", ids)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            purged += len(ids)
@@ -0,0 +1,154 @@
+"""Online snapshots of the bot's SQLite database.
+
+    python -m store.backup create bhb.sqlite
+    python -m store.backup list bhb.sqlite
+    python -m store.backup restore backups/bhb-20260101-030000.sqlite bhb.sqlite
+"""
+import argparse
+import glob
+import logging
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta, UTC
+from typing import Optional
+
+logger = logging.getLogger("boardgame.helper.store.backup")
+
+
+class _Restarted(Exception):
+    pass
+
+
+class Backups:
+    # Snapshots are copied a few pages at a time with the backup API, the
+    # source is only read locked while a step runs, so the bot keeps writing
+    backup_dir = "backups"
+    keep = 7
+    # How often the bot takes one, None leaves it to the command line
+    interval: Optional[timedelta] = timedelta(days=1)
+    pages = 256
+    pause = 0.005
+    # A write from another connection restarts the copy, after this many it
+    # is finished in one step instead
+    max_restarts = 3
+
+    def __init__(self, db_path: str = "bhb.sqlite"):
+        self.db_path = db_path
+        self.name = os.path.splitext(os.path.basename(db_path))[0]
+
+    def snapshots(self) -> list[str]:
+        # Oldest first, the timestamp in the name sorts them. The timestamp is
+        # matched exactly, bhb-index-... and bhb-shard-N-... also start with bhb-
+        pattern = re.compile(re.escape(self.name) + r"-\d{8}-\d{6}\.sqlite")
+        return sorted(path for path in glob.glob(os.path.join(self.backup_dir, f"{glob.escape(self.name)}-*.sqlite"))
+                      if pattern.fullmatch(os.path.basename(path)))
+
+    def run(self, now: datetime = None) -> str:
+        """Take a snapshot, check it and drop the oldest beyond `keep`."""
+        now = now or datetime.now(UTC)
+        os.makedirs(self.backup_dir, exist_ok=True)
+        path = os.path.join(self.backup_dir, f"{self.name}-{now:%Y%m%d-%H%M%S}.sqlite")
+        # Written aside and renamed once checked, a snapshot in the directory is always whole
+        partial = path + ".part"
+        start = time.perf_counter()
+        try:
+            self.copy(self.db_path, partial)
+            problems = self.verify(partial)
+            if problems:
+                raise sqlite3.DatabaseError(f"Snapshot of {self.db_path} failed its integrity check: {'; '.join(problems)}")
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        logger.info("Backed up %s to %s in %.1fs", self.db_path, path, time.perf_counter() - start)
+        self.rotate()
+        return path
+
+    def copy(self, source_path: str, target_path: str):
+        source = sqlite3.connect(source_path, timeout=30)
+        target = sqlite3.connect(target_path)
+        restarts = 0
+        remaining = None
+
+        def progress(status, left, total):
+            nonlocal remaining, restarts
+            if remaining is not None and left > remaining:
+                restarts += 1
+                if restarts > self.max_restarts:
+                    raise _Restarted
+            remaining = left
+            # Let the bot's writes in between steps
+            time.sleep(self.pause)
+
+        try:
+            try:
+                source.backup(target, pages=self.pages, progress=progress)
+            except _Restarted:
+                logger.info("Backup of %s restarted %d times, finishing it in one step", source_path, restarts)
+                source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    def verify(self, path: str) -> list[str]:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+            return [] if problems == ["ok"] else problems
+        finally:
+            conn.close()
+
+    def rotate(self) -> int:
+        stale = self.snapshots()[:-self.keep] if self.keep > 0 else []
+        for path in stale:
+            os.remove(path)
+            logger.info("Removed old backup %s", path)
+        return len(stale)
+
+    def restore(self, snapshot: str):
+        """Overwrite the database with `snapshot`, with the bot stopped."""
+        problems = self.verify(snapshot)
+        if problems:
+            raise sqlite3.DatabaseError(f"Not restoring {snapshot}, it failed its integrity check: {'; '.join(problems)}")
+        source = sqlite3.connect(f"file:{snapshot}?mode=ro", uri=True)
+        target = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        logger.info("Restored %s from %s", self.db_path, snapshot)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dir", default=Backups.backup_dir, help="where snapshots are kept")
+    commands = parser.add_subparsers(dest="command", required=True)
+    creating = commands.add_parser("create", help="snapshot a database, the bot can keep running")
+    creating.add_argument("db")
+    creating.add_argument("--keep", type=int, default=Backups.keep, help="snapshots to keep")
+    listing = commands.add_parser("list", help="list a database's snapshots and check them")
+    listing.add_argument("db")
+    restoring = commands.add_parser("restore", help="overwrite a database with a snapshot, stop the bot first")
+    restoring.add_argument("snapshot")
+    restoring.add_argument("db")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    Backups.backup_dir = args.dir
+    backups = Backups(args.db)
+    if args.command == "create":
+        backups.keep = args.keep
+        backups.run()
+    elif args.command == "list":
+        for path in backups.snapshots():
+            problems = backups.verify(path)
+            print(f"{path}  {os.path.getsize(path)} bytes  {'ok' if not problems else '; '.join(problems)}")
+    else:
+        backups.restore(args.snapshot)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Export and import meetup data as JSON lines.
+
+Every line is one row, {"kind": <table>, "row": {<column>: <value>}}, after a
+header line. Rows are streamed straight from a cursor on export and inserted
+in batches on import, so neither holds more than a batch in memory.
+
+    python -m store.dump export bhb.sqlite --guild 1234 -o guild.jsonl
+    python -m store.dump import bhb.sqlite guild.jsonl --replace
+"""
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+from collections import Counter
+from datetime import datetime, UTC
+from typing import IO, Iterable, Optional
+
+from .local import SQLiteStore, _timestamp
+
+logger = logging.getLogger("boardgame.helper.store.dump")
+
+FORMAT_VERSION = 1
+batch_size = 500
+
+GUILD_TABLES = "SELECT t.id FROM _table t JOIN event e ON e.id = t.event_id WHERE e.guild_id = :guild"
+
+# In import order, so rows come after whatever they refer to, with the
+# condition that narrows the export down to one guild
+KINDS = [
+    ("guild", "id = :guild"),
+    ("guild_roles", "guild_id = :guild"),
+    ("player", f"""id IN (
+        SELECT owner_id FROM _table WHERE id IN ({GUILD_TABLES})
+        UNION SELECT player_id FROM table_player WHERE table_id IN ({GUILD_TABLES})
+        UNION SELECT player_id FROM table_waitlist WHERE table_id IN ({GUILD_TABLES})
+        UNION SELECT player_id FROM table_preference WHERE table_id IN ({GUILD_TABLES}))"""),
+    ("game", f"id IN (SELECT game_id FROM _table WHERE id IN ({GUILD_TABLES}))"),
+    ("message", "guild_id = :guild"),
+    ("schedule", "guild_id = :guild"),
+    ("event", "guild_id = :guild"),
+    ("_table", "event_id IN (SELECT id FROM event WHERE guild_id = :guild)"),
+    ("table_player", f"table_id IN ({GUILD_TABLES})"),
+    ("table_message", f"table_id IN ({GUILD_TABLES})"),
+    ("table_waitlist", f"table_id IN ({GUILD_TABLES})"),
+    ("table_preference", f"table_id IN ({GUILD_TABLES})"),
+    ("job", """key IN (
+        SELECT 'create:' || id FROM schedule WHERE guild_id = :guild
+        UNION SELECT 'lock:' || id FROM event WHERE guild_id = :guild)"""),
+]
+
+# Generated keys that only mean something in the database they came from.
+# Waitlist ids just keep the queue in order, which insertion order already does.
+GENERATED = {"table_waitlist": {"id"}}
+
+# Players and games are shared between guilds, replacing a guild leaves them be
+DELETES = [
+    f"DELETE FROM table_preference WHERE table_id IN ({GUILD_TABLES})",
+    f"DELETE FROM table_waitlist WHERE table_id IN ({GUILD_TABLES})",
+    f"DELETE FROM table_message WHERE table_id IN ({GUILD_TABLES})",
+    f"DELETE FROM table_player WHERE table_id IN ({GUILD_TABLES})",
+    "DELETE FROM job WHERE key IN (SELECT 'lock:' || id FROM event WHERE guild_id = :guild)",
+    "DELETE FROM job WHERE key IN (SELECT 'create:' || id FROM schedule WHERE guild_id = :guild)",
+    "DELETE FROM _table WHERE event_id IN (SELECT id FROM event WHERE guild_id = :guild)",
+    "DELETE FROM event WHERE guild_id = :guild",
+    "DELETE FROM schedule WHERE guild_id = :guild",
+    "DELETE FROM message WHERE guild_id = :guild",
+    "DELETE FROM guild_roles WHERE guild_id = :guild",
+    "DELETE FROM guild WHERE id = :guild",
+]
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, autocommit=True, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def export(conn: sqlite3.Connection, out: IO[str], guild_id: Optional[int] = None) -> Counter:
+    """Write every row of one guild, or of all of them, to `out`."""
+    counts = Counter()
+    header = {"kind": "header", "version": FORMAT_VERSION, "guild_id": guild_id, "exported_at": _timestamp(datetime.now(UTC))}
+    out.write(json.dumps(header) + "\n")
+    # One read transaction, so the dump is a consistent snapshot while the bot writes
+    conn.execute("BEGIN")
+    try:
+        for kind, where in KINDS:
+            where = f"WHERE {where}" if guild_id is not None else ""
+            # Only generated keys need their order kept, sorting anything else would buffer it
+            order = "ORDER BY id" if kind in GENERATED else ""
+            for row in conn.execute(f"SELECT * FROM {kind} {where} {order}", {"guild": guild_id}):
+                out.write(json.dumps({"kind": kind, "row": dict(row)}) + "\n")
+                counts[kind] += 1
+    finally:
+        conn.execute("COMMIT")
+    return counts
+
+
+def delete_guild(conn: sqlite3.Connection, guild_id: int):
+    for statement in DELETES:
+        conn.execute(statement, {"guild": guild_id})
+
+
+def load(conn: sqlite3.Connection, lines: Iterable[str], replace: bool = False) -> Counter:
+    """Insert the rows of an export, overwriting rows with the same keys.
+
+    With `replace`, each guild in the export is deleted before its rows go
+    in, so a restore doesn't leave behind tables added since. Everything is
+    one transaction, a bad file changes nothing.
+    """
+    columns = {kind: [row["name"] for row in conn.execute(f"PRAGMA table_info({kind})") if row["name"] not in GENERATED.get(kind, ())]
+               for kind, _ in KINDS}
+    counts = Counter()
+    batch, statement = [], None
+
+    def flush():
+        if batch:
+            conn.executemany(statement, batch)
+            batch.clear()
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            kind = record.get("kind")
+            if kind == "header":
+                if record.get("version") != FORMAT_VERSION:
+                    raise ValueError(f"Unsupported export version {record.get('version')}")
+                continue
+            if kind not in columns:
+                raise ValueError(f"Line {number}: unknown kind {kind!r}")
+            row = record["row"]
+            if kind == "guild" and replace:
+                flush()
+                delete_guild(conn, row["id"])
+            if kind == "schedule":
+                # Schedule ids are in job keys so they are kept, but mustn't take over another guild's
+                owner = conn.execute("SELECT guild_id FROM schedule WHERE id = ?", (row["id"],)).fetchone()
+                if owner is not None and owner["guild_id"] != row["guild_id"]:
+                    raise ValueError(f"Line {number}: schedule {row['id']} belongs to another guild")
+            # Columns the database doesn't have are dropped, missing ones get their defaults
+            names = [name for name in columns[kind] if name in row]
+            current = f"INSERT OR REPLACE INTO {kind} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+            if current != statement or len(batch) >= batch_size:
+                flush()
+                statement = current
+            batch.append([row[name] for name in names])
+            counts[kind] += 1
+        flush()
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    exporting = commands.add_parser("export", help="write a database out as JSON lines")
+    exporting.add_argument("db")
+    exporting.add_argument("--guild", type=int, help="only this guild's data")
+    exporting.add_argument("-o", "--output", help="file to write, stdout by default")
+    importing = commands.add_parser("import", help="read JSON lines into a database")
+    importing.add_argument("db")
+    importing.add_argument("input", help="export to read, - for stdin")
+    importing.add_argument("--replace", action="store_true", help="delete each exported guild's data first")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "import":
+        # Creates the schema of a fresh file, so a dump can seed an empty database
+        SQLiteStore(args.db).conn.close()
+    conn = connect(args.db)
+    try:
+        if args.command == "export":
+            with open(args.output, "w", encoding="utf-8") if args.output else sys.stdout as out:
+                counts = export(conn, out, args.guild)
+        else:
+            with open(args.input, encoding="utf-8") if args.input != "-" else sys.stdin as lines:
+                counts = load(conn, lines, args.replace)
+    finally:
+        conn.close()
+    logger.info("%sed %s", args.command.capitalize(), ", ".join(f"{count} {kind}" for kind, count in counts.items()) or "nothing")
+
+
+if __name__ == "__main__":
+    main()
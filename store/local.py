@@ -6,9 +6,26 @@ logger = logging.getLogger("boardgame.helper.store.local")
 
 import sqlite3
 import uuid
-from typing import Optional, Dict, List
+from datetime import datetime, timedelta, UTC
+from typing import Optional, Dict, Iterator, List
 from dataclasses import dataclass, field
 from functools import wraps
+from contextlib import contextmanager
+
+# Event times are stored as UTC text so they sort and compare as strings
+TIMESTAMP = "%Y-%m-%d %H:%M:%S"
+
+def _timestamp(value: datetime | None) -> str | None:
+    return value.astimezone(UTC).strftime(TIMESTAMP) if value else None
+
+def _datetime(value: str | None) -> datetime | None:
+    return datetime.strptime(value, TIMESTAMP).replace(tzinfo=UTC) if value else None
+
+def _schedule(row: dict) -> Schedule:
+    return Schedule(**{**row, "next_at": _datetime(row["next_at"])})
+
+def _job(row: dict) -> Job:
+    return Job(row["key"], JobType(row["type"]), _datetime(row["due_at"]), row["target"])
 
 def lazy_load(load: str, keys: list[str]):
     def _decorate(func):
@@ -59,7 +76,9 @@ class _Table(Base):
 
     _players: Dict[str, Player] = field(default_factory=dict)
     _messages: Optional[list["Message"]] = field(default_factory=list)
+    _waitlist: list[Player] = field(default_factory=list)
     id: str = field(default_factory=lambda: str(uuid.uuid4()))  # Generate unique ID per instance
+    version: int = field(default=0)
 
     @property
     @lazy_load(load="get_event", keys=["event_id"])
@@ -105,6 +124,15 @@ class _Table(Base):
     @messages.setter
     def messages(self, messages):
         self._messages = messages
+
+    @property
+    @lazy_load(load="get_waitlist_for_table", keys=["id"])
+    def waitlist(self):
+        return self._waitlist
+
+    @waitlist.setter
+    def waitlist(self, waitlist):
+        self._waitlist = waitlist
     
 
 @dataclass(unsafe_hash=True)
@@ -114,6 +142,21 @@ class _Event(Base):
     _guild: "_Guild" = field(default=None)
     _tables: Dict[str, Table] = field(default_factory=dict)
     id: str = field(default_factory=lambda: str(uuid.uuid4()))  # Generate unique ID per instance
+    version: int = field(default=0)
+    title: Optional[str] = field(default=None)
+    scheduled_at: Optional[datetime] = field(default=None)
+    status: EventStatus = field(default=EventStatus.OPEN)
+    closed_at: Optional[datetime] = field(default=None)
+    active_at: Optional[datetime] = field(default=None)
+
+    def __post_init__(self):
+        if isinstance(self.scheduled_at, str):
+            self.scheduled_at = _datetime(self.scheduled_at)
+        if isinstance(self.closed_at, str):
+            self.closed_at = _datetime(self.closed_at)
+        if isinstance(self.active_at, str):
+            self.active_at = _datetime(self.active_at)
+        self.status = EventStatus(self.status)
 
     @property
     @lazy_load(load="get_tables_for_event", keys=["id"])
@@ -142,7 +185,7 @@ class _Guild(Base):
     _roles: list[int] = field(default_factory=list)
 
     @property
-    @lazy_load(load="get_event_for_guild_id", keys=["id"])
+    @lazy_load(load="get_next_event", keys=["id"])
     def event(self):
         return self._event
     
@@ -160,7 +203,14 @@ class _Guild(Base):
         self._roles = roles
 
 class SQLiteStore:
+    # Events stay "next"/"active" for this long after they were due to start
+    event_grace = timedelta(hours=12)
+    # Events without a date are closed after this long without a change
+    undated_idle = timedelta(days=7)
+
     def __init__(self, db_path: str = "bhb.sqlite"):
+        self.db_path = db_path
+        self.changes = ChangeFeed()
         self.conn = sqlite3.connect(db_path, autocommit=True)
         self.conn.row_factory = dict_factory
         # self.conn.set_trace_callback(print)
@@ -188,6 +238,12 @@ class SQLiteStore:
                     id TEXT PRIMARY KEY,
                     guild_id INTEGER NOT NULL,
                     channel_id INTEGER NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    title TEXT,
+                    scheduled_at TEXT,
+                    status INTEGER NOT NULL DEFAULT 1,
+                    closed_at TEXT,
+                    active_at TEXT,
                     FOREIGN KEY(guild_id) REFERENCES guild(id)
                 );
                 CREATE TABLE IF NOT EXISTS _table (
@@ -195,6 +251,7 @@ class SQLiteStore:
                     event_id TEXT NOT NULL,
                     owner_id INTEGER NOT NULL,
                     game_id INTEGER NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 0,
                     FOREIGN KEY(event_id) REFERENCES event(id),
                     FOREIGN KEY(owner_id) REFERENCES player(id),
                     FOREIGN KEY(game_id) REFERENCES game(id)
@@ -213,6 +270,22 @@ class SQLiteStore:
                     FOREIGN KEY(table_id) REFERENCES _table(id) ON DELETE CASCADE,
                     FOREIGN KEY(message_id) REFERENCES message(id)
                 );
+                CREATE TABLE IF NOT EXISTS table_waitlist (
+                    id INTEGER PRIMARY KEY,
+                    table_id TEXT NOT NULL,
+                    player_id INTEGER NOT NULL,
+                    UNIQUE(table_id, player_id) ON CONFLICT IGNORE,
+                    FOREIGN KEY(table_id) REFERENCES _table(id) ON DELETE CASCADE,
+                    FOREIGN KEY(player_id) REFERENCES player(id)
+                );
+                CREATE TABLE IF NOT EXISTS table_preference (
+                    table_id TEXT NOT NULL,
+                    player_id INTEGER NOT NULL,
+                    rank INTEGER NOT NULL,
+                    PRIMARY KEY(table_id, player_id),
+                    FOREIGN KEY(table_id) REFERENCES _table(id) ON DELETE CASCADE,
+                    FOREIGN KEY(player_id) REFERENCES player(id)
+                );
                 CREATE TABLE IF NOT EXISTS player (
                     id INTEGER PRIMARY KEY,
                     display_name TEXT NOT NULL,
@@ -235,9 +308,100 @@ class SQLiteStore:
                     channel_id INTEGER NOT NULL,
                     type INTEGER
                 );
+                CREATE TABLE IF NOT EXISTS schedule (
+                    id INTEGER PRIMARY KEY,
+                    guild_id INTEGER NOT NULL,
+                    channel_id INTEGER NOT NULL,
+                    title TEXT NOT NULL,
+                    next_at TEXT NOT NULL,
+                    every_days INTEGER NOT NULL,
+                    lead_days INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS job (
+                    key TEXT PRIMARY KEY,
+                    type INTEGER NOT NULL,
+                    due_at TEXT NOT NULL,
+                    target TEXT
+                );
+                CREATE INDEX IF NOT EXISTS message_guild ON message (guild_id, channel_id);
+                CREATE INDEX IF NOT EXISTS schedule_guild ON schedule (guild_id);
+                CREATE INDEX IF NOT EXISTS job_due ON job (due_at);
+                CREATE INDEX IF NOT EXISTS table_event ON _table (event_id);
+                CREATE INDEX IF NOT EXISTS waitlist_table ON table_waitlist (table_id, id);
+                CREATE INDEX IF NOT EXISTS preference_player ON table_preference (player_id);
                 """
             )
+            self._add_column("event", "version", "INTEGER NOT NULL DEFAULT 0")
+            self._add_column("_table", "version", "INTEGER NOT NULL DEFAULT 0")
+            self._add_column("event", "title", "TEXT")
+            self._add_column("event", "scheduled_at", "TEXT")
+            self._add_column("event", "status", "INTEGER NOT NULL DEFAULT 1")
+            self._add_column("event", "closed_at", "TEXT")
+            if self._add_column("event", "active_at", "TEXT"):
+                # Undated events from before are idle from now, not since forever
+                self.conn.execute("UPDATE event SET active_at = datetime('now') WHERE scheduled_at IS NULL")
+            # Undated events sort after dated ones, hence the expression index
+            self.conn.executescript("""
+                CREATE INDEX IF NOT EXISTS event_guild_schedule ON event (guild_id, status, scheduled_at IS NULL, scheduled_at);
+                CREATE INDEX IF NOT EXISTS event_status_schedule ON event (status, scheduled_at);
+            """)
+
+    def _add_column(self, table: str, column: str, definition: str):
+        columns = [row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            return True
+        return False
+
+    @contextmanager
+    def _transaction(self):
+        # The connection autocommits, statements that must land together
+        # need an explicit transaction
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def _bump_event(self, event_id: str = None, table_id: str = None):
+        if table_id is not None:
+            self.conn.execute("UPDATE _table SET version = version + 1 WHERE id = ?", (table_id,))
+            self.conn.execute("UPDATE event SET version = version + 1, active_at = datetime('now') WHERE id = (SELECT event_id FROM _table WHERE id = ?)", (table_id,))
+        else:
+            self.conn.execute("UPDATE event SET version = version + 1, active_at = datetime('now') WHERE id = ?", (event_id,))
             
+    def shard_for_guild(self, guild_id: int) -> "SQLiteStore":
+        # Every guild is in the one file
+        return self
+
+    def warmup(self) -> None:
+        # Uses its own connection so it can run off the event loop thread;
+        # scanning the hot tables pulls their pages into the OS page cache.
+        conn = sqlite3.connect(self.db_path, autocommit=True)
+        try:
+            for name in ("guild", "event", "_table", "table_player", "table_message", "player", "game", "message"):
+                conn.execute(f"SELECT count(*) FROM {name}").fetchone()
+            conn.execute("PRAGMA optimize")
+        finally:
+            conn.close()
+
+    def signup_history(self) -> Iterator[tuple[int, int]]:
+        # (player, game) pairs, also read from an executor with its own connection
+        conn = sqlite3.connect(self.db_path)
+        try:
+            yield from conn.execute("SELECT DISTINCT tp.player_id, t.game_id FROM table_player tp JOIN _table t ON t.id = tp.table_id")
+        finally:
+            conn.close()
+
+    def game_names(self) -> Iterator[tuple[int, str, int]]:
+        conn = sqlite3.connect(self.db_path)
+        try:
+            yield from conn.execute("SELECT id, name, rank FROM game")
+        finally:
+            conn.close()
+
     def add_guild(self, guild_id: int, channel_id: int, role_id:int = None):
         with self.conn:
             self.conn.execute("INSERT INTO guild (id, channel_id) VALUES (?, ?)", (guild_id, channel_id,))
@@ -278,20 +442,106 @@ class SQLiteStore:
             self.conn.execute("DELETE FROM guild WHERE id = ?", (guild.id,))
             self.conn.execute("DELETE FROM guild_roles WHERE guild_id = ?", (guild.id,))
            
-    def get_event_for_guild_id(self, guild_id: int):
-        query = "SELECT * FROM event WHERE guild_id = ?"
-        cursor = self.conn.execute(query, (guild_id,))
-        row = cursor.fetchone()
-        return _Event(**row) if row else None
-
-    def add_event(self, guild: Guild, event_id: str = None):
+    def _active_events(self, guild_id: int, since: datetime = None, limit: int = -1) -> List:
+        since = since or datetime.now(UTC) - self.event_grace
+        cursor = self.conn.execute("""
+            SELECT * FROM event
+            WHERE guild_id = ? AND status = ? AND (scheduled_at IS NULL OR scheduled_at >= ?)
+            ORDER BY scheduled_at IS NULL, scheduled_at, rowid
+            LIMIT ?
+        """, (guild_id, EventStatus.OPEN, _timestamp(since), limit))
+        return [_Event(**row) for row in cursor.fetchall()]
+
+    def get_next_event(self, guild_id: int, since: datetime = None):
+        events = self._active_events(guild_id, since, limit=1)
+        return events[0] if events else None
+
+    def get_active_events(self, guild_id: int, since: datetime = None) -> List:
+        return self._active_events(guild_id, since)
+
+    def add_event(self, guild: Guild, event_id: str = None, title: str = None, scheduled_at: datetime = None):
         if event_id is None:
             event_id = str(uuid.uuid4())
         with self.conn:
-            self.conn.execute("INSERT INTO event (id, guild_id, channel_id) VALUES (?, ?, ?)", (event_id, guild.id, guild.channel_id))
+            self.conn.execute("INSERT INTO event (id, guild_id, channel_id, title, scheduled_at, active_at) VALUES (?, ?, ?, ?, ?, datetime('now'))",
+                              (event_id, guild.id, guild.channel_id, title, _timestamp(scheduled_at)))
         
         return self.get_event(event_id=event_id)
 
+    def set_event_status(self, event_id: str, status: EventStatus) -> None:
+        with self.conn:
+            self.conn.execute("""
+                UPDATE event SET status = ?, version = version + 1,
+                       closed_at = CASE WHEN ? = ? THEN NULL ELSE datetime('now') END
+                WHERE id = ?
+            """, (status, status, EventStatus.OPEN, event_id))
+
+    def close_past_events(self, before: datetime) -> int:
+        # Undated events, the ones /meetup games add opens when there is none,
+        # have no end, they close once nobody has touched them for a while
+        idle = _timestamp(datetime.now(UTC) - self.undated_idle)
+        with self.conn:
+            cursor = self.conn.execute("""
+                UPDATE event SET status = ?, version = version + 1, closed_at = datetime('now')
+                WHERE status = ? AND (scheduled_at < ? OR (scheduled_at IS NULL AND active_at < ?))
+            """, (EventStatus.CLOSED, EventStatus.OPEN, _timestamp(before), idle))
+        return cursor.rowcount
+
+    def add_schedule(self, schedule: Schedule) -> Schedule:
+        with self.conn:
+            cursor = self.conn.execute("""
+                INSERT INTO schedule (guild_id, channel_id, title, next_at, every_days, lead_days)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (schedule.guild_id, schedule.channel_id, schedule.title, _timestamp(schedule.next_at),
+                  schedule.every_days, schedule.lead_days))
+        schedule.id = cursor.lastrowid
+        return schedule
+
+    def get_schedule(self, schedule_id: int) -> Optional[Schedule]:
+        row = self.conn.execute("SELECT * FROM schedule WHERE id = ?", (schedule_id,)).fetchone()
+        return _schedule(row) if row else None
+
+    def get_schedules(self, guild_id: int) -> List[Schedule]:
+        cursor = self.conn.execute("SELECT * FROM schedule WHERE guild_id = ? ORDER BY next_at", (guild_id,))
+        return [_schedule(row) for row in cursor.fetchall()]
+
+    def update_schedule(self, schedule_id: int, next_at: datetime) -> None:
+        with self.conn:
+            self.conn.execute("UPDATE schedule SET next_at = ? WHERE id = ?", (_timestamp(next_at), schedule_id))
+
+    def remove_schedule(self, schedule_id: int) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM schedule WHERE id = ?", (schedule_id,))
+            self.conn.execute("DELETE FROM job WHERE type = ? AND target = ?", (JobType.CREATE, str(schedule_id)))
+
+    # The job table is the scheduler's due-time heap: the due_at index keeps
+    # peeking at and popping the earliest jobs cheap however many are queued
+
+    def push_job(self, job: Job, replace: bool = True) -> None:
+        with self.conn:
+            self.conn.execute(f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO job (key, type, due_at, target) VALUES (?, ?, ?, ?)",
+                              (job.key, job.type, _timestamp(job.due_at), job.target))
+
+    def get_due_jobs(self, now: datetime, limit: int) -> List[Job]:
+        cursor = self.conn.execute("SELECT * FROM job WHERE due_at <= ? ORDER BY due_at LIMIT ?", (_timestamp(now), limit))
+        return [_job(row) for row in cursor.fetchall()]
+
+    def get_next_due(self) -> Optional[datetime]:
+        row = self.conn.execute("SELECT min(due_at) AS due_at FROM job").fetchone()
+        return _datetime(row["due_at"])
+
+    def claim_job(self, job: Job, until: datetime) -> Optional[Job]:
+        # Moving the due time is the claim: only one process sharing the file
+        # sees its update land, and the job is due again if that process dies
+        row = self.conn.execute("UPDATE job SET due_at = ? WHERE key = ? AND due_at = ? RETURNING *",
+                                (_timestamp(until), job.key, _timestamp(job.due_at))).fetchone()
+        return _job(row) if row else None
+
+    def complete_job(self, job: Job) -> None:
+        # A job pushed again while it ran has a new due time and stays queued
+        with self.conn:
+            self.conn.execute("DELETE FROM job WHERE key = ? AND due_at = ?", (job.key, _timestamp(job.due_at)))
+
     def get_event(self, event_id: str = None, load_tables=True) -> List:
         query = "SELECT * FROM event WHERE id = ?"
         logger.info("get event %s", event_id)
@@ -309,11 +559,31 @@ class SQLiteStore:
         with self.conn:
             self.conn.execute("DELETE FROM event WHERE id = ?", (event_id,))
 
+    def get_event_version(self, event_id: str) -> int:
+        row = self.conn.execute("SELECT version FROM event WHERE id = ?", (event_id,)).fetchone()
+        return row["version"] if row else None
+
+    def get_table_summaries(self, event_id: str) -> List[TableSummary]:
+        cursor = self.conn.execute("""
+            SELECT t.id, t.owner_id, g.id AS game_id, g.name, g.minplayers, g.maxplayers,
+                   count(p.id) AS players, coalesce(group_concat(p.mention, ', '), '') AS mentions
+            FROM _table t
+            JOIN game g ON g.id = t.game_id
+            LEFT JOIN table_player tp ON tp.table_id = t.id
+            LEFT JOIN player p ON p.id = tp.player_id
+            WHERE t.event_id = ?
+            GROUP BY t.id
+            ORDER BY t.rowid
+        """, (event_id,))
+        return [TableSummary(**row) for row in cursor.fetchall()]
+
     def add_table(self, event: Event, owner: Player, game: Game) -> str:
         table_id = str(uuid.uuid4())
         with self.conn:
             self.conn.execute("INSERT INTO _table (id, event_id, owner_id, game_id) VALUES (?, ?, ?, ?)",
                               (table_id, event.id, owner.id, game.id))
+            self._bump_event(event_id=event.id)
+        self.changes.publish(TableChange(ChangeType.ADD, table_id, player_id=owner.id))
         return self.get_table(table_id=table_id)
 
     def get_table(self, table_id: str):
@@ -341,22 +611,137 @@ class SQLiteStore:
         return [self.get_table(table_id=row["id"]) for row in rows] if rows else []
 
     def join_table(self, player: Player, table: Table):
-        with self.conn:
-            self.conn.execute("INSERT INTO table_player (player_id, table_id) VALUES (?, ?)", (player.id, table.id))
-
+        # The seat count is checked in the same statement that takes the seat,
+        # so a burst of clicks can't overfill a table; everyone else queues
+        change = None
+        with self._transaction():
+            cursor = self.conn.execute("""
+                INSERT INTO table_player (player_id, table_id)
+                SELECT ?, t.id FROM _table t JOIN game g ON g.id = t.game_id
+                WHERE t.id = ? AND (coalesce(g.maxplayers, 0) = 0
+                      OR (SELECT count(*) FROM table_player WHERE table_id = t.id) < g.maxplayers)
+            """, (player.id, table.id))
+            if cursor.rowcount:
+                change = ChangeType.JOIN
+            else:
+                cursor = self.conn.execute("""
+                    INSERT INTO table_waitlist (table_id, player_id)
+                    SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM table_player WHERE table_id = ? AND player_id = ?)
+                """, (table.id, player.id, table.id, player.id))
+                change = ChangeType.WAITLIST if cursor.rowcount else None
+            if change:
+                self._bump_event(table_id=table.id)
+
+        if change:
+            self.changes.publish(TableChange(change, table.id, player_id=player.id))
         return self.get_table(table_id=table.id)
 
     def leave_table(self, player: Player, table: Table):
-        with self.conn:
-            self.conn.execute("DELETE FROM table_player WHERE player_id = ? AND table_id = ?", (player.id, table.id))
-
+        promoted = None
+        with self._transaction():
+            left = self.conn.execute("DELETE FROM table_player WHERE player_id = ? AND table_id = ?", (player.id, table.id)).rowcount
+            if left:
+                # The freed seat goes to the head of the queue in the same transaction
+                row = self.conn.execute("""
+                    DELETE FROM table_waitlist
+                    WHERE id = (SELECT id FROM table_waitlist WHERE table_id = ? ORDER BY id LIMIT 1)
+                    RETURNING player_id
+                """, (table.id,)).fetchone()
+                if row:
+                    promoted = row["player_id"]
+                    self.conn.execute("INSERT INTO table_player (player_id, table_id) VALUES (?, ?)", (promoted, table.id))
+            else:
+                left = self.conn.execute("DELETE FROM table_waitlist WHERE player_id = ? AND table_id = ?", (player.id, table.id)).rowcount
+            if left:
+                self._bump_event(table_id=table.id)
+
+        if left:
+            self.changes.publish(TableChange(ChangeType.LEAVE, table.id, player_id=player.id))
+        if promoted is not None:
+            self.changes.publish(TableChange(ChangeType.PROMOTE, table.id, player_id=promoted))
         return self.get_table(table_id=table.id)
 
+    def get_waitlist_for_table(self, table_id: str) -> List[Player]:
+        cursor = self.conn.execute("""
+            SELECT p.id, p.display_name, p.mention FROM table_waitlist w JOIN player p ON p.id = w.player_id
+            WHERE w.table_id = ? ORDER BY w.id
+        """, (table_id,))
+        return [Player(**row) for row in cursor.fetchall()]
+
+    def get_waitlist_position(self, table_id: str, player_id: int) -> Optional[int]:
+        row = self.conn.execute("""
+            SELECT count(*) AS position FROM table_waitlist
+            WHERE table_id = ? AND id <= (SELECT id FROM table_waitlist WHERE table_id = ? AND player_id = ?)
+        """, (table_id, table_id, player_id)).fetchone()
+        return row["position"] or None
+
     def remove_table(self, table: Table) -> None:
+        messages = tuple(self.get_messages_for_table(table.id))
         with self.conn:
+            self._bump_event(table_id=table.id)
             self.conn.execute("DELETE FROM _table WHERE id = ?", (table.id,))
             self.conn.execute("DELETE FROM table_player WHERE table_id = ?", (table.id,))
+            self.conn.execute("DELETE FROM table_waitlist WHERE table_id = ?", (table.id,))
+            self.conn.execute("DELETE FROM table_preference WHERE table_id = ?", (table.id,))
             self.conn.execute("DELETE FROM table_message WHERE table_id = ?", (table.id,))
+        self.changes.publish(TableChange(ChangeType.REMOVE, table.id, messages=messages))
+
+    def set_preferences(self, event_id: str, player_id: int, table_ids: list[str]) -> None:
+        with self._transaction():
+            self.conn.execute("""
+                DELETE FROM table_preference
+                WHERE player_id = ? AND table_id IN (SELECT id FROM _table WHERE event_id = ?)
+            """, (player_id, event_id))
+            self.conn.executemany("INSERT OR IGNORE INTO table_preference (table_id, player_id, rank) VALUES (?, ?, ?)",
+                                  [(table_id, player_id, rank) for rank, table_id in enumerate(table_ids, start=1)])
+
+    def get_preferences(self, event_id: str) -> Dict[int, List[str]]:
+        # Players who ranked nothing are taken to prefer the tables they joined,
+        # in the order they joined them, then those they are queued for
+        cursor = self.conn.execute("""
+            SELECT tp.player_id, tp.table_id, 0, tp.rank FROM table_preference tp
+            JOIN _table t ON t.id = tp.table_id WHERE t.event_id = :event_id
+            UNION ALL
+            SELECT p.player_id, p.table_id, p.queued, p.position FROM (
+                SELECT player_id, table_id, 1 AS queued, rowid AS position FROM table_player
+                UNION ALL
+                SELECT player_id, table_id, 2, id FROM table_waitlist
+            ) p
+            JOIN _table t ON t.id = p.table_id WHERE t.event_id = :event_id
+              AND NOT EXISTS (SELECT 1 FROM table_preference tp JOIN _table pt ON pt.id = tp.table_id
+                              WHERE tp.player_id = p.player_id AND pt.event_id = t.event_id)
+            ORDER BY 1, 3, 4
+        """, {"event_id": event_id})
+        preferences: Dict[int, List[str]] = {}
+        for row in cursor.fetchall():
+            preferences.setdefault(row["player_id"], []).append(row["table_id"])
+        return preferences
+
+    def get_rosters(self, event_id: str) -> Dict[str, List[int]]:
+        cursor = self.conn.execute("""
+            SELECT p.table_id, p.player_id FROM table_player p
+            JOIN _table t ON t.id = p.table_id WHERE t.event_id = ? ORDER BY p.rowid
+        """, (event_id,))
+        rosters: Dict[str, List[int]] = {}
+        for row in cursor.fetchall():
+            rosters.setdefault(row["table_id"], []).append(row["player_id"])
+        return rosters
+
+    def seat_players(self, event_id: str, seating: Dict[str, List[int]]) -> None:
+        # Rosters of the given tables are replaced wholesale in one transaction.
+        # Owners aren't seated, their seats and places in queues stay as they are.
+        tables = [(table_id, event_id) for table_id in seating]
+        owners = "SELECT owner_id FROM _table WHERE event_id = ?"
+        with self._transaction():
+            self.conn.executemany(f"DELETE FROM table_player WHERE table_id = ? AND player_id NOT IN ({owners})", tables)
+            self.conn.executemany(f"DELETE FROM table_waitlist WHERE table_id = ? AND player_id NOT IN ({owners})", tables)
+            self.conn.executemany("INSERT INTO table_player (table_id, player_id) VALUES (?, ?)",
+                                  [(table_id, player_id) for table_id, players in seating.items() for player_id in players])
+            self.conn.executemany("UPDATE _table SET version = version + 1 WHERE id = ?", [(table_id,) for table_id in seating])
+            self._bump_event(event_id=event_id)
+
+        for table_id in seating:
+            self.changes.publish(TableChange(ChangeType.SEAT, table_id))
 
     def add_player(self, player: Player):
         with self.conn:
@@ -413,11 +798,26 @@ class SQLiteStore:
         row = cursor.fetchone()
         return Message(**row) if row else None
 
+    def get_messages_for_guild(self, guild_id: int, channel_id: int = None, after: int = None) -> List[Message]:
+        # Message ids are snowflakes, `after` an id narrows it down to messages sent since
+        where, params = "guild_id = ?", [guild_id]
+        if channel_id is not None:
+            where, params = f"{where} AND channel_id = ?", [*params, channel_id]
+        if after is not None:
+            where, params = f"{where} AND id > ?", [*params, after]
+        cursor = self.conn.execute(f"SELECT * FROM message WHERE {where}", params)
+        return [Message(**row) for row in cursor.fetchall()]
+
     def delete_message(self, message: Message) -> None:
         with self.conn:
             self.conn.execute("DELETE FROM message WHERE id = ?", (message.id,))
             self.conn.execute("DELETE FROM table_message WHERE message_id = ?", (message.id,))
 
+    def delete_messages(self, messages: List[Message]) -> None:
+        ids = [(message.id,) for message in messages]
+        with self.conn:
+            self.conn.executemany("DELETE FROM message WHERE id = ?", ids)
+            self.conn.executemany("DELETE FROM table_message WHERE message_id = ?", ids)
 
     def reset(self) -> None:
         with self.conn:
@@ -0,0 +1,464 @@
+"""Guild-sharded storage over several SQLite files.
+
+    python -m store.sharded rebalance --shards 4 --source bhb.sqlite
+    python -m store.sharded bench --shards 1 4 --processes 4
+"""
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from itertools import chain
+from typing import Dict, Iterator, List, Optional
+
+from . import *
+from . import dump
+from .local import SQLiteStore, _Event, _Guild, _Player, _Table
+
+logger = logging.getLogger("boardgame.helper.store.sharded")
+
+# Rows every guild shares, kept in the index rather than in a shard. Shards
+# also hold copies of the games and players their own tables use.
+SHARED = ("game", "player", "schedule", "job")
+COPIED = ("game", "player")
+
+
+class ShardedStore:
+    # Each guild's events, tables, rosters and messages live in one of several
+    # SQLite files, so a busy guild only holds up the guilds on its own shard.
+    # Games, players, schedules and scheduler jobs are shared and live in a
+    # small index file next to the guild -> shard directory. Shards keep
+    # copies of the games and players their tables use, so their joins stay
+    # within one file.
+    shard_count = 0  # 0 keeps everything in one SQLiteStore
+    shard_path = "bhb-shard-{}.sqlite"
+    index_path = "bhb-index.sqlite"
+    event_grace = SQLiteStore.event_grace
+    # Where recently used events, tables and messages are, ids never change shard while running
+    cache_size = 10_000
+
+    def __init__(self, shards: int = None):
+        count = shards or self.shard_count
+        self.changes = ChangeFeed()
+        self.index = SQLiteStore(self.index_path)
+        self.shards = [SQLiteStore(self.shard_path.format(i)) for i in range(count)]
+        self.stores = [self.index, *self.shards]
+        for store in self.stores:
+            store.changes = self.changes
+        self.db_path = self.index.db_path
+        self.index.conn.execute("CREATE TABLE IF NOT EXISTS guild_shard (guild_id INTEGER PRIMARY KEY, shard INTEGER NOT NULL)")
+        self.directory = {row["guild_id"]: row["shard"] for row in self.index.conn.execute("SELECT * FROM guild_shard")}
+        stranded = sorted({shard for shard in self.directory.values() if shard >= count})
+        if stranded:
+            raise ValueError(f"Guilds are still on shards {stranded}, rebalance to {count} shards first")
+        self.located: dict[tuple[str, object], int] = {}
+        # Lazy loaded attributes come back through here, to the right shard
+        _Player._store = _Table._store = _Event._store = _Guild._store = self
+
+    def shard_for_guild(self, guild_id: int) -> SQLiteStore:
+        shard = self.directory.get(guild_id)
+        return self.shards[guild_id % len(self.shards) if shard is None else shard]
+
+    def _remember(self, kind: str, key, store: SQLiteStore):
+        if len(self.located) >= self.cache_size:
+            del self.located[next(iter(self.located))]
+        self.located[kind, key] = self.shards.index(store)
+
+    def _locate(self, kind: str, key) -> Optional[SQLiteStore]:
+        shard = self.located.get((kind, key))
+        if shard is not None:
+            return self.shards[shard]
+        for store in self.shards:
+            if store.conn.execute(f"SELECT 1 FROM {kind} WHERE id = ?", (key,)).fetchone():
+                self._remember(kind, key, store)
+                return store
+        return None
+
+    def _share(self, store: SQLiteStore, kind: str, ids):
+        # Copies the index rows a shard's joins need, the first time it needs them
+        missing = [id for id in set(ids) if not store.conn.execute(f"SELECT 1 FROM {kind} WHERE id = ?", (id,)).fetchone()]
+        rows = [row for row in (self.index.conn.execute(f"SELECT * FROM {kind} WHERE id = ?", (id,)).fetchone() for id in missing) if row]
+        if rows:
+            columns = list(rows[0])
+            with store._transaction():
+                store.conn.executemany(f"INSERT OR IGNORE INTO {kind} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                                       [list(row.values()) for row in rows])
+
+    def warmup(self) -> None:
+        for store in self.stores:
+            store.warmup()
+
+    def signup_history(self) -> Iterator[tuple[int, int]]:
+        return chain.from_iterable(store.signup_history() for store in self.shards)
+
+    def game_names(self) -> Iterator[tuple[int, str, int]]:
+        return self.index.game_names()
+
+    # Guilds
+
+    def add_guild(self, guild_id: int, channel_id: int, role_id: int = None):
+        store = self.shard_for_guild(guild_id)
+        if guild_id not in self.directory:
+            shard = self.shards.index(store)
+            self.index.conn.execute("INSERT OR REPLACE INTO guild_shard (guild_id, shard) VALUES (?, ?)", (guild_id, shard))
+            self.directory[guild_id] = shard
+        return store.add_guild(guild_id, channel_id, role_id)
+
+    def update_guild(self, guild: Guild, channel_id: int) -> Guild:
+        return self.shard_for_guild(guild.id).update_guild(guild, channel_id)
+
+    def get_guild(self, guild_id: int):
+        return self.shard_for_guild(guild_id).get_guild(guild_id)
+
+    def add_role(self, guild: Guild, role_id: int) -> Guild:
+        return self.shard_for_guild(guild.id).add_role(guild, role_id)
+
+    def remove_role(self, guild: Guild, role_id: int):
+        return self.shard_for_guild(guild.id).remove_role(guild, role_id)
+
+    def get_roles_for_guild(self, guild_id: int):
+        return self.shard_for_guild(guild_id).get_roles_for_guild(guild_id)
+
+    def remove_guild(self, guild: Guild):
+        self.shard_for_guild(guild.id).remove_guild(guild)
+
+    # Events
+
+    def get_next_event(self, guild_id: int, since: datetime = None):
+        return self.shard_for_guild(guild_id).get_next_event(guild_id, since)
+
+    def get_active_events(self, guild_id: int, since: datetime = None) -> List:
+        return self.shard_for_guild(guild_id).get_active_events(guild_id, since)
+
+    def add_event(self, guild: Guild, event_id: str = None, title: str = None, scheduled_at: datetime = None):
+        store = self.shard_for_guild(guild.id)
+        event = store.add_event(guild, event_id, title, scheduled_at)
+        self._remember("event", event.id, store)
+        return event
+
+    def get_event(self, event_id: str = None, load_tables=True):
+        store = self._locate("event", event_id)
+        return store.get_event(event_id=event_id) if store else None
+
+    def set_event_status(self, event_id: str, status: EventStatus) -> None:
+        store = self._locate("event", event_id)
+        if store:
+            store.set_event_status(event_id, status)
+
+    def close_past_events(self, before: datetime) -> int:
+        return sum(store.close_past_events(before) for store in self.shards)
+
+    def get_all_events(self) -> List:
+        return [event for store in self.shards for event in store.get_all_events()]
+
+    def remove_event(self, event_id: str) -> None:
+        store = self._locate("event", event_id)
+        if store:
+            store.remove_event(event_id)
+
+    def get_event_version(self, event_id: str) -> int:
+        store = self._locate("event", event_id)
+        return store.get_event_version(event_id) if store else None
+
+    def get_table_summaries(self, event_id: str) -> List[TableSummary]:
+        store = self._locate("event", event_id)
+        return store.get_table_summaries(event_id) if store else []
+
+    def get_tables_for_event(self, event_id: str):
+        store = self._locate("event", event_id)
+        return store.get_tables_for_event(event_id) if store else []
+
+    # Schedules and jobs are few and not per guild hot paths, the index has them all
+
+    def add_schedule(self, schedule: Schedule) -> Schedule:
+        return self.index.add_schedule(schedule)
+
+    def get_schedule(self, schedule_id: int) -> Optional[Schedule]:
+        return self.index.get_schedule(schedule_id)
+
+    def get_schedules(self, guild_id: int) -> List[Schedule]:
+        return self.index.get_schedules(guild_id)
+
+    def update_schedule(self, schedule_id: int, next_at: datetime) -> None:
+        self.index.update_schedule(schedule_id, next_at)
+
+    def remove_schedule(self, schedule_id: int) -> None:
+        self.index.remove_schedule(schedule_id)
+
+    def push_job(self, job: Job, replace: bool = True) -> None:
+        self.index.push_job(job, replace)
+
+    def get_due_jobs(self, now: datetime, limit: int) -> List[Job]:
+        return self.index.get_due_jobs(now, limit)
+
+    def get_next_due(self) -> Optional[datetime]:
+        return self.index.get_next_due()
+
+    def claim_job(self, job: Job, until: datetime) -> Optional[Job]:
+        return self.index.claim_job(job, until)
+
+    def complete_job(self, job: Job) -> None:
+        self.index.complete_job(job)
+
+    # Tables
+
+    def add_table(self, event: Event, owner: Player, game: Game) -> str:
+        store = self._locate("event", event.id)
+        self._share(store, "player", [owner.id])
+        self._share(store, "game", [game.id])
+        table = store.add_table(event, owner, game)
+        self._remember("_table", table.id, store)
+        return table
+
+    def get_table(self, table_id: str):
+        store = self._locate("_table", table_id)
+        return store.get_table(table_id) if store else None
+
+    def join_table(self, player: Player, table: Table):
+        store = self._locate("_table", table.id)
+        self._share(store, "player", [player.id])
+        return store.join_table(player, table)
+
+    def leave_table(self, player: Player, table: Table):
+        return self._locate("_table", table.id).leave_table(player, table)
+
+    def get_waitlist_for_table(self, table_id: str) -> List[Player]:
+        store = self._locate("_table", table_id)
+        return store.get_waitlist_for_table(table_id) if store else []
+
+    def get_waitlist_position(self, table_id: str, player_id: int) -> Optional[int]:
+        store = self._locate("_table", table_id)
+        return store.get_waitlist_position(table_id, player_id) if store else None
+
+    def remove_table(self, table: Table) -> None:
+        store = self._locate("_table", table.id)
+        if store:
+            store.remove_table(table)
+
+    def set_preferences(self, event_id: str, player_id: int, table_ids: list[str]) -> None:
+        store = self._locate("event", event_id)
+        self._share(store, "player", [player_id])
+        store.set_preferences(event_id, player_id, table_ids)
+
+    def get_preferences(self, event_id: str) -> Dict[int, List[str]]:
+        store = self._locate("event", event_id)
+        return store.get_preferences(event_id) if store else {}
+
+    def get_rosters(self, event_id: str) -> Dict[str, List[int]]:
+        store = self._locate("event", event_id)
+        return store.get_rosters(event_id) if store else {}
+
+    def seat_players(self, event_id: str, seating: Dict[str, List[int]]) -> None:
+        store = self._locate("event", event_id)
+        self._share(store, "player", [player_id for players in seating.values() for player_id in players])
+        store.seat_players(event_id, seating)
+
+    def get_players_for_table(self, table_id: int):
+        store = self._locate("_table", table_id)
+        return store.get_players_for_table(table_id) if store else []
+
+    def get_table_for_player(self, player_id: int) -> Table:
+        return next((table for store in self.shards if (table := store.get_table_for_player(player_id))), None)
+
+    # Games and players
+
+    def add_game(self, game: Game):
+        return self.index.add_game(game)
+
+    def get_game(self, game_id: str):
+        return self.index.get_game(game_id)
+
+    def add_player(self, player: Player):
+        return self.index.add_player(player)
+
+    def get_player(self, player_id: int):
+        return self.index.get_player(player_id)
+
+    # Messages
+
+    def add_table_message(self, table: Table, message: Message) -> Table:
+        store = self._locate("_table", table.id)
+        table = store.add_table_message(table, message)
+        self._remember("message", message.id, store)
+        return table
+
+    def get_table_for_message(self, message: int) -> Table:
+        store = self._locate("message", message)
+        return store.get_table_for_message(message) if store else None
+
+    def get_messages_for_table(self, table_id: int) -> List[Message]:
+        store = self._locate("_table", table_id)
+        return store.get_messages_for_table(table_id) if store else []
+
+    def add_message(self, message: Message) -> Message:
+        store = self.shard_for_guild(message.guild_id)
+        message = store.add_message(message)
+        self._remember("message", message.id, store)
+        return message
+
+    def get_message(self, message_id: int) -> Message:
+        store = self._locate("message", message_id)
+        return store.get_message(message_id) if store else None
+
+    def get_messages_for_guild(self, guild_id: int, channel_id: int = None, after: int = None) -> List[Message]:
+        return self.shard_for_guild(guild_id).get_messages_for_guild(guild_id, channel_id, after)
+
+    def delete_message(self, message: Message) -> None:
+        self.shard_for_guild(message.guild_id).delete_message(message)
+
+    def delete_messages(self, messages: List[Message]) -> None:
+        by_shard: dict[int, list[Message]] = {}
+        for message in messages:
+            by_shard.setdefault(self.shards.index(self.shard_for_guild(message.guild_id)), []).append(message)
+        for shard, batch in by_shard.items():
+            self.shards[shard].delete_messages(batch)
+
+    def reset(self) -> None:
+        for store in self.stores:
+            store.reset()
+        self.located.clear()
+
+
+def _kind(line: str) -> str:
+    return json.loads(line).get("kind")
+
+
+def _copy(source: sqlite3.Connection, target: sqlite3.Connection, guild_id: Optional[int], kinds, replace: bool = False) -> Counter:
+    # Streams through a temporary file, so a guild of any size moves in constant memory
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as buffer:
+        dump.export(source, buffer, guild_id)
+        buffer.seek(0)
+        if replace:
+            target.execute("BEGIN IMMEDIATE")
+            dump.delete_guild(target, guild_id)
+            target.execute("COMMIT")
+        return dump.load(target, (line for line in buffer if _kind(line) in kinds))
+
+
+def rebalance(shards: int, source: str = None) -> Counter:
+    """Move every guild to the shard it belongs on with `shards` shards, with the bot stopped.
+
+    `source` is an unsharded database to split up as well. It is only read
+    into shards once, guilds already in the index are skipped, so running
+    the same command again leaves their newer data alone. A move copies the
+    guild before deleting it from where it was, so an interrupted rebalance
+    can simply be run again.
+    """
+    pattern = re.escape(ShardedStore.shard_path).replace(r"\{\}", r"(\d+)")
+    existing = {int(match.group(1)): path for path in glob.glob(ShardedStore.shard_path.replace("{}", "*"))
+                if (match := re.fullmatch(pattern, path))}
+    index = SQLiteStore(ShardedStore.index_path)
+    index.conn.execute("CREATE TABLE IF NOT EXISTS guild_shard (guild_id INTEGER PRIMARY KEY, shard INTEGER NOT NULL)")
+    targets = [SQLiteStore(ShardedStore.shard_path.format(i)) for i in range(shards)]
+    guild_kinds = {kind for kind, _ in dump.KINDS} - set(SHARED) | set(COPIED)
+    known = {row["guild_id"] for row in index.conn.execute("SELECT guild_id FROM guild_shard")}
+    moved = Counter()
+
+    sources = [(shard, path) for shard, path in sorted(existing.items())]
+    if source:
+        sources.append((None, source))
+    for shard, path in sources:
+        conn = dump.connect(path)
+        try:
+            if shard is None and not known:
+                # Everything shared goes to the index once, into a fresh index only
+                shared = dump.connect(index.db_path)
+                try:
+                    moved.update(_copy(conn, shared, None, SHARED))
+                finally:
+                    shared.close()
+            guilds = [row[0] for row in conn.execute("SELECT id FROM guild UNION SELECT guild_id FROM event UNION SELECT guild_id FROM message")]
+            for guild_id in guilds:
+                if shard is None and guild_id in known:
+                    # Split off before, its shard has moved on since
+                    continue
+                target = guild_id % shards
+                if target != shard:
+                    destination = dump.connect(targets[target].db_path)
+                    try:
+                        _copy(conn, destination, guild_id, guild_kinds, replace=True)
+                    finally:
+                        destination.close()
+                    # The unsharded database is left as it was, to fall back on
+                    if shard is not None:
+                        conn.execute("BEGIN IMMEDIATE")
+                        dump.delete_guild(conn, guild_id)
+                        conn.execute("COMMIT")
+                    moved["guilds"] += 1
+                    logger.info("Moved guild %s from %s to shard %d", guild_id, path, target)
+                index.conn.execute("INSERT OR REPLACE INTO guild_shard (guild_id, shard) VALUES (?, ?)", (guild_id, target))
+        finally:
+            conn.close()
+
+    for shard, path in existing.items():
+        if shard >= shards:
+            logger.info("%s is no longer used and can be removed", path)
+    return moved
+
+
+# Benchmark
+
+def _writer(shards: int, guild_id: int, ops: int, directory: str) -> float:
+    ShardedStore.shard_path = os.path.join(directory, "shard-{}.sqlite")
+    ShardedStore.index_path = os.path.join(directory, "index.sqlite")
+    store = ShardedStore(shards)
+    guild = store.get_guild(guild_id) or store.add_guild(guild_id, guild_id)
+    event = store.add_event(guild, title="bench")
+    game = store.add_game(Game(guild_id, f"game {guild_id}", 2000, 1, "", "", 2, 0, 4))
+    owner = store.get_player(guild_id) or store.add_player(Player(guild_id, "owner", "@owner"))
+    table = store.add_table(event, owner, game)
+    players = [store.get_player(guild_id * 1000 + i) or store.add_player(Player(guild_id * 1000 + i, "p", "@p")) for i in range(10)]
+    start = time.perf_counter()
+    for i in range(ops):
+        player = players[i % len(players)]
+        if i // len(players) % 2:
+            store.leave_table(player, table)
+        else:
+            store.join_table(player, table)
+    return time.perf_counter() - start
+
+
+def bench(shards: list[int], processes: int, ops: int):
+    for count in shards:
+        with tempfile.TemporaryDirectory() as directory:
+            # One guild per process, spread over the shards
+            with multiprocessing.Pool(processes) as pool:
+                start = time.perf_counter()
+                pool.starmap(_writer, [(count, guild_id, ops, directory) for guild_id in range(1, processes + 1)])
+                elapsed = time.perf_counter() - start
+            print(f"{count} shards, {processes} processes: {processes * ops / elapsed:.0f} joins and leaves/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shard-path", default=ShardedStore.shard_path, help="shard file name, {} is the shard number")
+    parser.add_argument("--index", default=ShardedStore.index_path, help="index file name")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebalancing = commands.add_parser("rebalance", help="move guilds to their shards, stop the bot first")
+    rebalancing.add_argument("--shards", type=int, required=True)
+    rebalancing.add_argument("--source", help="unsharded database to split into the shards")
+    benchmarking = commands.add_parser("bench", help="time concurrent writers, one guild each")
+    benchmarking.add_argument("--shards", type=int, nargs="+", default=[1, 4])
+    benchmarking.add_argument("--processes", type=int, default=4)
+    benchmarking.add_argument("--ops", type=int, default=1000, help="joins and leaves per process")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    ShardedStore.shard_path = args.shard_path
+    ShardedStore.index_path = args.index
+    if args.command == "rebalance":
+        moved = rebalance(args.shards, args.source)
+        logger.info("Rebalanced to %d shards: %s", args.shards, ", ".join(f"{count} {kind}" for kind, count in moved.items()) or "nothing moved")
+    else:
+        bench(args.shards, args.processes, args.ops)
+
+
+if __name__ == "__main__":
+    main()
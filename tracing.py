@@ -0,0 +1,146 @@
+import functools
+import inspect
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger("boardgame.helper.tracing")
+
+current: ContextVar["Trace | None"] = ContextVar("trace", default=None)
+
+
+class Trace:
+    max_spans = 50
+
+    def __init__(self, kind: str, name: str, **attributes):
+        self.kind = kind
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.duration: float | None = None
+        self.spans: list[tuple[str, float, float]] = []
+
+    def add(self, name: str, start: float, end: float):
+        # Spans from work that outlives the interaction are dropped
+        if self.duration is None:
+            self.spans.append((name, start - self.start, end - start))
+
+    def finish(self) -> float:
+        self.duration = time.perf_counter() - self.start
+        return self.duration
+
+    def record(self) -> dict:
+        breakdown = {}
+        for name, _, took in self.spans:
+            total = breakdown.setdefault(name, {"count": 0, "ms": 0.0})
+            total["count"] += 1
+            total["ms"] += took * 1000
+
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            **self.attributes,
+            "ms": round(self.duration * 1000, 1),
+            "breakdown": {name: {"count": t["count"], "ms": round(t["ms"], 1)}
+                          for name, t in sorted(breakdown.items(), key=lambda i: -i[1]["ms"])},
+            "spans": [{"name": name, "at_ms": round(at * 1000, 1), "ms": round(took * 1000, 1)}
+                      for name, at, took in self.spans[:self.max_spans]],
+        }
+
+
+class Tracer:
+    def __init__(self, threshold: float = 2.0):
+        self.threshold = threshold
+        self.tokens = {}
+
+    @contextmanager
+    def trace(self, kind: str, name: str, **attributes):
+        trace = Trace(kind, name, **attributes)
+        token = current.set(trace)
+        try:
+            yield trace
+        finally:
+            current.reset(token)
+            self.finish(trace)
+
+    def finish(self, trace: Trace):
+        if trace.finish() >= self.threshold:
+            logger.warning("slow interaction %s", json.dumps(trace.record()))
+
+    @contextmanager
+    def span(self, name: str):
+        trace = current.get()
+        if trace is None:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            trace.add(name, start, time.perf_counter())
+
+    def wrap(self, name: str, func):
+        if getattr(func, "__traced__", False):
+            return func
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def traced(*args, **kwargs):
+                with self.span(name):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def traced(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+
+        traced.__traced__ = True
+        return traced
+
+    # Slash commands run their before and after hooks in the same task as
+    # the callback, so the trace set here is current for the whole command
+
+    def attach(self, bot):
+        bot.before_invoke(self.before_invoke)
+        bot.after_invoke(self.after_invoke)
+
+    async def before_invoke(self, ctx):
+        trace = Trace("command", ctx.command.qualified_name,
+                      guild=ctx.guild_id, user=ctx.author.id if ctx.author else None)
+        self.tokens[ctx.interaction.id] = (trace, current.set(trace))
+
+    async def after_invoke(self, ctx):
+        trace, token = self.tokens.pop(ctx.interaction.id, (None, None))
+        if trace is not None:
+            current.reset(token)
+            self.finish(trace)
+
+    def instrument_store(self, store):
+        for name in dir(store):
+            if name.startswith("_"):
+                continue
+            attr = getattr(store, name)
+            if inspect.ismethod(attr):
+                setattr(store, name, self.wrap(f"store.{name}", attr))
+
+    def instrument_discord(self, bot):
+        import discord.webhook.async_
+
+        # Interaction responses and followups go through the webhook adapter,
+        # everything else (sends, edits, fetches) through the bot's client
+        def request(func):
+            @functools.wraps(func)
+            async def traced(route, *args, **kwargs):
+                with self.span(f"discord {route.method} {route.path}"):
+                    return await func(route, *args, **kwargs)
+            return traced
+
+        bot.http.request = request(bot.http.request)
+        adapter = discord.webhook.async_.async_context.get()
+        adapter.request = request(adapter.request)
+
+
+tracer = Tracer()
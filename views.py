@@ -1,6 +1,7 @@
 
 from __future__ import annotations
 
+import re
 import typing
 import traceback
 import logging
@@ -9,7 +10,10 @@ import discord
 import discord.ext
 import discord.ext.pages
 from embeds import GameEmbed
-from store import Store, Table, Player, Game, Event
+from metrics import metrics
+from tracing import tracer
+from guard import guard
+from store import Store, Table, TableSummary, Player, Game, Event, EventStatus
 
 logger = logging.getLogger("boardgame.helper.view")
 
@@ -30,6 +34,11 @@ class BaseView(discord.ui.View):
         self.interaction = interaction
         return True
 
+    async def _scheduled_task(self, item: discord.ui.Item, interaction: discord.Interaction):
+        with metrics.timer("view_callback_seconds", view=type(self).__name__), \
+                tracer.trace("view", type(self).__name__, custom_id=interaction.custom_id):
+            await super()._scheduled_task(item, interaction)
+
     async def _edit(self, **kwargs: typing.Any) -> None:
         if self.interaction is None and self.message is not None:
             await self.message.edit(**kwargs)
@@ -53,90 +62,133 @@ class BaseView(discord.ui.View):
         self.stop()
 
 
-class GameJoinView(BaseView):
-    def __init__(self, table: Table, store: Store):
-        self.table_id = table.id
-        self.store = store
+class GameJoinView(discord.ui.View):
+    def __init__(self, table: Table | None, table_id: str | None = None):
+        table_id = table.id if table else table_id
         super().__init__(timeout=None)
 
         join = discord.ui.Button(
-            custom_id=f"{table.id}-join", label="Join", style=discord.ButtonStyle.blurple)
-        join.callback = self.join_callback
+            custom_id=f"{table_id}-join", label="Join", style=discord.ButtonStyle.blurple)
         self.add_item(join)
 
         leave = discord.ui.Button(
-            custom_id=f"{table.id}-leave", label="Leave", style=discord.ButtonStyle.blurple)
-        leave.callback = self.leave_callback
+            custom_id=f"{table_id}-leave", label="Leave", style=discord.ButtonStyle.blurple)
         self.add_item(leave)
 
         remove_button = discord.ui.Button(emoji="❌",
-            custom_id=f"{table.id}-remove", style=discord.ButtonStyle.blurple)
-        remove_button.callback = self.remove_callback
+            custom_id=f"{table_id}-remove", style=discord.ButtonStyle.blurple)
         self.add_item(remove_button)
 
-    async def update(self, interaction: discord.Interaction):
-        table = self.store.get_table(self.table_id)
-        if not table:
+        if table is None:
             self.disable_all_items()
-            self.stop()
-            await self._edit(content="Table no longer exists", view=self)
-            return
+        elif table.game.maxplayers and len(table.players) >= table.game.maxplayers:
+            join.label = "Join waitlist"
+
+        # Clicks are dispatched by GameJoinRouter from the custom_id. Stopped,
+        # edits don't store the view, but Messageable.send always does, so
+        # whoever sends one must untrack it afterwards.
+        self.stop()
 
-        logger.debug("Update join view - %s - %d/%d", table.game.name,
-                     len(table.players), table.game.maxplayers)
-        self.children[0].disabled = len(table.players) == table.game.maxplayers
 
-        e = GameEmbed(table, list_players=True)
-        await self._edit(embed=e, view=self)
+class GameJoinRouter:
+    custom_id = re.compile(r"^(?P<table_id>[0-9a-f-]{36})-(?P<action>join|leave|remove)$")
 
-    async def join_callback(self, interaction: discord.Interaction):
-        logger.info("JOIN BUTTON for user %s - id %s",
-                    interaction.user.id, interaction.custom_id)
+    def __init__(self, store: Store):
+        self.store = store
+        self.actions = {
+            "join": self.join,
+            "leave": self.leave,
+            "remove": self.remove,
+        }
+
+    async def on_interaction(self, interaction: discord.Interaction):
+        if interaction.type != discord.InteractionType.component:
+            return
+
+        match = self.custom_id.match(interaction.custom_id or "")
+        if match is None:
+            return
+
+        table_id, action = match.group("table_id", "action")
+        logger.info("%s BUTTON for user %s - table %s",
+                    action.upper(), interaction.user.id, table_id)
+        retry_after = guard.allow(interaction.user.id, "button")
+        if retry_after:
+            metrics.inc("command_rejected_total", command=f"button {action}", reason="throttled")
+            await interaction.response.send_message(f"Slow down! Try again in {retry_after:.0f}s",
+                                                    ephemeral=True, delete_after=5)
+            return
+        try:
+            with metrics.timer("view_callback_seconds", view="GameJoinView", action=action), \
+                    tracer.trace("view", "GameJoinView", action=action, table=table_id):
+                await self.actions[action](interaction, table_id)
+        except Exception:
+            logger.error("Failed to handle %s for table %s", action, table_id, exc_info=True)
+
+    async def _edit(self, interaction: discord.Interaction, **kwargs: typing.Any) -> None:
+        try:
+            await interaction.response.edit_message(**kwargs)
+        except discord.InteractionResponded:
+            await interaction.edit_original_response(**kwargs)
+
+    async def missing(self, interaction: discord.Interaction, table_id: str):
+        await self._edit(interaction, content="Table no longer exists",
+                         view=GameJoinView(None, table_id=table_id))
+
+    # Join and leave only acknowledge the click: the store publishes the
+    # change and every message for the table is refreshed from the feed.
+    async def join(self, interaction: discord.Interaction, table_id: str):
         user = interaction.user
-        table = self.store.get_table(self.table_id)
+        table = self.store.get_table(table_id)
+        if not table:
+            await self.missing(interaction, table_id)
+            return
+        if table.event is None or table.event.status != EventStatus.OPEN:
+            await interaction.response.send_message("This meetup is closed", delete_after=5, ephemeral=True)
+            return
+
         player = self.store.get_player(user.id)
         if player is None:
             player = self.store.add_player(
                 Player(user.id, user.display_name, user.mention))
 
-        if table and player and not player.id in table.players:
+        if not player.id in table.players:
             logger.debug("user %s attempting to join table %s",
                          user.id, table.id)
             self.store.join_table(player, table)
-        await self.update(interaction=interaction)
-    
-    async def remove_callback(self, interaction: discord.Interaction):
-        logger.info("REMOVE BUTTON")
-        table = self.store.get_table(self.table_id)
+        position = self.store.get_waitlist_position(table.id, player.id)
+        if position:
+            await interaction.response.send_message(
+                f"{table.game.name} is full - you're #{position} on the waitlist and will get a message if a seat opens up",
+                ephemeral=True)
+            return
+        await interaction.response.defer()
+
+    async def remove(self, interaction: discord.Interaction, table_id: str):
+        table = self.store.get_table(table_id)
         if table and interaction.user.id == table.owner.id:
-            table = self.store.get_table(self.table_id)
             self.store.remove_table(table)
-            self.disable_all_items()
-            self.stop()
-            await self._edit(content="Table removed", view=None, embed=None)
+            await interaction.response.defer()
         else:
             await interaction.response.send_message('Only the owner can remove the table', delete_after=5, ephemeral=True)
 
-
-    async def leave_callback(self, interaction: discord.Interaction):
-        logger.info("LEAVE BUTTON for user %s - id %s",
-                    interaction.user.id, interaction.custom_id)
+    async def leave(self, interaction: discord.Interaction, table_id: str):
         user = interaction.user
-        table = self.store.get_table(self.table_id)
+        table = self.store.get_table(table_id)
         player = self.store.get_player(user.id) or Player(
             user.id, user.display_name, user.mention)
-        
+
         if not table:
-            await self.update(interaction=interaction)
+            await self.missing(interaction, table_id)
             return
 
         logger.debug("player %d table %s - players [%s]", player.id, table.id,
                      ", ".join(str(p.id) for p in table.players.values()))
-        if table and player and player.id in table.players:
+        if player.id in table.players or player.id in (p.id for p in table.waitlist):
             logger.debug("user %s attempting to leave table %s",
                          user.id, table.id)
             self.store.leave_table(player, table)
-        await self.update(interaction=interaction)
+        await interaction.response.defer()
 
 
 class GameChooseView(BaseView):
@@ -176,34 +228,61 @@ class GameListView(BaseView):
     interaction: discord.Interaction | None = None
     message: discord.Message | None = None
 
-    def __init__(self, event: Event, store: Store):
+    def __init__(self, event: Event, store: Store, timeout: int = 300):
         self.event_id = event.id
         self.store = store
-        self.tables = list(event.tables.values())
         self.index = 0
         self.choice = None
+        self.snapshot()
 
-        super().__init__(timeout=None)
+        # A dismissed picker never gets a click, the timeout ends the command waiting on it
+        super().__init__(timeout=timeout)
 
         self.children[0].disabled = True
-        self.children[1].disabled = len(self.tables) == 1
+        self.children[1].disabled = len(self.tables) <= 1
+
+    def snapshot(self):
+        self.version = self.store.get_event_version(self.event_id)
+        self.tables: list[TableSummary] = self.store.get_table_summaries(self.event_id)
+        self.embeds: dict[str, discord.Embed] = {}
+
+    def embed(self, index: int) -> discord.Embed | None:
+        table_id = self.tables[index].id
+        if table_id not in self.embeds:
+            table = self.store.get_table(table_id)
+            if table is None:
+                return None
+            self.embeds[table_id] = GameEmbed.cached(table, list_players=True)
+        return self.embeds[table_id]
+
+    def prerender(self):
+        for index in (self.index - 1, self.index + 1):
+            if 0 <= index < len(self.tables):
+                self.embed(index)
 
     async def edit_page(self, interaction: discord.Interaction):
-        event = self.store.get_event(self.event_id)
-        if not event:
+        # The snapshot is only reloaded when a join/leave/add/remove has
+        # bumped the event version since it was taken
+        version = self.store.get_event_version(self.event_id)
+        if version != self.version:
+            self.snapshot()
+
+        e = self.embed(self.index) if self.index < len(self.tables) else None
+        if e is None:
+            self.snapshot()
+            self.index = min(self.index, len(self.tables)-1)
+            e = self.embed(self.index) if self.tables else None
+        if e is None:
             await self.on_timeout()
             return
 
-        self.tables = list(event.tables.values())
-
         logger.info("index: %s - tables: %d", self.index, len(self.tables))
-        table = self.tables[self.index]
         l, r = self.children[0:2]
         l.disabled = self.index == 0
         r.disabled = self.index == len(self.tables)-1
 
-        e = GameEmbed(table, list_players=True)
         await self._edit(embed=e, view=self)
+        self.prerender()
 
     @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.blurple)
     async def previous(self, button: discord.Button, interaction: discord.Interaction):
@@ -223,8 +302,8 @@ class GameListView(BaseView):
     async def join(self, button: discord.Button, interaction: discord.Interaction):
         logger.info("JOIN BUTTON:- index: %s - tables: %d",
                     self.index, len(self.tables))
-        self.choice = self.index
-        await self._edit(content=f"You chose {self.tables[self.index].game.name}", embed=None, view=None)
+        self.choice = self.tables[self.index].id
+        await self._edit(content=f"You chose {self.tables[self.index].name}", embed=None, view=None)
 
         self.disable_all_items()
         self.stop()
@@ -241,9 +320,9 @@ class GuildSettingsView(BaseView):
     role_choice: int = None
     channel_choice: int = None
 
-    def __init__(self, store: Store):
+    def __init__(self, store: Store, timeout: int = 300):
         self.store = store
-        super().__init__(timeout=None)
+        super().__init__(timeout=timeout)
         
     async def update(self):
         if self.role_choice and self.channel_choice: